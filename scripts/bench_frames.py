@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Микро-бенчмарк нарезки аудио на фреймы: старый способ (bytes += / срезы) против FrameSlicer.
+# swig-потребителям (snowboy, APM) нужны bytes: для них сравнивается memoryview + bytes() и FrameSlicer(as_bytes).
+# Запуск: python3 scripts/bench_frames.py [секунд аудио]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from lib.frame_slicer import FrameSlicer
+
+RATE = 16000
+WIDTH = 2
+# Microphone.CHUNK сэмплов и большое чтение, как после задержки потока
+CHUNKS = (1024 * WIDTH, 32 * 1024 * WIDTH)
+FRAMES_MS = (10, 30, 150)  # APM, VAD, Snowboy
+
+
+class Legacy:
+    def __init__(self, frame_size):
+        self._sample_size = frame_size
+        self._buffer = b''
+
+    def run(self, data, detector):
+        self._buffer += data
+        buff_len = len(self._buffer)
+        read_len = (buff_len // self._sample_size) * self._sample_size
+        if read_len:
+            for step in range(0, read_len, self._sample_size):
+                detector(self._buffer[step: step + self._sample_size])
+            self._buffer = self._buffer[read_len:]
+
+
+class Sliced:
+    def __init__(self, frame_size, as_bytes=False):
+        self._slicer = FrameSlicer(frame_size, as_bytes)
+
+    def run(self, data, detector):
+        self._slicer.feed(data, detector)
+
+
+def _bytes_consumer(frame):
+    # Как swig: принимает только bytes
+    if type(frame) is not bytes:
+        raise TypeError(type(frame))
+    return frame
+
+
+def legacy_apm(slicer: Legacy, data):
+    return b''.join(chunk for chunk in _collect(slicer, data))
+
+
+def _collect(slicer, data):
+    result = []
+    slicer.run(data, lambda x: result.append(_bytes_consumer(x)))
+    return result
+
+
+def sliced_apm(slicer: FrameSlicer, data):
+    return b''.join([_bytes_consumer(frame) for frame in slicer.slice(data)])
+
+
+def bench(name, func, chunks, repeat=5):
+    # Лучший из repeat прогонов, меньше шума
+    wall, cpu = float('inf'), float('inf')
+    for _ in range(repeat):
+        start, cpu_start = time.perf_counter(), time.process_time()
+        for chunk in chunks:
+            func(chunk)
+        wall, cpu = min(wall, time.perf_counter() - start), min(cpu, time.process_time() - cpu_start)
+    per_chunk = wall / len(chunks) * 1e6
+    print('{:<28} {:>8.1f} ms, cpu {:>8.1f} ms, {:>6.2f} us/chunk'.format(name, wall * 1000, cpu * 1000, per_chunk))
+    return wall
+
+
+def main(seconds):
+    for chunk_size in CHUNKS:
+        chunk = os.urandom(chunk_size)
+        chunks = [chunk] * int(seconds * RATE * WIDTH / chunk_size)
+        print('== Audio: {} sec, {} chunks of {} bytes'.format(seconds, len(chunks), chunk_size))
+        run(chunks)
+        print()
+
+
+def run(chunks):
+    for ms in FRAMES_MS:
+        size = WIDTH * RATE * ms // 1000
+        print('-- {} ms frames ({} bytes)'.format(ms, size))
+        old = Legacy(size)
+        new = Sliced(size)
+        a = bench('legacy detector', lambda x: old.run(x, len), chunks)
+        b = bench('FrameSlicer detector', lambda x: new.run(x, len), chunks)
+        print('{:<28} x{:.2f}'.format('speedup', a / b))
+        # Потребитель bytes: legacy отдает bytes как есть
+        old = Legacy(size)
+        view = Sliced(size)
+        raw = Sliced(size, True)
+        a = bench('legacy bytes detector', lambda x: old.run(x, _bytes_consumer), chunks)
+        bench('memoryview + bytes()', lambda x: view.run(x, lambda f: _bytes_consumer(bytes(f))), chunks)
+        b = bench('FrameSlicer as_bytes', lambda x: raw.run(x, _bytes_consumer), chunks)
+        print('{:<28} x{:.2f}'.format('speedup as_bytes', a / b))
+    size = WIDTH * RATE * 10 // 1000
+    print('-- APM convert, 10 ms frames')
+    old = Legacy(size)
+    new = FrameSlicer(size, True)
+    a = bench('legacy join', lambda x: legacy_apm(old, x), chunks)
+    b = bench('FrameSlicer as_bytes join', lambda x: sliced_apm(new, x), chunks)
+    print('{:<28} x{:.2f}'.format('speedup', a / b))
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 600)
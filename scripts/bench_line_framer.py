@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Микро-бенчмарк чтения длинной строки из сокета: старый Connect (bytes += / split) против LineFramer.
+# Запуск: python3 scripts/bench_line_framer.py [размеры строк в МБ]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from lib.line_framer import LineFramer
+
+CRLF = b'\r\n'
+OLD_CHUNK = 1024 * 4
+NEW_CHUNK = 1024 * 64
+SIZES = (1, 10, 50)
+
+
+def legacy(chunks):
+    data = b''
+    lines = []
+    for chunk in chunks:
+        data += chunk
+        while CRLF in data:
+            line, data = data.split(CRLF, 1)
+            lines.append(line)
+    return lines
+
+
+def framed(chunks):
+    framer = LineFramer(1024 * 1024 * 1024)
+    lines = []
+    for chunk in chunks:
+        framer.feed(chunk)
+        lines.extend(framer.lines())
+    return lines
+
+
+def chunked(data, size):
+    view = memoryview(data)
+    return [view[pos:pos + size] for pos in range(0, len(data), size)]
+
+
+def bench(name, func, chunks):
+    start, cpu = time.perf_counter(), time.process_time()
+    lines = func(chunks)
+    wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+    print('{:<28} {:>10.1f} ms, cpu {:>10.1f} ms'.format(name, wall * 1000, cpu * 1000))
+    return wall, lines
+
+
+def main(sizes):
+    for size in sizes:
+        # base64 модели: одна длинная строка и пара коротких команд вокруг
+        data = b'ping:1\r\nsend_model:' + b'A' * int(size * 1024 * 1024) + b'\r\nping:2\r\n\r\n'
+        print('== Line {} MB'.format(size))
+        a, old = bench('legacy 4 KiB recv', legacy, chunked(data, OLD_CHUNK))
+        b, new = bench('LineFramer 64 KiB recv', framed, chunked(data, NEW_CHUNK))
+        assert old == new, 'Results differ'
+        print('{:<28} x{:.2f}'.format('speedup', a / b))
+        print()
+
+
+if __name__ == '__main__':
+    main([float(x) for x in sys.argv[1:]] or SIZES)
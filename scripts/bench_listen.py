@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# Прогон тракта прослушивания на записях: ключевое слово -> конец речи -> текст.
+# Запуск: python3 scripts/bench_listen.py [--models model1.pmdl ...] [--stt google] [--speed 1] file1.wav ...
+# Без --models фраза ищется по energy_threshold, как в SpeechToText._block_listen.
+
+import argparse
+import audioop
+import os
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import lib.sr_wrapper as sr
+from lib.replay import ReplayMicrophone
+from utils import EnergyControl
+
+HOME = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+SPEECH_FRAME_MS = 30
+
+
+class _Cfg:
+    # Минимум от ConfigHandler для EnergyControl
+    def __init__(self, energy_threshold):
+        self._energy_threshold = energy_threshold
+
+    def gts(self, key, default=None):
+        return self._energy_threshold if key == 'energy_threshold' else default
+
+
+def speech_end(path, threshold) -> float or None:
+    # Конец речи в записи по энергии, секунды от начала файла
+    if path.startswith('tcp://'):
+        return None
+    with wave.open(path, 'rb') as fp:
+        width, rate = fp.getsampwidth(), fp.getframerate()
+        data = fp.readframes(fp.getnframes())
+        if fp.getnchannels() > 1:
+            data = audioop.tomono(data, width, 0.5, 0.5)
+    step = width * (rate * SPEECH_FRAME_MS // 1000)
+    end = 0
+    for pos in range(0, len(data) - step + 1, step):
+        if audioop.rms(data[pos:pos + step], width) > threshold:
+            end = pos + step
+    return end / (width * rate)
+
+
+class Run:
+    def __init__(self, args):
+        self._args = args
+        self._energy = EnergyControl(_Cfg(args.energy), lambda: False)
+        self._events = {}
+        self._raw = None
+
+    def _mark(self, name):
+        self._events[name] = (time.perf_counter(), self._raw.seconds)
+
+    def _record_callback(self, start):
+        if not start:
+            self._mark('eos')
+
+    def _recognize(self, adata, *_):
+        if isinstance(adata, sr.StreamRecognition):
+            adata = adata.get_audio_data()
+        if not self._args.stt:
+            return ''
+        from lib import STT
+        key = self._args.key.split(',') if self._args.key and ',' in self._args.key else self._args.key
+        return STT.GetSTT(self._args.stt, audio_data=adata, key=key, lang=self._args.lang).text()
+
+    def __call__(self, path):
+        args = self._args
+        self._events.clear()
+        r = sr.Recognizer(
+            sensitivity=args.sensitivity, hotword_callback=lambda: self._mark('hotword'),
+            record_callback=self._record_callback
+        )
+        if args.vad:
+            r.no_energy_threshold()
+            r.use_webrtcvad(args.vad)
+        snowboy = (args.home, args.models) if args.models else None
+        text, error = '', None
+        cpu = time.process_time()
+        with ReplayMicrophone([args.lead, path], args.speed, args.tail) as source:
+            self._raw = source.raw
+            self._mark('start')
+            if not args.models:
+                self._energy.correct(r, source)
+            try:
+                if args.listen2:
+                    adata = r.listen2(source, 5, args.limit, snowboy, self._recognize)
+                else:
+                    adata = r.listen(source, 5, args.limit, snowboy)
+            except (sr.WaitTimeoutError, sr.Interrupted) as e:
+                adata, error = None, repr(e)
+        if adata is not None:
+            try:
+                text = adata.text if args.listen2 else self._recognize(adata)
+            except (RuntimeError, sr.UnknownValueError, sr.RequestError) as e:
+                error = repr(e)
+        self._mark('text')
+        cpu = time.process_time() - cpu
+        return self._report(path, text, error, cpu)
+
+    def _report(self, path, text, error, cpu):
+        start_wall, _ = self._events['start']
+        end = speech_end(path, self._args.threshold)
+        result = {'file': os.path.basename(path), 'cpu': cpu, 'audio': self._raw.seconds, 'text': text, 'error': error}
+        if 'hotword' in self._events:
+            result['hotword'] = self._events['hotword'][1]
+        if 'eos' in self._events:
+            wall, audio = self._events['eos']
+            if end is not None:
+                # Насколько позже реального конца речи закончилась запись (в секундах аудио)
+                result['eos_delay'] = audio - end - self._args.lead
+            result['text_latency'] = self._events['text'][0] - wall
+        result['total'] = self._events['text'][0] - start_wall
+        return result
+
+
+def _fmt(value):
+    return '{:7.3f}'.format(value) if isinstance(value, float) else '{:>7}'.format('-')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay WAV files through Recognizer and report latencies')
+    parser.add_argument('files', nargs='+', help='WAV files, or tcp://host:port for raw 16k s16le PCM')
+    parser.add_argument('--models', nargs='*', default=[], help='snowboy models, hotword is required if set')
+    parser.add_argument('--home', default=HOME, help='path with resources/common.res')
+    parser.add_argument('--sensitivity', type=float, default=0.45)
+    parser.add_argument('--vad', type=int, default=0, help='with --models: webrtcvad (1-4) instead of energy threshold')
+    parser.add_argument('--listen2', action='store_true', help='streaming recognition (SnowBoySR4)')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 - real time, 0 - as fast as possible')
+    parser.add_argument('--lead', type=float, default=1.5, help='seconds of silence before each file')
+    parser.add_argument('--tail', type=float, default=2.0, help='seconds of silence after each file')
+    parser.add_argument('--limit', type=float, default=15, help='phrase_time_limit')
+    parser.add_argument('--energy', type=int, default=-1, help='energy_threshold, as in settings')
+    parser.add_argument('--threshold', type=int, default=500, help='rms level of speech for end-of-speech mark')
+    parser.add_argument('--stt', default='', help='STT provider, without it only listening is measured')
+    parser.add_argument('--key', default='', help='STT key, comma separated for pairs')
+    parser.add_argument('--lang', default='ru-RU')
+    args = parser.parse_args()
+    if args.listen2 and not args.models:
+        parser.error('--listen2 requires --models')
+
+    run = Run(args)
+    print('{:<24} {:>7} {:>7} {:>7} {:>7} {:>7} {:>7}  {}'.format(
+        'file', 'hotword', 'eos', 'stt', 'total', 'cpu', 'rtf', 'text'))
+    results = []
+    for path in args.files:
+        result = run(path)
+        results.append(result)
+        print('{:<24} {} {} {} {} {} {}  {}'.format(
+            result['file'][:24], _fmt(result.get('hotword')), _fmt(result.get('eos_delay')),
+            _fmt(result.get('text_latency')), _fmt(result['total']), _fmt(result['cpu']),
+            _fmt(result['cpu'] / result['audio'] if result['audio'] else None),
+            result['error'] or repr(result['text'])
+        ))
+    done = [x for x in results if 'text_latency' in x]
+    if done:
+        delays = [x['eos_delay'] for x in done if 'eos_delay' in x]
+        print('mean eos delay {} s, mean stt latency {:.3f} s, cpu {:.3f} s on {:.1f} s of audio'.format(
+            _fmt(sum(delays) / len(delays) if delays else None).strip(),
+            sum(x['text_latency'] for x in done) / len(done),
+            sum(x['cpu'] for x in results), sum(x['audio'] for x in results)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,12 @@ import sys
 import socket
 
 
-def log(ip, port):
+def log(ip, port, options=''):
+    # options: raw;lvl=warn;name=Server,STT
     crlf = b'\r\n'
     client = socket.create_connection((ip, port))
-    client.send(b'remote_log' + crlf * 2)
+    cmd = 'remote_log:{}'.format(options) if options else 'remote_log'
+    client.send(cmd.encode() + crlf * 2)
     data = b''
     chunk = True
     while chunk:
@@ -21,4 +23,8 @@ def log(ip, port):
 
 
 if __name__ == '__main__':
-    log(sys.argv[1] if len(sys.argv) > 1 else '127.0.0.1', int(sys.argv[2]) if len(sys.argv) > 2 else 7999)
+    log(
+        sys.argv[1] if len(sys.argv) > 1 else '127.0.0.1',
+        int(sys.argv[2]) if len(sys.argv) > 2 else 7999,
+        sys.argv[3] if len(sys.argv) > 3 else ''
+    )
@@ -205,6 +205,10 @@ class TestShell(cmd__.Cmd):
         """Запросить модель у терминала. Аргументы: имя файла"""
         self._send('recv_model:{}'.format(filename))
 
+    def do_flight_log(self, arg):
+        """Бортовой самописец логгера. Аргументы: file - сохранить в файл на терминале"""
+        self._send('flight_log:file' if arg == 'file' else 'flight_log')
+
     def do_log(self,_):
         """Подключает удаленного логгера к терминалу. Аргументы: нет"""
         self._send('remote_log', True)
@@ -27,6 +27,8 @@ class ConfigHandler(dict):
         self._log = self.__print  # Тут будет логгер
         self._to_tts = []  # Пока player нет храним фразы тут.
         self._to_log = []  # А тут принты в лог
+        # Конфиг меняют сервер, терминал и модули из разных потоков - изменения и запись по одному
+        self._lock = threading.RLock()
         self._config_init()
 
     def __print(self, msg, lvl):
@@ -73,18 +75,31 @@ class ConfigHandler(dict):
         else:
             return 1
 
-    def model_info_by_id(self, model: int):
-        model -= 1
-        if model < len(self.path['models_list']):
-            model_name = os.path.split(self.path['models_list'][model])[1]
-            phrase = self.gt('models', model_name, '')
-            msg = '' if not phrase else ': "{}"'.format(phrase)
+    def model_info_by_id(self, model: int or str):
+        # Индекс модели (с 1) или путь до нее
+        if isinstance(model, str):
+            model_name = os.path.split(model)[1]
+        elif 0 < model <= len(self.path['models_list']):
+            model_name = os.path.split(self.path['models_list'][model - 1])[1]
         else:
-            model_name = str(model)
-            phrase = ''
-            msg = ''
+            return str(model - 1), '', ''
+        phrase = self.gt('models', model_name, '')
+        msg = '' if not phrase else ': "{}"'.format(phrase)
         return model_name, phrase, msg
 
+    def model_sensitivity(self, path: str) -> float:
+        # Чувствительность для модели из [sensitivity] или общая из settings
+        default = self.gts('sensitivity')
+        value = self.gt('sensitivity', os.path.split(path)[1])
+        try:
+            value = float(value) if value is not None else default
+        except (TypeError, ValueError):
+            value = default
+        return min(1.0, max(0.0, value))
+
+    def models_sensitivity(self) -> list:
+        return [self.model_sensitivity(path) for path in self.path['models_list']]
+
     def gt(self, sec, key, default=None):
         # .get для саб-словаря
         return self.get(sec, {}).get(key, default)
@@ -124,11 +139,12 @@ class ConfigHandler(dict):
     def allow_connect(self, ip: str) -> bool:
         if ip == '127.0.0.1':
             return True
-        if not self['majordomo'].get('ip') and self.gts('first_love'):
-            self['majordomo']['ip'] = ip
-            self.config_save()
-        if self.gts('last_love') and ip != self['majordomo'].get('ip'):
-            return False
+        with self._lock:
+            if not self['majordomo'].get('ip') and self.gts('first_love'):
+                self['majordomo']['ip'] = ip
+                self.config_save()
+            if self.gts('last_love') and ip != self['majordomo'].get('ip'):
+                return False
         return True
 
     def is_model_name(self, filename: str) -> bool:
@@ -250,18 +266,21 @@ class ConfigHandler(dict):
         wtime = time.time()
 
         config = ConfigParserOnOff()
-        for key, val in self.items():
-            if isinstance(val, dict):
-                config[key] = val
+        with self._lock:
+            for key, val in self.items():
+                if isinstance(val, dict):
+                    config[key] = val
 
-        with open(self.path['settings'], 'w') as configfile:
-            config.write(configfile)
+            with open(self.path['settings'], 'w') as configfile:
+                config.write(configfile)
         self._print(LNG['save_for'].format(utils.pretty_time(time.time() - wtime)), logger.INFO)
         self._print(LNG['save'], mode=2)
 
     def models_load(self):
-        self.path['models_list'] = []
+        # Список подменяется целиком - его читает слушающий поток
+        models_list = []
         if not os.path.isdir(self.path['models']):
+            self.path['models_list'] = models_list
             self._print(LNG['miss_models'].format(self.path['models']), logger.INFO, 3)
             return
 
@@ -271,9 +290,10 @@ class ConfigHandler(dict):
             full_path = os.path.join(self.path['models'], file)
             if os.path.isfile(full_path):
                 if not allow or file in allow:
-                    self.path['models_list'].append(full_path)
+                    models_list.append(full_path)
                     count += 1
 
+        self.path['models_list'] = models_list
         self._print(LNG['models_count_call'].format(count), logger.INFO, 3)
 
     def config_load(self):
@@ -299,10 +319,11 @@ class ConfigHandler(dict):
 
     def update_from_json(self, data: str) -> dict or None:
         cu = ConfigUpdater(self, self._print)
-        if cu.from_json(data):
-            return cu.diff
-        else:
-            return None
+        with self._lock:
+            if cu.from_json(data):
+                return cu.diff
+            else:
+                return None
 
     def print_cfg_change(self):
         self._print(LNG['cfg_up'])
@@ -311,7 +332,8 @@ class ConfigHandler(dict):
         self._print(LNG['cfg_no_change'])
 
     def update_from_dict(self, data: dict) -> bool:
-        return self._cfg_update(ConfigUpdater(self, self._print).from_dict(data))
+        with self._lock:
+            return self._cfg_update(ConfigUpdater(self, self._print).from_dict(data))
 
     def _cfg_update(self, result: int):
         if result:
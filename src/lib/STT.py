@@ -2,13 +2,12 @@
 import hashlib
 import json
 import time
-from io import BytesIO
 
 import requests
 
 import lib.streaming_converter as streaming_converter
 from utils import REQUEST_ERRORS, RuntimeErrorTrace
-from .audio_utils import StreamRecognition
+from .audio_utils import StreamRecognition, AudioBuffer
 from .keys_utils import requests_post, xml_yandex
 from .proxy import proxies
 from .sr_wrapper import google_reply_parser, UnknownValueError, Recognizer, AudioData, RequestError
@@ -30,9 +29,9 @@ class BaseSTT:
         if ext in streaming_converter.CMD or isinstance(audio_data, StreamRecognition):
             self._data = streaming_converter.AudioConverter(audio_data, ext, convert_rate, convert_width)
         elif ext == 'wav':
-            self._data = BytesIO(audio_data.get_wav_data(convert_rate, convert_width))
+            self._data = AudioBuffer.from_audio_data(audio_data).iter_wav(convert_rate, convert_width)
         elif ext == 'pcm':
-            self._data = BytesIO(audio_data.get_raw_data(convert_rate, convert_width))
+            self._data = AudioBuffer.from_audio_data(audio_data).iter_raw(convert_rate, convert_width)
         else:
             raise RuntimeError('Unknown format: {}'.format(ext))
 
@@ -41,6 +40,10 @@ class BaseSTT:
         self._parse_response()
 
     def _chunks(self):
+        if not isinstance(self._data, streaming_converter.AudioConverter):
+            # wav и pcm отдаем прямо из фреймов
+            yield from self._data
+            return
         chunk = True
         with self._data as fp:
             while chunk:
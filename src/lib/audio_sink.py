@@ -0,0 +1,356 @@
+import audioop
+import queue
+import subprocess
+import threading
+import time
+import wave
+
+import logger
+
+try:
+    import pyaudio
+except ImportError as e:
+    pyaudio = None
+    PYAUDIO_ERR = 'Error importing pyaudio: {}'.format(e)
+else:
+    PYAUDIO_ERR = None
+
+DECODE_ERRORS = (RuntimeError, OSError, EOFError, wave.Error, audioop.error)
+
+
+class Playback:
+    """
+    Один звук в AudioSink. Интерфейс как у linux_play.Popen (poll, wait, kill) - плеер не видит разницы.
+    """
+    def __init__(self, ext, target, stream, callback, pcm=None, parts=None):
+        self.ext = ext
+        self.target = target
+        self.stream = stream
+        self.callback = callback
+        # Уже декодированный звук (RATE, WIDTH, моно), target тогда только имя
+        self.pcm = pcm
+        # Цепочка: итератор (ext, target, stream) частей, играющих подряд без пауз
+        self.parts = parts
+        # Текущая часть цепочки
+        self.part = None
+        self.created = time.time()
+        # Время до первого сэмпла в устройстве, None если до звука не дошло
+        self.ttfs = None
+        self.cancelled = False
+        self.error = None
+        self._started = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def name(self) -> str:
+        return self.target if not self.stream else '<stream{}>'.format(self.ext)
+
+    def poll(self):
+        return None if not self._done.is_set() else (0 if self.error is None else 1)
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise subprocess.TimeoutExpired(self.name, timeout)
+        return self.poll()
+
+    def kill(self):
+        with self._lock:
+            self.cancelled = True
+            started = self._started
+        if not started:
+            # Еще в очереди, сток его пропустит - ждать нечего
+            self.finish()
+            return
+        current = self.part or self
+        if current.stream:
+            # Разблокируем чтение из потока
+            current.target.write(b'')
+        self._done.wait(5)
+
+    def start(self) -> bool:
+        # Вызывает сток перед воспроизведением. False - уже отменен
+        with self._lock:
+            self._started = not self.cancelled
+            return self._started
+
+    def first_sample(self):
+        if self.ttfs is None:
+            self.ttfs = time.time() - self.created
+
+    def finish(self, error=None):
+        # Может позвать и сток, и kill - завершаем один раз
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.error = error
+            self._done.set()
+        if self.callback:
+            self.callback(False)
+
+
+class AudioSink(threading.Thread):
+    """
+    Постоянно открытое устройство вывода. Звуки декодируются в PCM (моно, 16 бит, RATE) и пишутся
+    в один и тот же поток pyaudio, без запуска aplay и открытия ALSA на каждое воспроизведение.
+    wav декодируется в процессе, mp3 и opus - mpg123 и opusdec, вывод которых идет в то же устройство.
+    Декодер mp3/opus по-прежнему запускается на каждый звук: opusdec декодирует один поток за запуск,
+    а в режиме -R mpg123 не отделяет PCM соседних файлов в stdout. Постоянным стало только устройство.
+    """
+    RATE = 24000
+    WIDTH = 2
+    CHUNK = 1024 * 4
+    POPEN_TIMEOUT = 5
+
+    def __init__(self, log, device_index=None, reference=None):
+        if PYAUDIO_ERR:
+            raise RuntimeError(PYAUDIO_ERR)
+        super().__init__(name='AudioSink')
+        self.log = log
+        self._queue = queue.Queue()
+        self._audio = pyaudio.PyAudio()
+        try:
+            self._stream = self._audio.open(
+                format=self._audio.get_format_from_width(self.WIDTH), channels=1, rate=self.RATE,
+                output=True, output_device_index=device_index, frames_per_buffer=self.CHUNK // self.WIDTH
+            )
+        except Exception as e:
+            self._audio.terminate()
+            raise RuntimeError('Error opening output device: {}'.format(e))
+        # Получатель опорного сигнала для эхоподавления (APMReverseStream)
+        self._reference = reference
+        self._work = True
+        # play после stop не должен попасть в очередь, которую уже никто не разберет
+        self._lock = threading.Lock()
+        self._count = 0
+        self._ttfs_sum = 0.0
+
+    def play(self, ext, target, stream: bool, callback=None) -> Playback:
+        return self._put(Playback(ext, target, stream, callback))
+
+    def play_pcm(self, name, pcm: bytes, callback=None) -> Playback:
+        return self._put(Playback('.pcm', name, False, callback, pcm))
+
+    def play_chain(self, parts, callback=None) -> Playback:
+        return self._put(Playback('.chain', '<chain>', False, callback, parts=parts))
+
+    def _put(self, playback: Playback) -> Playback:
+        with self._lock:
+            if self._work:
+                self._queue.put_nowait(playback)
+                return playback
+        playback.kill()
+        return playback
+
+    def decode(self, ext, path) -> bytes:
+        # Декодирует файл целиком в PCM для play_pcm
+        decoder = self._decoder(Playback(ext, path, False, None))
+        try:
+            return b''.join(decoder)
+        except DECODE_ERRORS as e:
+            raise RuntimeError('Error decoding {}: {}'.format(path, e))
+        finally:
+            decoder.close()
+
+    def stop(self):
+        with self._lock:
+            self._work = False
+            self._queue.put_nowait(None)
+        self.join()
+        # Не начатые звуки завершаем, иначе их wait не вернется никогда
+        while True:
+            try:
+                playback = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if playback is not None:
+                playback.kill()
+        try:
+            self._stream.close()
+        finally:
+            self._audio.terminate()
+
+    @property
+    def reference(self):
+        return self._reference
+
+    @property
+    def metrics(self) -> dict:
+        return {'count': self._count, 'ttfs': self._ttfs_sum / self._count if self._count else 0.0}
+
+    def run(self):
+        while self._work:
+            playback = self._queue.get()
+            if playback is None:
+                break
+            error = None
+            try:
+                if playback.start():
+                    self._playing(playback)
+            except Exception as e:
+                # Любая ошибка тут убила бы поток, а с ним и все ожидающие wait
+                error = e
+                self.log('Error playing {}: {}'.format(playback.name, e), logger.ERROR)
+            finally:
+                try:
+                    playback.finish(error)
+                except Exception as e:
+                    self.log('Playback callback {} failed: {}'.format(playback.name, e), logger.ERROR)
+
+    def _playing(self, playback: Playback):
+        decoder = self._decoder(playback)
+        try:
+            for chunk in decoder:
+                if playback.cancelled or not self._work:
+                    break
+                if not chunk:
+                    continue
+                if playback.ttfs is None:
+                    playback.first_sample()
+                    self._count += 1
+                    self._ttfs_sum += playback.ttfs
+                    msg = 'Play {}: first sample in {} ms'.format(playback.name, int(playback.ttfs * 1000))
+                    self.log(msg, logger.DEBUG)
+                self._stream.write(chunk)
+                if self._reference:
+                    self._reference.process(chunk)
+        finally:
+            decoder.close()
+
+    def _decoder(self, playback: Playback):
+        if playback.pcm is not None:
+            return self._pcm_decoder(playback.pcm)
+        if playback.parts is not None:
+            return self._chain_decoder(playback)
+        if playback.ext == '.wav':
+            fp = _StreamReader(playback.target) if playback.stream else open(playback.target, 'rb')
+            return self._wav_decoder(fp)
+        return self._popen_decoder(playback)
+
+    def _chain_decoder(self, playback: Playback):
+        # Части идут в устройство одна за другой, следующая декодируется сразу после предыдущей
+        for ext, target, stream in playback.parts:
+            if playback.cancelled:
+                break
+            playback.part = Playback(ext, target, stream, None)
+            try:
+                yield from self._decoder(playback.part)
+            except DECODE_ERRORS as e:
+                self.log('Error playing {}: {}'.format(playback.part.name, e), logger.ERROR)
+
+    def _pcm_decoder(self, pcm: bytes):
+        for start in range(0, len(pcm), self.CHUNK):
+            yield pcm[start:start + self.CHUNK]
+
+    def _wav_decoder(self, fp):
+        try:
+            with wave.open(fp, 'rb') as wav:
+                converter = _Converter(wav.getsampwidth(), wav.getnchannels(), wav.getframerate(), self.RATE)
+                frames = self.CHUNK // self.WIDTH
+                while True:
+                    data = wav.readframes(frames)
+                    if not data:
+                        break
+                    yield converter(data)
+        finally:
+            fp.close()
+
+    def _popen_decoder(self, playback: Playback):
+        source = '-' if playback.stream else playback.target
+        if playback.ext == '.mp3':
+            cmd = ['mpg123', '-q', '-s', '-m', '-r', str(self.RATE), '-e', 's16', source]
+        elif playback.ext == '.opus':
+            cmd = ['opusdec', '--quiet', '--rate', str(self.RATE), '--force-wav', source, '-']
+        else:
+            raise RuntimeError('Unknown type: {}'.format(playback.ext))
+        popen = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE if playback.stream else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        feeder = _Feeder(playback.target, popen.stdin) if playback.stream else None
+        try:
+            if playback.ext == '.opus':
+                yield from self._wav_decoder(popen.stdout)
+            else:
+                while True:
+                    chunk = popen.stdout.read(self.CHUNK)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            if popen.poll() is None:
+                popen.kill()
+            popen.stdout.close()
+            try:
+                popen.wait(self.POPEN_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                pass
+            if feeder:
+                feeder.join(self.POPEN_TIMEOUT)
+
+
+class _Converter:
+    def __init__(self, width, channels, rate, target_rate):
+        self._width = width
+        self._channels = channels
+        self._rate = rate
+        self._target_rate = target_rate
+        self._state = None
+
+    def __call__(self, data: bytes) -> bytes:
+        if self._width == 1:
+            data = audioop.bias(data, 1, -128)
+        if self._channels == 2:
+            data = audioop.tomono(data, self._width, 0.5, 0.5)
+        if self._width != AudioSink.WIDTH:
+            data = audioop.lin2lin(data, self._width, AudioSink.WIDTH)
+        if self._rate != self._target_rate:
+            data, self._state = audioop.ratecv(data, AudioSink.WIDTH, 1, self._rate, self._target_rate, self._state)
+        return data
+
+
+class _StreamReader:
+    # Файловый интерфейс поверх FakeFP (read отдает чанки, b'' - конец) для модуля wave
+    def __init__(self, fp):
+        self._fp = fp
+        self._buffer = b''
+        self._eof = False
+
+    def read(self, size=-1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._fp.read()
+            if not chunk:
+                self._eof = True
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        pass
+
+
+class _Feeder(threading.Thread):
+    # Поток из TTS в stdin декодера
+    def __init__(self, fp, stdin):
+        super().__init__(name='AudioSinkFeeder')
+        self._fp = fp
+        self._stdin = stdin
+        self.start()
+
+    def run(self):
+        try:
+            while True:
+                chunk = self._fp.read()
+                if not chunk:
+                    break
+                self._stdin.write(chunk)
+        except (BrokenPipeError, ValueError, OSError):
+            pass
+        finally:
+            try:
+                self._stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
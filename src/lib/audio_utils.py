@@ -1,13 +1,16 @@
 import audioop
 import collections
 import os
+import struct
 import threading
 import time
 from functools import lru_cache
 
 from speech_recognition import Microphone, AudioData
 
+import logger
 from lib import snowboydetect
+from lib.frame_slicer import FrameSlicer
 from utils import singleton, is_int
 
 try:
@@ -36,6 +39,8 @@ class APMSettings:
             'agc_lvl': None,
             'agc_target': None,
         }
+        # APM общий для микрофона и опорного сигнала (AEC), swig-обертка не потокобезопасна
+        self.lock = threading.Lock()
 
     def cfg(self, **kwargs):
         # https://github.com/xiongyihui/python-webrtc-audio-processing/blob/master/src/audio_processing_module.cpp
@@ -67,6 +72,10 @@ class APMSettings:
     def enable(self):
         return not APM_ERR and self._cfg['enable']
 
+    @property
+    def aec(self):
+        return self.enable and self._cfg['aec_type'] > 0
+
     @property
     def conservative(self):
         return self._cfg['conservative']
@@ -104,6 +113,36 @@ class APMSettings:
         return ap
 
 
+class APMReverseStream:
+    """
+    Опорный сигнал для эхоподавления: то, что сейчас уходит в динамик.
+    Передается в тот же APM, что чистит микрофон, приводится к формату микрофона.
+    """
+    def __init__(self, width, rate, mic_rate=16000):
+        self._ap = None
+        self._lock = APMSettings().lock
+        self._width = width
+        self._rate = rate
+        self._mic_rate = mic_rate
+        self._state = None
+        self._slicer = FrameSlicer(2 * int(mic_rate * 10 / 1000), True)
+
+    def process(self, data: bytes):
+        if not APMSettings().aec:
+            return
+        if self._width != 2:
+            data = audioop.lin2lin(data, self._width, 2)
+        if self._rate != self._mic_rate:
+            data, self._state = audioop.ratecv(data, 2, 1, self._rate, self._mic_rate, self._state)
+        with self._lock:
+            # APM мог быть пересоздан после изменения настроек
+            ap = APMSettings().instance
+            if ap is not self._ap:
+                self._ap = ap
+                self._ap.set_reverse_stream_format(self._mic_rate, 1)
+            self._slicer.feed(data, self._ap.process_reverse_stream)
+
+
 class MicrophoneStream(Microphone.MicrophoneStream):
     def deactivate(self):
         pass
@@ -117,10 +156,11 @@ class MicrophoneStreamAPM(MicrophoneStream):
     def __init__(self, pyaudio_stream, width, rate, conservative):
         super().__init__(pyaudio_stream)
         self._ap = APMSettings().instance
+        self._lock = APMSettings().lock
         self._conservative = conservative
         self._ap.set_stream_format(rate, 1)
-        self._buffer = b''
-        self._sample_size = width * int(rate * 10 / 1000)
+        # APM (swig) принимает только bytes
+        self._slicer = FrameSlicer(width * int(rate * 10 / 1000), True)
         self._active = True
 
     def read(self, size):
@@ -128,16 +168,8 @@ class MicrophoneStreamAPM(MicrophoneStream):
         return self._convert(data) if self._active else data
 
     def _convert(self, data):
-        return b''.join(chunk for chunk in self._reader(data))
-
-    def _reader(self, data: bytes):
-        self._buffer += data
-        buff_len = len(self._buffer)
-        read_len = (buff_len // self._sample_size) * self._sample_size
-        if read_len:
-            for step in range(0, read_len, self._sample_size):
-                yield self._ap.process_stream(self._buffer[step: step + self._sample_size])
-            self._buffer = self._buffer[read_len:]
+        with self._lock:
+            return b''.join([self._ap.process_stream(frame) for frame in self._slicer.slice(data)])
 
     def deactivate(self):
         if self._conservative:
@@ -146,8 +178,8 @@ class MicrophoneStreamAPM(MicrophoneStream):
     def reactivate(self, chunks):
         if not self._active:
             self._active = True
-            if self._buffer:
-                raise RuntimeError('buffer {}'.format(len(self._buffer)))
+            if len(self._slicer):
+                raise RuntimeError('buffer {}'.format(len(self._slicer)))
             return collections.deque(self._convert(chunk) for chunk in chunks)
         return chunks
 
@@ -157,9 +189,9 @@ class Detector:
         self._resample_rate = resample_rate
         self._rate = rate
         self._width = width
-        self._sample_size = int(width * (self._resample_rate * duration / 1000))
+        # snowboy и APM (swig) принимают только bytes, а на чтениях по 1024 сэмпла срезы bytes быстрее memoryview
+        self._slicer = FrameSlicer(int(width * (self._resample_rate * duration / 1000)), True)
         self._resample_state = None
-        self._buffer = b''
         self._state = False
         if self._rate == self._resample_rate:
             self._resampler = lambda x: x
@@ -174,13 +206,7 @@ class Detector:
         pass
 
     def _call_detector(self, data: bytes):
-        self._buffer += data
-        buff_len = len(self._buffer)
-        read_len = (buff_len // self._sample_size) * self._sample_size
-        if read_len:
-            for step in range(0, read_len, self._sample_size):
-                self._detector(self._buffer[step: step + self._sample_size])
-            self._buffer = self._buffer[read_len:]
+        self._slicer.feed(data, self._detector)
 
     def _audio_resampler(self, buffer: bytes) -> bytes:
         buffer, self._resample_state = audioop.ratecv(
@@ -191,13 +217,22 @@ class Detector:
 
 class SnowboyDetector(Detector):
     def __init__(self, resource_path, snowboy_hot_word_files, sensitivity, audio_gain, width, rate, webrtcvad):
-        self._snowboy = SnowboyDetector._constructor(resource_path, sensitivity, audio_gain, *snowboy_hot_word_files)
-        super().__init__(150, width, rate, self._snowboy.SampleRate())
+        self._models = SnowboyModels()
+        # Если модели изменились, новые загрузятся в фоне, а пока слушаем старыми
+        self._models.configure(resource_path, snowboy_hot_word_files, sensitivity, audio_gain, background=True)
+        if self._models.current is None:
+            # Первая загрузка еще идет в другом потоке или не удалась
+            raise RuntimeError('Snowboy models are not loaded')
+        super().__init__(150, width, rate, self._models.current.sample_rate)
         webrtcvad = min(4, max(0, webrtcvad))
         webrtcvad = webrtcvad if Vad else 0
 
         self._current_state = -2
+        self._only_detect = False
+        self._found = False
         self._another = DetectorVAD(width, self._resample_rate, webrtcvad - 1) if webrtcvad else None
+        # Путь до сработавшей модели, индекс мог устареть если модели поменялись
+        self.model_path = None
 
     def detect(self, buffer: bytes) -> int:
         return self._detector(buffer)
@@ -206,35 +241,139 @@ class SnowboyDetector(Detector):
         return self._detector(buffer, True) >= 0
 
     def _detector(self, buffer: bytes, only_detect=False) -> int:
-        self._buffer += self._resampler(buffer)
-        if len(self._buffer) >= self._sample_size:
-            if self._another:
-                is_speech = self._another.is_speech(self._buffer)
-                if only_detect or not is_speech:
-                    self._current_state = 0 if is_speech else -2
-                elif is_speech:
-                    self._current_state = self._snowboy.RunDetection(self._buffer)
-            else:
-                self._current_state = self._snowboy.RunDetection(self._buffer)
-            self._buffer = b''
+        self._only_detect = only_detect
+        self._found = False
+        self._slicer.feed(self._resampler(buffer), self._frame)
         return self._current_state
 
-    @classmethod
-    @lru_cache(maxsize=1)
-    def _constructor(cls, resource_path, sensitivity, audio_gain, *snowboy_hot_word_files):
-        sn = snowboydetect.SnowboyDetect(
+    def _frame(self, frame: bytes):
+        if self._found:
+            # Ключевое слово найдено, остаток уже не важен
+            return
+        if self._another:
+            is_speech = self._another.is_speech(frame)
+            if self._only_detect or not is_speech:
+                self._current_state = 0 if is_speech else -2
+                return
+        # Детектор мог быть подменен между фреймами, берем актуальный
+        snowboy = self._models.current
+        self._current_state = snowboy.run(frame)
+        if self._current_state > 0:
+            self._found = True
+            self.model_path = snowboy.model_path(self._current_state)
+
+
+@singleton
+class SnowboyModels:
+    """
+    Реестр моделей сноубоя, общий для всех детекторов.
+    Новый набор моделей загружается в фоне, старый детектор продолжает работать,
+    подмена происходит атомарно - детекторы берут актуальный экземпляр на каждом фрейме.
+    Чувствительность и усиление меняются без перезагрузки моделей.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = None
+        # (resource_path, models), sensitivity, audio_gain - последний запрошенный набор
+        self._pending = None
+        # Ошибки фоновой загрузки некому поймать, их пишем в лог (см. MDTerminal)
+        self.log = lambda msg, lvl=logger.DEBUG: print(msg)
+
+    @property
+    def current(self):
+        return self._current
+
+    def configure(self, resource_path, models, sensitivity, audio_gain, background=False):
+        models = tuple(models)
+        sensitivity = _sensitivity_list(sensitivity, len(models))
+        key = (resource_path, models)
+        with self._lock:
+            current = self._current
+            if current is not None and current.key == key:
+                self._pending = None
+                current.set_params(sensitivity, audio_gain)
+                return
+            pending_key = self._pending[0] if self._pending else None
+            self._pending = (key, sensitivity, audio_gain)
+            if pending_key == key:
+                # Уже грузится, загрузчик сам применит новые параметры
+                return
+        if background and current is not None:
+            threading.Thread(target=self._load, args=(key, sensitivity, audio_gain), name='SnowboyModels').start()
+        else:
+            self._load(key, sensitivity, audio_gain, True)
+
+    def _load(self, key, sensitivity, audio_gain, raise_error=False):
+        try:
+            instance = _SnowboyInstance(*key, sensitivity, audio_gain)
+        except Exception as e:
+            # swig-обертка может кинуть что угодно. Без сброса _pending этот набор больше не загрузится
+            with self._lock:
+                if self._pending is not None and self._pending[0] == key:
+                    self._pending = None
+            msg = 'Error loading snowboy models {}: {}'.format(', '.join(key[1]), e)
+            self.log(msg, logger.ERROR)
+            if raise_error:
+                raise RuntimeError(msg)
+            return
+        with self._lock:
+            if self._pending is None or self._pending[0] != key:
+                # Пока грузили запросили другие модели
+                return
+            instance.set_params(*self._pending[1:])
+            self._pending = None
+            self._current = instance
+
+
+class _SnowboyInstance:
+    def __init__(self, resource_path, models, sensitivity, audio_gain):
+        self.key = (resource_path, models)
+        self._models = models
+        self._detector = snowboydetect.SnowboyDetect(
             resource_filename=os.path.join(resource_path, 'resources', 'common.res').encode(),
-            model_str=",".join(snowboy_hot_word_files).encode()
+            model_str=",".join(models).encode()
         )
-        sn.SetAudioGain(audio_gain)
-        sn.SetSensitivity(','.join([str(sensitivity)] * len(snowboy_hot_word_files)).encode())
-        return sn
+        self.sample_rate = self._detector.SampleRate()
+        self._params = None
+        self._applied = None
+        self.set_params(sensitivity, audio_gain)
+        self._apply()
+
+    def set_params(self, sensitivity, audio_gain):
+        # Применятся в потоке детектора перед следующим фреймом
+        self._params = (tuple(sensitivity), audio_gain)
+
+    def model_path(self, model: int) -> str or None:
+        return self._models[model - 1] if 0 < model <= len(self._models) else None
+
+    def run(self, data: bytes) -> int:
+        if self._params is not self._applied:
+            self._apply()
+        return self._detector.RunDetection(data)
+
+    def _apply(self):
+        params = self._params
+        sensitivity, audio_gain = params
+        if self._applied is None or self._applied[1] != audio_gain:
+            self._detector.SetAudioGain(audio_gain)
+        if self._applied is None or self._applied[0] != sensitivity:
+            self._detector.SetSensitivity(','.join(str(x) for x in sensitivity).encode())
+        self._applied = params
+
+
+def _sensitivity_list(sensitivity, count: int) -> list:
+    if isinstance(sensitivity, (list, tuple)):
+        if len(sensitivity) == count:
+            return list(sensitivity)
+        sensitivity = sensitivity[0] if sensitivity else 0.45
+    return [sensitivity] * count
 
 
 class DetectorVAD(Detector):
-    def __init__(self, width, rate, lvl):
+    def __init__(self, width, rate, lvl, shared=True):
         super().__init__(30, width, rate, 16000)
-        self._vad = DetectorVAD._constructor(lvl)
+        # VAD хранит состояние, для работы в другом потоке нужен свой экземпляр
+        self._vad = DetectorVAD._constructor(lvl) if shared else Vad(lvl)
 
     def _detector(self, chunk: bytes):
         self._state = self._vad.is_speech(chunk, self._resample_rate)
@@ -246,9 +385,9 @@ class DetectorVAD(Detector):
 
 
 class DetectorAPM(Detector):
-    def __init__(self, width, rate, lvl):
+    def __init__(self, width, rate, lvl, shared=True):
         super().__init__(10, width, rate, 16000)
-        self._apm = DetectorAPM._constructor(lvl)
+        self._apm = DetectorAPM._constructor(lvl) if shared else DetectorAPM._new_apm(lvl)
 
     def is_speech(self, data: bytes) -> bool:
         self._call_detector(self._resampler(data))
@@ -261,11 +400,108 @@ class DetectorAPM(Detector):
     @classmethod
     @lru_cache(maxsize=1)
     def _constructor(cls, lvl):
+        return cls._new_apm(lvl)
+
+    @staticmethod
+    def _new_apm(lvl):
         apm = AudioProcessingModule(enable_vad=True)
         apm.set_vad_level(lvl)
         return apm
 
 
+class SilenceTrimmer:
+    """
+    Вырезает тишину перед отправкой в STT: до и после речи оставляет pad_ms,
+    паузы внутри фразы длиннее max_pause_ms сокращает до max_pause_ms.
+    Работает потоково - тишина придерживается, пока не станет ясно нужна ли она.
+    Если речь так и не найдена, end отдаст все аудио без изменений, как trim_silence.
+    Речь определяет webrtcvad, если его нет - VAD из APM.
+    """
+    FRAME_MS = 30
+
+    def __init__(self, width, rate, lvl, pad_ms=300, max_pause_ms=600):
+        lvl = min(4, max(1, lvl)) - 1
+        if Vad:
+            self._detector = DetectorVAD(width, rate, lvl, False)
+        elif not APM_ERR:
+            self._detector = DetectorAPM(width, rate, lvl, False)
+        else:
+            raise RuntimeError('VAD unavailable: webrtcvad and webrtc_audio_processing not installed')
+        # Фреймы придерживаются дольше одного вызова slice, нужны bytes
+        self._slicer = FrameSlicer(width * int(rate * self.FRAME_MS / 1000), True)
+        self._pad = max(1, pad_ms // self.FRAME_MS)
+        self._max_pause = max(self._pad * 2, max_pause_ms // self.FRAME_MS)
+        # Все аудио до начала речи, перед речью из него уйдут только последние _pad фреймов
+        self._head = []
+        self._pause = []
+        self._started = False
+        self.input_bytes = 0
+        self.output_bytes = 0
+
+    @property
+    def saved(self) -> int:
+        return self.input_bytes - self.output_bytes
+
+    @property
+    def found(self) -> bool:
+        # Была ли найдена речь
+        return self._started
+
+    def process(self, data) -> list:
+        self.input_bytes += len(data)
+        result = []
+        for frame in self._slicer.slice(data):
+            if not self._detector.is_speech(frame):
+                if self._started:
+                    self._pause.append(frame)
+                else:
+                    self._head.append(frame)
+                continue
+            if self._started:
+                pause = self._pause
+                if len(pause) > self._max_pause:
+                    half = self._max_pause // 2
+                    pause = pause[:half] + pause[-half:]
+                result.extend(pause)
+                self._pause = []
+            else:
+                self._started = True
+                result.extend(self._head[-self._pad:])
+                self._head = []
+            result.append(frame)
+        return self._count(result)
+
+    def end(self) -> list:
+        if self._started:
+            result = self._pause[:self._pad]
+        else:
+            # Речи нет - отдаем все как было, вместе с неполным последним фреймом
+            result = self._head
+            if len(self._slicer):
+                result.append(self._slicer.tail())
+        self._pause = []
+        self._head = []
+        self._slicer.clear()
+        return self._count(result)
+
+    def _count(self, result: list) -> list:
+        self.output_bytes += sum(len(frame) for frame in result)
+        return result
+
+
+def trim_silence(adata: AudioData, lvl: int) -> tuple:
+    # Возвращает укороченный AudioBuffer и сколько байт сэкономлено. Если речь не найдена, аудио не меняется
+    trimmer = SilenceTrimmer(adata.sample_width, adata.sample_rate, lvl)
+    adata = AudioBuffer.from_audio_data(adata)
+    frames = []
+    for chunk in adata.iter_raw():
+        frames.extend(trimmer.process(chunk))
+    frames.extend(trimmer.end())
+    if not trimmer.found:
+        return adata, 0
+    return AudioBuffer(frames, adata.sample_rate, adata.sample_width), len(adata) - trimmer.output_bytes
+
+
 class StreamRecognition(threading.Thread):
     def __init__(self, voice_recognition):
         super().__init__()
@@ -279,6 +515,9 @@ class StreamRecognition(threading.Thread):
         self._written = False
         self._block = threading.Event()
         self.__event = threading.Event()
+        # SilenceTrimmer, выставляется до начала чтения
+        self.trimmer = None
+        self._trimmed = collections.deque()
 
     @property
     def ready(self):
@@ -308,6 +547,18 @@ class StreamRecognition(threading.Thread):
         self.start()
 
     def read(self):
+        if self.trimmer is None:
+            return self._read()
+        while not self._trimmed:
+            chunk = self._read()
+            if chunk:
+                self._trimmed.extend(self.trimmer.process(chunk))
+            else:
+                self._trimmed.extend(self.trimmer.end())
+                self._trimmed.append(chunk)
+        return self._trimmed.popleft()
+
+    def _read(self):
         while True:
             self.__event.wait(0.5)
             try:
@@ -334,12 +585,87 @@ class StreamRecognition(threading.Thread):
             self._block.set()
 
     def get_audio_data(self):
-        frames = collections.deque()
+        frames = []
         chunk = True
         while chunk:
             chunk = self.read()
             frames.append(chunk)
-        return AudioData(frame_data=b''.join(frames), sample_rate=self.sample_rate, sample_width=self.sample_width)
+        return AudioBuffer(frames, self.sample_rate, self.sample_width)
+
+
+class AudioBuffer(AudioData):
+    """
+    AudioData, хранящий фреймы как есть, без склейки.
+    Конвертация формата выполняется лениво, по фреймам, при итерации - целиком фраза в памяти не копируется.
+    frame_data склеивается только по требованию (для кода, ожидающего обычный AudioData).
+    """
+    def __init__(self, frames, sample_rate, sample_width):
+        self._frames = [frame for frame in frames if frame]
+        super().__init__(None, sample_rate, sample_width)
+
+    @classmethod
+    def from_audio_data(cls, adata):
+        return adata if isinstance(adata, AudioBuffer) else cls([adata.frame_data], adata.sample_rate, adata.sample_width)
+
+    @property
+    def frame_data(self):
+        if len(self._frames) > 1:
+            self._frames = [b''.join(self._frames)]
+        return self._frames[0] if self._frames else b''
+
+    @frame_data.setter
+    def frame_data(self, data):
+        if data is not None:
+            self._frames = [data] if data else []
+
+    def __len__(self):
+        return sum(len(frame) for frame in self._frames)
+
+    def iter_raw(self, convert_rate=None, convert_width=None):
+        # Аналог get_raw_data, но отдает данные по фреймам. Без конвертации - memoryview исходных фреймов
+        # Как и в AudioData, 8 бит без convert_width=1 отдаются со знаком
+        unsigned = convert_width == 1
+        convert_rate = None if convert_rate == self.sample_rate else convert_rate
+        convert_width = None if convert_width == self.sample_width else convert_width
+        if convert_rate is None and convert_width is None and self.sample_width != 1:
+            for frame in self._frames:
+                yield memoryview(frame)
+            return
+        state = None
+        for frame in self._frames:
+            if self.sample_width == 1:
+                frame = audioop.bias(frame, 1, -128)
+            if convert_rate is not None:
+                frame, state = audioop.ratecv(frame, self.sample_width, 1, self.sample_rate, convert_rate, state)
+            if convert_width is not None:
+                frame = audioop.lin2lin(frame, self.sample_width, convert_width)
+            if unsigned:
+                frame = audioop.bias(frame, 1, 128)
+            yield frame
+
+    def iter_wav(self, convert_rate=None, convert_width=None):
+        # Аналог get_wav_data: заголовок и данные по фреймам
+        sample_rate = self.sample_rate if convert_rate is None else convert_rate
+        sample_width = self.sample_width if convert_width is None else convert_width
+        if sample_rate != self.sample_rate:
+            # Размер после ресемплинга заранее не известен, конвертируем фреймы без склейки
+            frames = list(self.iter_raw(convert_rate, convert_width))
+            size = sum(len(frame) for frame in frames)
+        else:
+            frames = self.iter_raw(convert_rate, convert_width)
+            size = len(self) // self.sample_width * sample_width
+        yield self._wav_header(size, sample_rate, sample_width)
+        yield from frames
+
+    @staticmethod
+    def _wav_header(size, sample_rate, sample_width) -> bytes:
+        # 44 байта RIFF/WAVE, PCM моно
+        return struct.pack(
+            '<4sI4s4sIHHIIHH4sI',
+            b'RIFF', 36 + size, b'WAVE',
+            b'fmt ', 16, 1, 1, sample_rate, sample_rate * sample_width, sample_width, sample_width * 8,
+            b'data', size
+        )
 
 
 class TimeFusion:
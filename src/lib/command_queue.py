@@ -0,0 +1,77 @@
+import heapq
+import queue
+import threading
+import time
+
+
+class CommandQueue:
+    """
+    Очередь команд терминала с приоритетами.
+    Голосовые команды идут раньше уведомлений, повторные идемпотентные команды
+    схлопываются в последнюю (с сохранением места в очереди), просроченные выкидываются при добавлении.
+    Команды с data None - запросы (volume без значения только сообщает уровень), они не схлопываются
+    и не заменяют установку значения.
+    Элементы - (cmd, data, lvl, late), late - время добавления или 0 если не устаревает.
+    """
+    PRIORITY = {'ask': 0, 'voice': 0, 'tts': 2, 'notify': 2}
+    DEFAULT_PRIORITY = 1
+    COALESCE = ('volume', 'mpd_volume', 'reload', 'models')
+
+    def __init__(self, max_late: int):
+        self._max_late = max_late
+        self._lock = threading.Lock()
+        self._heap = []
+        self._coalesce = {}
+        self._seq = 0
+        self._size = 0
+        # Сколько команд выброшено: схлопнуто и просрочено
+        self.coalesced = 0
+        self.expired = 0
+
+    def qsize(self) -> int:
+        return self._size
+
+    def put_nowait(self, item: tuple):
+        cmd = item[0]
+        # Ключ схлопывания: запрос и установка - разные команды
+        key = (cmd, item[1] is not None)
+        with self._lock:
+            self._drop_expired()
+            entry = self._coalesce.get(key)
+            if entry is not None:
+                entry[2] = item
+                self.coalesced += 1
+                return
+            entry = [self.PRIORITY.get(cmd, self.DEFAULT_PRIORITY), self._seq, item]
+            self._seq += 1
+            heapq.heappush(self._heap, entry)
+            if cmd in self.COALESCE and item[1] is not None:
+                self._coalesce[key] = entry
+            self._size += 1
+
+    def get_nowait(self) -> tuple:
+        with self._lock:
+            while self._heap:
+                entry = heapq.heappop(self._heap)
+                item = entry[2]
+                if item is None:
+                    continue
+                key = (item[0], item[1] is not None)
+                if self._coalesce.get(key) is entry:
+                    del self._coalesce[key]
+                self._size -= 1
+                return item
+        raise queue.Empty
+
+    def _drop_expired(self):
+        now = time.time()
+        for entry in self._heap:
+            item = entry[2]
+            if item is not None and item[3] and now - item[3] > self._max_late:
+                key = (item[0], item[1] is not None)
+                if self._coalesce.get(key) is entry:
+                    del self._coalesce[key]
+                # Помечаем, выкинет get_nowait
+                entry[2] = None
+                self._size -= 1
+                self.expired += 1
@@ -0,0 +1,104 @@
+class FrameSlicer:
+    """
+    Нарезает поток байт на фреймы фиксированного размера.
+    Полные фреймы отдаются как memoryview прямо из входных данных, без копирования.
+    Копируется только хвост (меньше одного фрейма) - в один из двух заранее выделенных bytearray,
+    из него же собирается первый фрейм следующего вызова.
+    Фреймы валидны до следующего вызова slice.
+    as_bytes - для потребителей, которым нужны bytes (swig). Тогда нарезка идет срезами bytes, как раньше:
+    фрейм все равно копируется, а memoryview сверху только добавил бы работы. Такие фреймы валидны всегда.
+    """
+    def __init__(self, frame_size: int, as_bytes=False):
+        if frame_size < 1:
+            raise ValueError('frame_size must be positive, not {}'.format(frame_size))
+        self._frame_size = frame_size
+        self._as_bytes = as_bytes
+        # Хвост для as_bytes
+        self._buffer = b''
+        if as_bytes:
+            # Без лишнего вызова на каждый чанк
+            self.slice = self._slice_bytes
+            self.feed = self._feed_bytes
+        # Два буфера: пока один отдан наружу как фрейм, во второй пишем новый хвост
+        self._tails = (memoryview(bytearray(frame_size)), memoryview(bytearray(frame_size)))
+        self._tail_idx = 0
+        self._tail_len = 0
+
+    @property
+    def frame_size(self) -> int:
+        return self._frame_size
+
+    def __len__(self):
+        # Сколько байт ждут добора до полного фрейма
+        return len(self._buffer) if self._as_bytes else self._tail_len
+
+    def tail(self) -> bytes:
+        # Копия байт, ждущих добора до полного фрейма
+        if self._as_bytes:
+            return self._buffer
+        return bytes(self._tails[self._tail_idx][:self._tail_len])
+
+    def clear(self):
+        self._tail_len = 0
+        self._buffer = b''
+
+    def frames_count(self, data_len: int) -> int:
+        # Сколько фреймов получится если отдать data_len байт
+        return (len(self) + data_len) // self._frame_size
+
+    def feed(self, data, consumer):
+        # Как slice, но каждый фрейм сразу отдается consumer, без промежуточного списка
+        for frame in self.slice(data):
+            consumer(frame)
+
+    def slice(self, data) -> list:
+        data = memoryview(data)
+        data_len = len(data)
+        size = self._frame_size
+        frames = []
+        offset = 0
+        if self._tail_len:
+            tail = self._tails[self._tail_idx]
+            offset = min(size - self._tail_len, data_len)
+            tail[self._tail_len:self._tail_len + offset] = data[:offset]
+            self._tail_len += offset
+            if self._tail_len < size:
+                return frames
+            frames.append(tail)
+            self._tail_idx ^= 1
+            self._tail_len = 0
+        end = offset + ((data_len - offset) // size) * size
+        for step in range(offset, end, size):
+            frames.append(data[step:step + size])
+        if end < data_len:
+            self._tail_len = data_len - end
+            self._tails[self._tail_idx][:self._tail_len] = data[end:]
+        return frames
+
+    def _slice_bytes(self, data) -> list or tuple:
+        # b'' + bytes не копирует, остальное (bytearray, memoryview) приводится к bytes
+        buffer = self._buffer + data
+        size = self._frame_size
+        buff_len = len(buffer)
+        if buff_len < size:
+            # Частый случай для длинных фреймов, без лишнего списка
+            self._buffer = buffer
+            return ()
+        read_len = buff_len - buff_len % size
+        self._buffer = buffer[read_len:]
+        frames = []
+        for step in range(0, read_len, size):
+            frames.append(buffer[step:step + size])
+        return frames
+
+    def _feed_bytes(self, data, consumer):
+        buffer = self._buffer + data
+        size = self._frame_size
+        buff_len = len(buffer)
+        if buff_len < size:
+            self._buffer = buffer
+            return
+        read_len = buff_len - buff_len % size
+        self._buffer = buffer[read_len:]
+        for step in range(0, read_len, size):
+            consumer(buffer[step:step + size])
@@ -0,0 +1,63 @@
+class LineFramer:
+    """
+    Делит поток байт на строки по разделителю за линейное время.
+    Данные копятся в одном bytearray, поиск разделителя продолжается с места, где закончился прошлый,
+    прочитанное вырезается из буфера один раз на feed. Строки отдаются по одной, между ними
+    можно забрать сырые байты (take) - например бинарные данные, идущие после строки-заголовка.
+    Строка длиннее max_line без разделителя - RuntimeError.
+    """
+    def __init__(self, max_line: int, delimiter: bytes = b'\r\n'):
+        if max_line < 1:
+            raise ValueError('max_line must be positive, not {}'.format(max_line))
+        self._max_line = max_line
+        self._delimiter = delimiter
+        self._buffer = bytearray()
+        # Начало непрочитанных данных
+        self._start = 0
+        # Откуда продолжать поиск разделителя
+        self._scan = 0
+        # Был ли хоть один разделитель
+        self.framed = False
+
+    def __len__(self):
+        # Сколько байт еще не прочитано
+        return len(self._buffer) - self._start
+
+    def feed(self, data):
+        if self._start:
+            del self._buffer[:self._start]
+            self._scan -= self._start
+            self._start = 0
+        self._buffer += data
+
+    def lines(self):
+        """Генератор, отдает готовые строки (без разделителя) пока они есть в буфере."""
+        while True:
+            line = self.pop_line()
+            if line is None:
+                return
+            yield line
+
+    def pop_line(self) -> bytes or None:
+        end = self._buffer.find(self._delimiter, self._scan)
+        if end < 0:
+            # Разделитель мог прийти частично, его начало ищем заново
+            self._scan = max(self._scan, len(self._buffer) - len(self._delimiter) + 1)
+            if len(self) > self._max_line:
+                raise RuntimeError('Line too long: more than {} bytes'.format(self._max_line))
+            return None
+        line = bytes(self._buffer[self._start:end])
+        self._start = self._scan = end + len(self._delimiter)
+        self.framed = True
+        return line
+
+    def take(self, size: int) -> bytes:
+        # До size сырых байт из буфера
+        data = bytes(self._buffer[self._start:self._start + size])
+        self._start += len(data)
+        self._scan = max(self._scan, self._start)
+        return data
+
+    def tail(self) -> bytes:
+        # Весь непрочитанный остаток
+        return self.take(len(self))
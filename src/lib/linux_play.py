@@ -81,6 +81,8 @@ class DoublePopen(threading.Thread):
 
     def run(self):
         self._two.wait()
+        # poll смотрит на оба процесса, колбэк должен быть после завершения обоих
+        self._one.wait()
         self._callback(False)
 
     def poll(self):
@@ -1,18 +1,81 @@
+import collections
+import heapq
 import queue
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import logger
+
+
+class _Subscriber:
+    # Очередь вызовов одного коллбэка. Вызовы выполняются в пуле, строго по очереди
+    def __init__(self, callback):
+        self.callback = callback
+        # Событие -> окно объединения в секундах, см. PubSub.subscribe
+        self.coalesce = {}
+        self.name = getattr(callback, '__qualname__', None) or repr(callback)
+        self._pending = collections.deque()
+        self._running = False
+        self._lock = threading.Lock()
+
+    def push(self, item: tuple) -> bool:
+        # True - очередь никто не разбирает, нужно запустить обработку
+        with self._lock:
+            self._pending.append(item)
+            if self._running:
+                return False
+            self._running = True
+            return True
+
+    def pop(self) -> tuple or None:
+        with self._lock:
+            if self._pending:
+                return self._pending.popleft()
+            self._running = False
+            return None
 
 
 class PubSub(threading.Thread):
+    """
+    Поток только раскладывает события по очередям подписчиков, коллбэки выполняются в пуле.
+    Медленный коллбэк задерживает только свои события, порядок вызовов у каждого коллбэка сохраняется.
+    Подписка может объединять частые события (coalesce), отложенные события ждут в треде.
+    """
+    WORKERS = 4
+    # Коллбэк дольше этого (сек) попадет в лог
+    SLOW_CALLBACK = 0.5
+
     def __init__(self):
         super().__init__(name='PubSub')
-        # Подписки, формат `[канал][событие]: [список коллбэков]`
+        # Подписки, формат `[канал][событие]: (коллбэки)`.
+        # Меняются только в треде и только целиком (копия), читать можно откуда угодно без блокировок
         self._event_callbacks = {}
+        # Коллбэк -> _Subscriber
+        self._subscribers = {}
+        # Отложенные объединением вызовы: (_Subscriber, событие) -> [срок, args, kwargs], и их сроки
+        self._deferred = {}
+        self._deadlines = []
+        self._seq = 0
         # Очередь вызовов, все вызовы и изменения подписок делаем в треде
         self._queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(self.WORKERS)
+        self._log = lambda *_: None
         self._work = False
+        # Сколько раз коллбэки превысили SLOW_CALLBACK
+        self.slow = 0
+        # Сколько вызовов поглощено объединением
+        self.coalesced = 0
+
+    def configure(self, log):
+        self._log = log
 
-    def subscribe(self, event, callback, channel='default') -> bool:
-        return self._subscribe_action('add_subscribe', event, callback, channel)
+    def subscribe(self, event, callback, channel='default', coalesce=None) -> bool:
+        """
+        coalesce - {событие: секунды}. Для start_* - пара start_*/stop_* короче этого времени не вызывается совсем,
+        для остальных событий за это время после первого вызова будет один вызов с последним значением.
+        """
+        return self._subscribe_action('add_subscribe', event, callback, channel, coalesce)
 
     def unsubscribe(self, event, callback, channel='default') -> bool:
         return self._subscribe_action('remove_subscribe', event, callback, channel)
@@ -45,16 +108,23 @@ class PubSub(threading.Thread):
             self._work = False
             self._queue.put_nowait(None)
             super().join(timeout)
+            # Дожидаемся только уже запущенных коллбэков
+            self._pool.shutdown(wait=True)
 
     def run(self):
         while self._work:
-            data = self._queue.get()
+            timeout = max(0, self._deadlines[0][0] - time.time()) if self._deadlines else None
+            try:
+                data = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                data = None
+            self._deferred_processing()
             if isinstance(data, tuple):
                 self._call_processing(*data)
             elif isinstance(data, list):
-                (cmd, channel, data) = data
+                (cmd, channel, data, coalesce) = data
                 if cmd == 'add_subscribe':
-                    self._add_subscribe(data, channel)
+                    self._add_subscribe(data, channel, coalesce)
                 elif cmd == 'remove_subscribe':
                     self._remove_subscribe(data, channel)
                 else:
@@ -65,32 +135,98 @@ class PubSub(threading.Thread):
                 raise RuntimeError('Wrong type of data: {}'.format(repr(data)))
 
     def _call_processing(self, channel, name, args, kwargs):
-        # Вызываем подписчиков
-        if channel in self._event_callbacks and name in self._event_callbacks[channel]:
-            for callback in self._event_callbacks[channel][name]:
-                callback(name, *args, **kwargs)
-
-    def _add_subscribe(self, data, channel):
+        # Раскладываем вызов по очередям подписчиков
+        for callback in self._event_callbacks.get(channel, {}).get(name, ()):
+            subscriber = self._subscribers.get(callback)
+            if subscriber is None:
+                subscriber = self._subscribers[callback] = _Subscriber(callback)
+            window = subscriber.coalesce.get(name)
+            if name.startswith('stop_') and (subscriber, 'start_' + name[5:]) in self._deferred:
+                # Короткая пара start/stop, не вызываем ни то ни другое
+                del self._deferred[(subscriber, 'start_' + name[5:])]
+                self.coalesced += 2
+            elif window:
+                self._defer(subscriber, name, window, args, kwargs)
+            else:
+                self._push(subscriber, (name, args, kwargs))
+
+    def _defer(self, subscriber: _Subscriber, name, window, args, kwargs):
+        entry = self._deferred.get((subscriber, name))
+        if entry is not None:
+            # Побеждает последнее значение, срок не сдвигаем
+            entry[1:] = args, kwargs
+            self.coalesced += 1
+            return
+        entry = self._deferred[(subscriber, name)] = [time.time() + window, args, kwargs]
+        heapq.heappush(self._deadlines, (entry[0], self._seq, subscriber, name, entry))
+        self._seq += 1
+
+    def _deferred_processing(self):
+        now = time.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, _, subscriber, name, entry = heapq.heappop(self._deadlines)
+            if self._deferred.get((subscriber, name)) is not entry:
+                # Уже поглощен парой stop_*
+                continue
+            del self._deferred[(subscriber, name)]
+            if self._subscribers.get(subscriber.callback) is subscriber:
+                self._push(subscriber, (name, entry[1], entry[2]))
+
+    def _push(self, subscriber: _Subscriber, item: tuple):
+        if subscriber.push(item):
+            self._pool.submit(self._subscriber_processing, subscriber)
+
+    def _subscriber_processing(self, subscriber: _Subscriber):
+        item = subscriber.pop()
+        while item is not None and self._work:
+            name, args, kwargs = item
+            start = time.time()
+            try:
+                subscriber.callback(name, *args, **kwargs)
+            except Exception as e:
+                # Исключение в пуле потеряется молча
+                self._log('Callback {} for {} failed: {}'.format(subscriber.name, repr(name), e), logger.ERROR)
+            elapsed = time.time() - start
+            if elapsed > self.SLOW_CALLBACK:
+                self.slow += 1
+                msg = 'Slow callback {} for {}: {} ms'.format(subscriber.name, repr(name), int(elapsed * 1000))
+                self._log(msg, logger.WARN)
+            item = subscriber.pop()
+
+    def _add_subscribe(self, data, channel, coalesce):
         # Добавляем подписчиков
-        if channel not in self._event_callbacks:
-            self._event_callbacks[channel] = {}
+        callbacks = {key: dict(value) for key, value in self._event_callbacks.items()}
+        events = callbacks.setdefault(channel, {})
         for name, callback in data:
-            if name not in self._event_callbacks[channel]:
-                self._event_callbacks[channel][name] = set()
-            self._event_callbacks[channel][name].add(callback)
+            if callback not in events.get(name, ()):
+                events[name] = events.get(name, ()) + (callback,)
+            subscriber = self._subscribers.get(callback)
+            if subscriber is None:
+                subscriber = self._subscribers[callback] = _Subscriber(callback)
+            if coalesce and coalesce.get(name):
+                subscriber.coalesce[name] = coalesce[name]
+            else:
+                subscriber.coalesce.pop(name, None)
+        self._event_callbacks = callbacks
 
     def _remove_subscribe(self, data, channel):
         # Удаляем подписчиков
+        callbacks = {key: dict(value) for key, value in self._event_callbacks.items()}
         for name, callback in data:
-            if name not in self._event_callbacks.get(channel, {}):
+            if name not in callbacks.get(channel, {}):
                 continue
-            self._event_callbacks[channel][name].discard(callback)
-            if not self._event_callbacks[channel][name]:
-                del self._event_callbacks[channel][name]
-            if not self._event_callbacks[channel]:
-                del self._event_callbacks[channel]
-
-    def _subscribe_action(self, cmd, event, callback, channel) -> bool:
+            callbacks[channel][name] = tuple(x for x in callbacks[channel][name] if x != callback)
+            if not callbacks[channel][name]:
+                del callbacks[channel][name]
+            if not callbacks[channel]:
+                del callbacks[channel]
+        self._event_callbacks = callbacks
+        # Очереди отписавшихся больше не нужны, уже запущенные вызовы доработают
+        used = {callback for events in callbacks.values() for event in events.values() for callback in event}
+        for callback in [x for x in self._subscribers if x not in used]:
+            del self._subscribers[callback]
+
+    def _subscribe_action(self, cmd, event, callback, channel, coalesce=None) -> bool:
         if isinstance(event, (list, tuple)) and isinstance(callback, (list, tuple)):
             # Так нельзя
             return False
@@ -104,6 +240,6 @@ class PubSub(threading.Thread):
         else:
             data = [(event, callback)]
         if data:
-            self._queue.put_nowait([cmd, channel, data])
+            self._queue.put_nowait([cmd, channel, data, coalesce])
             return True
         return False
@@ -0,0 +1,198 @@
+import audioop
+import socket
+import threading
+import time
+import wave
+
+import lib.sr_wrapper as sr
+
+_original = sr.Microphone
+
+
+class _ReplayStream:
+    """
+    Замена pyaudio-потока: отдает PCM (моно, 16 бит) из WAV-файлов или сокета.
+    speed задает темп: 1.0 - реальное время, 2.0 - вдвое быстрее, 0 - без задержек.
+    Между файлами и после последнего вставляется тишина длиной gap секунд.
+    """
+    def __init__(self, sources, rate, speed=1.0, gap=1.0):
+        self._sources = list(sources)
+        self._rate = rate
+        self._speed = speed
+        self._gap = gap
+        self._stopped = False
+        self._buffer = b''
+        self._reader = None
+        self._start = None
+        # Сколько байт отдано с начала воспроизведения, для темпа и позиции
+        self.position = 0
+
+    @property
+    def seconds(self) -> float:
+        return self.position / (self._rate * 2)
+
+    def read(self, frames, exception_on_overflow=True):
+        size = frames * 2
+        while len(self._buffer) < size:
+            chunk = self._next_chunk(size)
+            if not chunk:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self._pace(len(data))
+        return data
+
+    def _pace(self, size):
+        if self._start is None:
+            self._start = time.perf_counter()
+        self.position += size
+        if self._speed > 0:
+            delay = self._start + self.seconds / self._speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _next_chunk(self, size) -> bytes:
+        while self._reader is not None or self._sources:
+            if self._reader is None:
+                self._reader = self._open(self._sources.pop(0))
+            chunk = self._reader(size)
+            if chunk:
+                return chunk
+            self._reader = None
+        return b''
+
+    def _open(self, source):
+        if isinstance(source, (int, float)):
+            return _Silence(source, self._rate).read
+        if source.startswith('tcp://'):
+            return _SocketReader(source[6:]).read
+        reader = _WaveReader(source, self._rate)
+        if self._gap > 0:
+            self._sources.insert(0, self._gap)
+        return reader.read
+
+    def is_stopped(self):
+        return self._stopped
+
+    def stop_stream(self):
+        self._stopped = True
+
+    def close(self):
+        self._stopped = True
+        self._sources.clear()
+        self._reader = None
+
+
+class _Silence:
+    def __init__(self, seconds, rate):
+        self._size = int(seconds * rate) * 2
+
+    def read(self, size) -> bytes:
+        size = min(size, self._size)
+        self._size -= size
+        return b'\x00' * size
+
+
+class _WaveReader:
+    def __init__(self, path, rate):
+        with wave.open(path, 'rb') as fp:
+            data = fp.readframes(fp.getnframes())
+            width, channels, file_rate = fp.getsampwidth(), fp.getnchannels(), fp.getframerate()
+        if width == 1:
+            data = audioop.bias(data, 1, -128)
+        if channels > 1:
+            data = audioop.tomono(data, width, 0.5, 0.5)
+        if file_rate != rate:
+            data, _ = audioop.ratecv(data, width, 1, file_rate, rate, None)
+        if width != 2:
+            data = audioop.lin2lin(data, width, 2)
+        self._data = memoryview(data)
+        self._pos = 0
+
+    def read(self, size) -> bytes:
+        chunk = self._data[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        return bytes(chunk)
+
+
+class _SocketReader:
+    # Сырой PCM (моно, 16 бит, частота микрофона), например: arecord -r 16000 -f S16_LE | nc -l 7990
+    def __init__(self, address: str):
+        host, port = address.rsplit(':', 1)
+        self._conn = socket.create_connection((host, int(port)), timeout=30)
+
+    def read(self, size) -> bytes:
+        try:
+            chunk = self._conn.recv(size)
+        except OSError:
+            chunk = b''
+        if not chunk:
+            self._conn.close()
+        return chunk
+
+
+class ReplayMicrophone(sr.AudioSource):
+    """
+    Источник звука с интерфейсом sr.Microphone, для воспроизводимых прогонов всего тракта прослушивания.
+    Поток оборачивается так же, как у микрофона, поэтому APM и детекторы работают без изменений.
+    Источники: пути до WAV, 'tcp://host:port' (сырой PCM) или число - секунды тишины.
+    """
+    SAMPLE_RATE = 16000
+    SAMPLE_WIDTH = 2
+    CHUNK = 1024
+
+    def __init__(self, sources, speed=1.0, gap=1.0, chunk_size=1024):
+        self.CHUNK = chunk_size
+        self._sources = sources
+        self._speed = speed
+        self._gap = gap
+        self.raw = None
+        self.stream = None
+
+    @staticmethod
+    def list_microphone_names():
+        return ['replay']
+
+    def __enter__(self):
+        assert self.stream is None, "This audio source is already inside a context manager"
+        # Источник может выдаваться только при открытии, см. install
+        sources = self._sources() if callable(self._sources) else self._sources
+        sources = [sources] if isinstance(sources, (str, int, float)) else sources
+        self.raw = _ReplayStream(sources, self.SAMPLE_RATE, self._speed, self._gap)
+        self.stream = _original.get_microphone_stream(self.raw, self.SAMPLE_WIDTH, self.SAMPLE_RATE)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.stream.close()
+        finally:
+            self.stream = None
+
+
+class _Installed:
+    # Подменяет sr.Microphone, каждый новый "микрофон" берет следующий источник
+    def __init__(self, sources, speed, gap):
+        self._sources = list(sources)
+        self._speed = speed
+        self._gap = gap
+        self._lock = threading.Lock()
+
+    def __call__(self, *_, chunk_size=1024, **__):
+        return ReplayMicrophone(self._next_source, self._speed, self._gap, chunk_size)
+
+    def _next_source(self):
+        with self._lock:
+            return self._sources.pop(0) if self._sources else []
+
+    @staticmethod
+    def list_microphone_names():
+        return ReplayMicrophone.list_microphone_names()
+
+
+def install(sources, speed=1.0, gap=1.0):
+    # Все sr.Microphone() терминала будут читать из sources вместо микрофона
+    sr.Microphone = _Installed(sources, speed, gap)
+
+
+def uninstall():
+    sr.Microphone = _original
@@ -1,11 +1,12 @@
 import lib.snowboydecoder as snowboydecoder
 import lib.sr_wrapper as sr
+from lib.audio_utils import SnowboyModels
 from owner import Owner
 
 
 class SnowBoy:
     def __init__(self, cfg, callback, interrupt_check, *_, **__):
-        sensitivity = [cfg.gts('sensitivity')]
+        sensitivity = cfg.models_sensitivity()
         decoder_model = cfg.path['models_list']
         audio_gain = cfg.gts('audio_gain')
         self._interrupt_check = interrupt_check
@@ -22,6 +23,11 @@ class SnowBoy:
     def terminate(self):
         self._snowboy.terminate()
 
+    @staticmethod
+    def models_reload() -> bool:
+        # Декодер не умеет менять модели на лету, нужно пересоздать
+        return False
+
 
 def msg_parse(msg: str, phrase: str):
     phrase2 = phrase.lower().replace('ё', 'е')
@@ -41,7 +47,12 @@ class SnowBoySR:
         self._callback = callback
         self._interrupt_check = interrupt_check
         self.own = owner
-        self._hotword_callback = owner.full_quiet if self._cfg.gts('chrome_choke') else None
+        # barge-in: ключевое слово (а при barge_in == 2 и просто речь) глушит воспроизведение сразу.
+        # Без эхоподавления речью посчитается собственный TTS, тогда только по ключевому слову
+        self._barge_in = self._cfg.gts('barge_in')
+        if self._barge_in == 2 and not owner.echo_cancellation():
+            self._barge_in = 1
+        self._hotword_callback = owner.full_quiet if self._cfg.gts('chrome_choke') or self._barge_in else None
         self._terminate = False
 
     def start(self):
@@ -52,19 +63,29 @@ class SnowBoySR:
                 energy_threshold = self.own.energy_correct(r, source)
                 try:
                     adata = r.listen(source, 5, self._cfg.gts('phrase_time_limit'),
-                                     (self._cfg.path['home'], self._cfg.path['models_list']))
+                                     self._snowboy_cfg())
                 except sr.WaitTimeoutError:
                     self.own.energy_set(None)
                     continue
                 except sr.Interrupted:
                     self.own.energy_set(energy_threshold)
                     continue
-            if r.get_model > 0:
-                self._adata_parse(adata, r.get_model, energy_threshold)
+            self._parse(r, adata, energy_threshold)
 
     def terminate(self):
         self._terminate = True
 
+    def models_reload(self) -> bool:
+        # Новые модели грузятся в фоне, прослушивание продолжается на старых
+        SnowboyModels().configure(
+            self._cfg.path['home'], self._cfg.path['models_list'], self._cfg.models_sensitivity(),
+            self._cfg.gts('audio_gain'), background=True
+        )
+        return True
+
+    def _snowboy_cfg(self):
+        return self._cfg.path['home'], self._cfg.path['models_list'], self._cfg.models_sensitivity()
+
     def _get_recognizer(self, noising=None):
         return sr.Recognizer(
             self._cfg.gts('sensitivity'),
@@ -73,10 +94,20 @@ class SnowBoySR:
             self._interrupted,
             self.own.record_callback,
             noising,
-            self._cfg.gts('silent_multiplier')
+            self._cfg.gts('silent_multiplier'),
+            self.own.really_busy if self._barge_in == 2 else None
         )
 
-    def _adata_parse(self, adata, model, energy_threshold):
+    def _parse(self, r, adata, energy_threshold):
+        if r.get_model > 0:
+            self._adata_parse(adata, r.get_model_path, energy_threshold)
+        elif r.barged:
+            # Пользователь заговорил поверх терминала, фраза - команда без ключевого слова
+            msg = self._get_text(adata)
+            if msg:
+                self._callback(msg, 'barge-in', '', energy_threshold)
+
+    def _adata_parse(self, adata, model: str, energy_threshold):
         model_name, phrase, model_msg = self._cfg.model_info_by_id(model)
         if not phrase:
             return
@@ -107,13 +138,12 @@ class SnowBoySR2(SnowBoySR):
             with sr.Microphone() as source:
                 try:
                     adata = r.listen(source, 5, self._cfg.gts('phrase_time_limit'),
-                                     (self._cfg.path['home'], self._cfg.path['models_list']))
+                                     self._snowboy_cfg())
                 except (sr.WaitTimeoutError, sr.Interrupted):
                     continue
-            if r.get_model > 0:
-                self._adata_parse(adata, r.get_model, r.energy_threshold)
+            self._parse(r, adata, r.energy_threshold)
 
-    def _adata_parse(self, adata, model, energy_threshold):
+    def _adata_parse(self, adata, model: str, energy_threshold):
         model_name, phrase, model_msg = self._cfg.model_info_by_id(model)
         if not phrase:
             return
@@ -136,11 +166,10 @@ class SnowBoySR3(SnowBoySR2):
             with sr.Microphone() as source:
                 try:
                     adata = r.listen(source, 5, self._cfg.gts('phrase_time_limit'),
-                                     (self._cfg.path['home'], self._cfg.path['models_list']))
+                                     self._snowboy_cfg())
                 except (sr.WaitTimeoutError, sr.Interrupted):
                     continue
-            if r.get_model > 0:
-                self._adata_parse(adata, r.get_model, None)
+            self._parse(r, adata, None)
 
 
 class SnowBoySR4(SnowBoySR2):
@@ -153,13 +182,12 @@ class SnowBoySR4(SnowBoySR2):
             with sr.Microphone() as source:
                 try:
                     vr = r.listen2(source, 5, self._cfg.gts('phrase_time_limit'),
-                                   (self._cfg.path['home'], self._cfg.path['models_list']),
+                                   self._snowboy_cfg(),
                                    self.own.voice_recognition
                                    )
                 except (sr.WaitTimeoutError, sr.Interrupted):
                     continue
-            if r.get_model > 0:
-                self._adata_parse(vr, r.get_model, None)
+            self._parse(r, vr, None)
 
     def _get_text(self, adata):
         if self._cfg.gts('chrome_alarmstt'):
@@ -32,7 +32,8 @@ import time
 
 import speech_recognition
 
-from .audio_utils import APMSettings, MicrophoneStreamAPM, MicrophoneStream, SnowboyDetector, StreamRecognition
+from .audio_utils import APMSettings, MicrophoneStreamAPM, MicrophoneStream, SnowboyDetector, StreamRecognition, \
+    AudioBuffer
 from .proxy import proxies
 
 AudioData = speech_recognition.AudioData
@@ -76,12 +77,16 @@ class Microphone(speech_recognition.Microphone):
 
 
 class Recognizer(speech_recognition.Recognizer):
+    BARGE_IN_BUFFERS = 4  # Столько буферов речи подряд (~0.25 сек) прерывают воспроизведение
+
     def __init__(self,
                  sensitivity=0.45, audio_gain=1.0,
-                 hotword_callback=None, interrupt_check=None, record_callback=None, noising=None, silent_multiplier=1.0
+                 hotword_callback=None, interrupt_check=None, record_callback=None, noising=None, silent_multiplier=1.0,
+                 barge_in=None
                  ):
         super().__init__()
         self._snowboy_result = 0
+        self._snowboy_model_path = None
         self._interrupt_check = interrupt_check
         self._sensitivity = sensitivity
         self._hotword_callback = hotword_callback
@@ -91,6 +96,9 @@ class Recognizer(speech_recognition.Recognizer):
 
         self._noising = noising
         self._record_callback = record_callback
+        # Вернет True если речь без ключевого слова должна прервать терминал (он сейчас говорит)
+        self._barge_in = barge_in
+        self._barged = False
 
         silent_multiplier = min(5.0, max(0.1, silent_multiplier))
         self.pause_threshold *= silent_multiplier
@@ -113,9 +121,11 @@ class Recognizer(speech_recognition.Recognizer):
     def _get_detector(self, source, snowboy_configuration):
         if not snowboy_configuration:
             return None
-        snowboy_location, snowboy_hot_word_files = snowboy_configuration
+        snowboy_location, snowboy_hot_word_files, *sensitivity = snowboy_configuration
+        # Третий элемент - чувствительность для каждой модели
+        sensitivity = sensitivity[0] if sensitivity else self._sensitivity
         return SnowboyDetector(
-                snowboy_location, snowboy_hot_word_files, self._sensitivity, self._audio_gain,
+                snowboy_location, snowboy_hot_word_files, sensitivity, self._audio_gain,
                 source.SAMPLE_WIDTH, source.SAMPLE_RATE, self._webrtcvad
             )
 
@@ -123,6 +133,16 @@ class Recognizer(speech_recognition.Recognizer):
     def get_model(self):
         return self._snowboy_result
 
+    @property
+    def barged(self):
+        # Ожидание ключевого слова прервано речью пользователя во время воспроизведения
+        return self._barged
+
+    @property
+    def get_model_path(self):
+        # Путь до сработавшей модели, в отличие от индекса не зависит от перезагрузки моделей
+        return self._snowboy_model_path
+
     def __enter__(self):
         pass
 
@@ -140,6 +160,8 @@ class Recognizer(speech_recognition.Recognizer):
     # noinspection PyMethodOverriding
     def snowboy_wait_for_hot_word(self, snowboy, source, timeout=None):
         self._snowboy_result = 0
+        self._snowboy_model_path = None
+        self._barged = False
 
         elapsed_time = 0
         seconds_per_buffer = float(source.CHUNK) / source.SAMPLE_RATE
@@ -148,6 +170,7 @@ class Recognizer(speech_recognition.Recognizer):
         frames = collections.deque(maxlen=five_seconds_buffer_count)
         start_time = time.time() + 0.2
         snowboy_result = 0
+        speech_count = 0
         source.stream.deactivate()
         while True:
             elapsed_time += seconds_per_buffer
@@ -162,6 +185,12 @@ class Recognizer(speech_recognition.Recognizer):
                 break
             elif snowboy_result == -1:
                 raise RuntimeError("Error initializing streams or reading audio data")
+            elif self._barge_in:
+                # 0 - речь без ключевого слова, -2 - тишина
+                speech_count = speech_count + 1 if snowboy_result == 0 else 0
+                if speech_count >= self.BARGE_IN_BUFFERS and self._barge_in():
+                    self._barged = True
+                    break
 
             if time.time() > start_time:
                 if self._interrupt_check and self._interrupt_check():
@@ -174,6 +203,7 @@ class Recognizer(speech_recognition.Recognizer):
                 self._calc_noise(buffer, source.SAMPLE_WIDTH, seconds_per_buffer)
 
         self._snowboy_result = snowboy_result
+        self._snowboy_model_path = snowboy.model_path if snowboy_result > 0 else None
         if self._hotword_callback:
             self._hotword_callback()
         return source.stream.reactivate(frames), elapsed_time if elapsed_time < 5 else 5.0
@@ -250,7 +280,7 @@ class Recognizer(speech_recognition.Recognizer):
                 snowboy_configuration = None
                 elapsed_time += delta_time
                 if len(buffer) == 0: break  # reached end of the stream
-                frames.append(b''.join(buffer))
+                frames.extend(buffer)
 
             # read audio input until the phrase ends
             pause_count, phrase_count = 0, 0
@@ -288,10 +318,10 @@ class Recognizer(speech_recognition.Recognizer):
 
         # obtain frame data
         for i in range(pause_count - non_speaking_buffer_count): frames.pop()  # remove extra non-speaking frames at the end
-        frame_data = b"".join(frames)
         if self._record_callback and send_record_starting:
             self._record_callback(False)
-        return AudioData(frame_data, source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+        # Фреймы не склеиваем, AudioBuffer отдаст их в STT как есть
+        return AudioBuffer(frames, source.SAMPLE_RATE, source.SAMPLE_WIDTH)
 
     def listen2(self, source, timeout, phrase_time_limit, snowboy_configuration, recognition):
         assert isinstance(source, AudioSource), "Source must be an audio source"
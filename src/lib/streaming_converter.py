@@ -3,8 +3,8 @@ import subprocess
 import threading
 import wave
 from collections import deque
-from io import BytesIO
 
+from .audio_utils import AudioBuffer
 from .sr_wrapper import AudioData, get_flac_converter
 
 CMD = {
@@ -15,7 +15,6 @@ CMD = {
 
 
 class AudioConverter(threading.Thread):
-    IN_CHUNK_SIZE = 1024 * 8
     OUT_CHUNK_SIZE = 1024 * 4
     POPEN_TIMEOUT = 10
     JOIN_TIMEOUT = 10
@@ -63,12 +62,11 @@ class AudioConverter(threading.Thread):
                 break
 
     def _run_adata(self):
-        with BytesIO(self._adata.get_raw_data(self._sample_rate, self._sample_width)) as fp:
-            del self._adata
-            while True:
-                chunk = fp.read(self.IN_CHUNK_SIZE)
-                if not (chunk and self._processing(chunk)):
-                    break
+        adata = AudioBuffer.from_audio_data(self._adata)
+        del self._adata
+        for chunk in adata.iter_raw(self._sample_rate, self._sample_width):
+            if not self._processing(chunk):
+                break
 
     def _processing(self, data):
         if self._wave:
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import collections
+import json
 import socket
 import threading
 
@@ -9,10 +11,69 @@ from utils import Connect
 import logger
 
 
+class WSConnect(Connect):
+    """
+    Соединение терминала поверх WebSocket клиента, для MDTServer ничем не отличается от TCP.
+    Строки приходят сообщениями и копятся в очереди, ответы уходят сообщениями.
+    Строки одного клиента обрабатываются по порядку, поток занят только пока очередь не пуста.
+    """
+    def __init__(self, client, ip_info, work=True):
+        super().__init__(client, ip_info, work)
+        self._pending = collections.deque()
+        self._running = False
+        self._lock = threading.Lock()
+
+    def push(self, lines: list) -> bool:
+        # True - очередь никто не разбирает, нужно запустить обработку
+        with self._lock:
+            self._pending.extend(lines)
+            if self._running:
+                return False
+            self._running = True
+            return True
+
+    def pop(self) -> str or None:
+        with self._lock:
+            if self._pending and self._work and self._conn:
+                return self._pending.popleft()
+            self._running = False
+            return None
+
+    def settimeout(self, timeout):
+        pass
+
+    def read_frames(self):
+        raise RuntimeError('Binary frames are not supported over WebSocket')
+
+    def write_frames(self, frames):
+        raise RuntimeError('Binary frames are not supported over WebSocket')
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+
+    def _conn_sender(self, data):
+        if not data:
+            data = ''
+        elif isinstance(data, dict):
+            try:
+                data = json.dumps(data, ensure_ascii=False)
+            except TypeError as e:
+                raise RuntimeError(e)
+        elif isinstance(data, bytes):
+            data = data.decode(errors='replace')
+        elif not isinstance(data, str):
+            raise RuntimeError('Unsupported data type: {}'.format(repr(type(data))))
+        try:
+            self._conn.sendMessage(data)
+        except (BrokenPipeError, socket.timeout, InterruptedError, OSError) as e:
+            raise RuntimeError(e)
+
+
 class WSClient(WebSocket):
     def __init__(self, server, sock, address):
         super().__init__(server, sock, address)
-        self._proxy = None
+        self._conn = None
         self._first = True
 
     def _is_allow(self) -> bool:
@@ -29,74 +90,35 @@ class WSClient(WebSocket):
         return allow
 
     def handleMessage(self):
-        if self._proxy:
-            self._proxy.send(self.data)
+        if self._conn:
+            if isinstance(self.data, str):
+                # Как и в TCP, строки разделены \r\n, пустая строка завершает сеанс
+                self.server.dispatch(self._conn, self.data.split('\r\n'))
         elif self._is_allow():
-            try:
-                self._proxy = TCPProxy(self, self.server.remote)
-            except RuntimeError as e:
-                self.server.log('Proxy error: {}'.format(e))
-                self.sendMessage(logger.colored('Error connecting to terminal, bye.', logger.COLORS[logger.ERROR]))
-                self.close()
+            self._conn = WSConnect(self, self.address)
         else:
             self.close()
 
     def handleClose(self):
         self.close()
-        if self._proxy:
-            self._proxy.join()
-
-
-class TCPProxy(threading.Thread):
-    def __init__(self, client: WSClient, remote):
-        super().__init__()
-        self._client = client
-        conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        conn.settimeout(2)
-        try:
-            conn.connect(remote)
-        except (BrokenPipeError, ConnectionResetError, ConnectionRefusedError, OSError, socket.timeout) as e:
-            raise RuntimeError(e)
-        self._conn = Connect(conn, remote)
-        self._conn.r_wait()
-        self._work = True
-        self.start()
-
-    def send(self, msg: str):
-        if isinstance(msg, str):
-            try:
-                self._conn.write(msg)
-            except RuntimeError:
-                self.join()
-
-    def join(self, timeout=None):
-        if self._work:
-            self._work = False
+        if self._conn:
             self._conn.stop()
-            super().join(timeout)
-
-    def run(self):
-        while self._work:
-            for line in self._conn.read():
-                self._client.sendMessage(line)
-            self._conn.close()
-            self._client.close()
+            self._conn = None
 
 
 class WSServer(SimpleWebSocketServer):
-    def __init__(self, local, remote, allow, log):
-        if local == remote:
-            raise RuntimeError('Remote and local must be different: {}'.format(local))
-        self.remote = remote
+    def __init__(self, local, dispatch, allow, log):
+        # dispatch(conn, lines) - передает строки клиента в обработчик команд терминала
+        self.dispatch = dispatch
         self.allow = allow
         self.log = log
         super().__init__(*local, WSClient)
 
 
 class Server(threading.Thread):
-    def __init__(self, local=('', 8999), remote=('192.168.1.198', 7999), allow=None, log=print):
+    def __init__(self, local=('', 8999), dispatch=None, allow=None, log=print):
         super().__init__()
-        self._data = (local, remote, allow, log)
+        self._data = (local, dispatch, allow, log)
         self._log = log
         self._server = None
         self._work = False
@@ -28,6 +28,7 @@ class Loader(Owner):
         self._cfg = ConfigHandler(cfg=init_cfg, path=path, owner=self)
         self._logger = Logger(self._cfg['log'], self)
         self._cfg.configure(self._logger.add('CFG'))
+        self._pub.configure(self._logger.add('PubSub'))
 
         proxies.add_logger(self._logger.add('Proxy'))
 
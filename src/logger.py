@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
+import collections
+import gzip
 import logging
 import os
 import queue
+import shutil
+import tempfile
 import threading
 import time
-import zlib
 from logging.handlers import RotatingFileHandler
 
 from languages import LOGGER as LNG
@@ -60,13 +63,92 @@ def _namer(name):
     return name + '.gz'
 
 
-def _rotator(source, dest):
-    with open(source, 'rb') as sf:
-        data = sf.read()
-        compressed = zlib.compress(data, 9)
-        with open(dest, 'wb') as df:
-            df.write(compressed)
-    os.remove(source)
+class _Compressor(threading.Thread):
+    """
+    Сжатие ротированных логов в gzip в отдельном потоке, поток логгера на сжатии не блокируется.
+    rotate только переименовывает лог и открывает файл назначения, поэтому последующие ротации
+    (переименования .gz) не мешают еще идущему сжатию - запись идет в тот же файл под новым именем.
+    """
+    CHUNK = 1024 * 64
+
+    def __init__(self, log):
+        super().__init__(name='LogCompressor')
+        self.log = log
+        self.compress_lvl = 6
+        self._queue = queue.Queue()
+        self.start()
+
+    def rotate(self, source, dest):
+        try:
+            fd, raw = tempfile.mkstemp(prefix=os.path.basename(dest) + '.', suffix='.tmp', dir=os.path.dirname(dest))
+            os.close(fd)
+            os.replace(source, raw)
+            fp = open(dest, 'wb')
+        except OSError as e:
+            self.log('Logger', 'Rotation error {}: {}'.format(dest, e), ERROR)
+            return
+        self._queue.put_nowait((raw, fp, os.path.basename(source), self.compress_lvl))
+
+    def join(self, timeout=None):
+        # Доделываем все начатое
+        self._queue.put_nowait(None)
+        super().join(timeout)
+
+    def run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            raw, fp, name, lvl = data
+            try:
+                with fp, gzip.GzipFile(filename=name, mode='wb', compresslevel=lvl, fileobj=fp) as gz:
+                    with open(raw, 'rb') as sf:
+                        shutil.copyfileobj(sf, gz, self.CHUNK)
+                os.remove(raw)
+            except OSError as e:
+                self.log('Logger', 'Compression error {}: {}'.format(raw, e), ERROR)
+
+
+class LazyRepr:
+    """repr(obj)[:limit], считается только если сообщение действительно попадет в лог."""
+    __slots__ = ('obj', 'limit')
+
+    def __init__(self, obj, limit=None):
+        self.obj = obj
+        self.limit = limit
+
+    def __str__(self):
+        return repr(self.obj)[:self.limit]
+
+
+def _flight_message(msg):
+    # В самописце не держим живые объекты LazyRepr: repr на момент записи, а не выгрузки
+    if isinstance(msg, tuple) and msg and isinstance(msg[0], str):
+        return tuple(_flight_arg(x) for x in msg)
+    return _flight_arg(msg)
+
+
+def _flight_arg(arg):
+    # Исключение держит traceback со всеми фреймами - храним только текст
+    if isinstance(arg, BaseException):
+        return str(arg)
+    if not isinstance(arg, LazyRepr):
+        return arg
+    try:
+        return str(arg)
+    except Exception as e:
+        return '<repr error: {}>'.format(e)
+
+
+def format_message(msg) -> str:
+    # Текст сообщения лога, str или отложенного (fmt, *args). Обычно форматируется только в потоке логгера.
+    # Ошибка форматирования (несовпадение аргументов, repr с исключением) не должна убить поток логгера
+    if isinstance(msg, tuple) and msg and isinstance(msg[0], str):
+        try:
+            return msg[0].format(*msg[1:])
+        except Exception as e:
+            return '{} [format error: {}: {}]'.format(msg[0], type(e).__name__, e)
+    return msg
 
 
 class _LogWrapper:
@@ -81,9 +163,178 @@ class _LogWrapper:
         self._print(self.name, msg, lvl, module_name)
 
 
+class _Throttle:
+    """
+    Ограничение вывода для одного приемника лога.
+    Подряд идущие одинаковые сообщения сворачиваются в "Last message repeated N times",
+    а одного шаблона (модуль + текст или fmt отложенного сообщения) за WINDOW секунд выводится не больше limit.
+    Ошибки (ERROR и выше) лимитом не режутся, для них только сворачиваются повторы.
+    """
+    WINDOW = 60
+    MAX_KEYS = 1000
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._last = None
+        self._repeats = 0
+        self._repeats_time = 0
+        # (name, m_name, шаблон) -> [начало окна, выведено, подавлено, уровень]
+        self._counters = {}
+
+    def __call__(self, l_time, name, msg, lvl, m_name, template) -> list:
+        # Вернет записи (name, msg, lvl, m_name), которые нужно вывести
+        result = []
+        record = (name, msg, lvl, m_name)
+        if record == self._last:
+            if not self._repeats:
+                self._repeats_time = l_time
+            self._repeats += 1
+            return result
+        if self._repeats:
+            last = self._last
+            result.append((last[0], 'Last message repeated {} times'.format(self._repeats), last[2], last[3]))
+            self._repeats = 0
+        self._last = record
+        if lvl >= ERROR:
+            result.append(record)
+            return result
+
+        key = (name, m_name, template)
+        counter = self._counters.get(key)
+        if counter is None or l_time - counter[0] >= self.WINDOW:
+            if counter and counter[2]:
+                result.append((name, '{} similar messages suppressed'.format(counter[2]), counter[3], m_name))
+            if counter is None and len(self._counters) >= self.MAX_KEYS:
+                self._cleanup(l_time)
+            counter = self._counters[key] = [l_time, 0, 0, lvl]
+        if counter[1] < self.limit:
+            counter[1] += 1
+            result.append(record)
+        else:
+            counter[2] += 1
+        return result
+
+    def flush(self, l_time, force=False) -> list:
+        # Счетчики, окно которых закончилось (force - все). Иначе они ждут следующего сообщения
+        result = []
+        if self._repeats and (force or l_time - self._repeats_time >= self.WINDOW):
+            last = self._last
+            result.append((last[0], 'Last message repeated {} times'.format(self._repeats), last[2], last[3]))
+            self._repeats = 0
+        for key in [k for k, v in self._counters.items() if force or l_time - v[0] >= self.WINDOW]:
+            counter = self._counters.pop(key)
+            if counter[2]:
+                result.append((key[0], '{} similar messages suppressed'.format(counter[2]), counter[3], key[1]))
+        return result
+
+    def _cleanup(self, l_time):
+        # Забываем окна которые уже закончились
+        self._counters = {k: v for k, v in self._counters.items() if l_time - v[0] < self.WINDOW}
+
+
+def _throttle(limit) -> _Throttle or None:
+    return _Throttle(limit) if limit > 0 else None
+
+
+def _remote_options(data: str) -> tuple:
+    """
+    Параметры удаленного лога из данных команды remote_log, через ';':
+    raw - без цвета, уровень lvl=<debug|info|warn|error|crit>, name=<имя,имя> - только эти модули,
+    throttle=<N> - не больше N одинаковых сообщений в минуту и сворачивание повторов (по умолчанию выкл).
+    Например: remote_log:raw;lvl=warn;name=Server,STT. Неизвестное игнорируется.
+    """
+    raw, lvl, names, throttle = False, DEBUG, None, 0
+    for option in (data or '').split(';'):
+        key, _, value = option.strip().partition('=')
+        if key == 'raw':
+            raw = True
+        elif key == 'lvl':
+            lvl = LOG_LEVEL.get(value.lower(), DEBUG)
+        elif key == 'name' and value:
+            names = frozenset(x.strip() for x in value.split(',') if x.strip()) or None
+        elif key == 'throttle' and value.isdigit():
+            throttle = int(value)
+    return raw, lvl, names, throttle
+
+
+class _RemoteLog(threading.Thread):
+    """
+    Подписчик удаленного лога. Строки копятся в кольцевом буфере и отправляются из своего потока,
+    при переполнении выкидываются самые старые. Медленный клиент не тормозит Logger и других подписчиков.
+    """
+    RING_SIZE = 1000
+    SEND_TIMEOUT = 10
+
+    def __init__(self, conn: Connect, raw=False, lvl=DEBUG, names=None, throttle=0):
+        super().__init__(name='RemoteLog')
+        self.conn = conn
+        self.raw = raw
+        self.lvl = lvl
+        self.names = names
+        self.throttle = _throttle(throttle)
+        # Сколько строк выброшено из-за переполнения
+        self.dropped = 0
+        self._reported = 0
+        self._ring = collections.deque(maxlen=self.RING_SIZE)
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._work = True
+        self.conn.settimeout(self.SEND_TIMEOUT)
+
+    @property
+    def alive(self) -> bool:
+        return self._work
+
+    def accept(self, name, lvl, m_name) -> bool:
+        return lvl >= self.lvl and (self.names is None or name in self.names or m_name in self.names)
+
+    def put(self, line: str):
+        with self._lock:
+            if len(self._ring) == self.RING_SIZE:
+                self.dropped += 1
+            self._ring.append(line)
+        self._event.set()
+
+    def stop(self, line=None):
+        if line:
+            self.put(line)
+        self._work = False
+        self._event.set()
+
+    def run(self):
+        try:
+            while True:
+                if self._work:
+                    self._event.wait()
+                    self._event.clear()
+                with self._lock:
+                    lines = list(self._ring)
+                    self._ring.clear()
+                    dropped, self._reported = self.dropped - self._reported, self.dropped
+                if not lines and not self._work:
+                    break
+                if dropped:
+                    lines.insert(0, colored('... {} lines dropped'.format(dropped), COLORS[WARN]))
+                for line in lines:
+                    self.conn.write(line)
+        except RuntimeError:
+            self._work = False
+        finally:
+            try:
+                self.conn.close()
+            except RuntimeError:
+                pass
+
+
 class Logger(threading.Thread):
     REMOTE_LOG = 'remote_log'
     CHANNEL = 'net_block'
+    MAX_REMOTE = 8
+    FLIGHT_FILE = 'mdmterminal_flight.log'
+    # Автосохранение бортового самописца по CRIT не чаще раза в столько секунд
+    FLIGHT_DUMP_INTERVAL = 60
+    # Как часто (сек) выводить накопленные счетчики ограничения частоты
+    THROTTLE_FLUSH_INTERVAL = 5
 
     def __init__(self, cfg: dict, owner: Owner):
         super().__init__(name='Logger')
@@ -91,12 +342,24 @@ class Logger(threading.Thread):
         self.own = owner
         self.file_lvl = None
         self.print_lvl = None
+        self._file_throttle = None
+        self._print_throttle = None
         self.in_print = None
         self._handler = None
         self._app_log = None
-        self._conn = None
-        self._conn_raw = False
+        # Подписчики удаленного лога, _RemoteLog
+        self._remotes = []
+        # Минимальный уровень, нужный хоть кому-то из выводов. Сообщения ниже даже не попадают в очередь
+        self.min_lvl = DEBUG
+        # Бортовой самописец: последние записи всех уровней, (время, уровень, имя, модуль, сообщение).
+        # Пишется в потоке вызывающего до фильтра по min_lvl, поэтому не мешает ранней фильтрации.
+        # Отложенные сообщения форматируются только при выгрузке, но LazyRepr и исключения сводятся к строке сразу
+        self._flight = None
+        self._flight_lock = threading.Lock()
+        self._flight_dumped = 0
+        self._throttle_flushed = 0
         self._queue = queue.Queue()
+        self._compressor = _Compressor(self._print)
         self._init()
         self._print('Logger', 'start', INFO)
         self.start()
@@ -108,21 +371,33 @@ class Logger(threading.Thread):
         self._print('Logger', 'stop.', INFO)
         self._queue.put_nowait(None)
         super().join()
+        self._compressor.join()
 
     def run(self):
         while True:
-            data = self._queue.get()
+            try:
+                data = self._queue.get(timeout=self.THROTTLE_FLUSH_INTERVAL)
+            except queue.Empty:
+                data = 'flush'
+            now = time.time()
+            if now - self._throttle_flushed >= self.THROTTLE_FLUSH_INTERVAL:
+                self._throttle_flushed = now
+                self._flush_throttles(now)
             if isinstance(data, tuple):
                 self._best_print(*data)
             elif data is None:
                 break
+            elif data == 'flush':
+                continue
             elif data == 'reload':
                 self._init()
             elif isinstance(data, list) and len(data) == 3 and data[0] == 'remote_log':
                 self._add_connect(data[1], data[2])
             else:
                 self._print('Logger', 'Wrong data: {}'.format(repr(data)), ERROR)
-        self._close_connect()
+        self._flush_throttles(time.time(), True)
+        for remote in self._close_connect():
+            remote.join(remote.SEND_TIMEOUT)
 
     def permission_check(self):
         if not write_permission_check(self._cfg.get('file')):
@@ -131,9 +406,17 @@ class Logger(threading.Thread):
         return True
 
     def _init(self):
+        # Старые ограничители сейчас будут заменены, их счетчики выводим в старые приемники
+        self._flush_throttles(time.time(), True)
         self.file_lvl = get_loglvl(self._cfg.get('file_lvl', 'info'))
         self.print_lvl = get_loglvl(self._cfg.get('print_lvl', 'info'))
         self.in_print = self._cfg.get('method', 3) in [2, 3] and self.print_lvl <= CRIT
+        self._compressor.compress_lvl = min(9, max(0, self._cfg.get('compress_lvl', 6)))
+        self._file_throttle = _throttle(self._cfg.get('file_throttle', 0))
+        self._print_throttle = _throttle(self._cfg.get('print_throttle', 0))
+        flight_size = self._cfg.get('flight_recorder', 0)
+        with self._flight_lock:
+            self._flight = collections.deque(self._flight or (), maxlen=flight_size) if flight_size > 0 else None
         in_file = self._cfg.get('method', 3) in [1, 3] and self.file_lvl <= CRIT
 
         if self._cfg['remote_log']:
@@ -156,7 +439,7 @@ class Logger(threading.Thread):
             self._handler = RotatingFileHandler(filename=self._cfg.get('file'), maxBytes=1024 * 1024,
                                                 backupCount=2, delay=0
                                                 )
-            self._handler.rotator = _rotator
+            self._handler.rotator = self._compressor.rotate
             self._handler.namer = _namer
             self._handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
             self._handler.setLevel(logging.DEBUG)
@@ -166,33 +449,83 @@ class Logger(threading.Thread):
             self._app_log.propagate = False
             self._app_log.setLevel(logging.DEBUG)
             self._app_log.addHandler(self._handler)
+        self._update_min_lvl()
+
+    def _update_min_lvl(self):
+        levels = [remote.lvl for remote in self._remotes]
+        if self.in_print:
+            levels.append(self.print_lvl)
+        if self._app_log:
+            levels.append(self.file_lvl)
+        self.min_lvl = min(levels, default=CRIT + 1)
+
+    def flight_records(self) -> list:
+        # Содержимое бортового самописца, строками
+        with self._flight_lock:
+            records = list(self._flight or ())
+        return [self._to_flight(*record) for record in records]
+
+    def flight_dump(self) -> str:
+        """Сохраняет бортовой самописец в файл рядом с логом (или во временный каталог), вернет путь."""
+        log_file = self._cfg.get('file')
+        path = os.path.join(os.path.dirname(log_file) if log_file else tempfile.gettempdir(), self.FLIGHT_FILE)
+        try:
+            with open(path, 'w') as fp:
+                for line in self.flight_records():
+                    fp.write(line + '\n')
+        except OSError as e:
+            raise RuntimeError('Error saving flight recorder to {}: {}'.format(path, e))
+        return path
+
+    @staticmethod
+    def _to_flight(l_time, lvl, name, m_name, msg) -> str:
+        if m_name:
+            name = '{}->{}'.format(name, m_name)
+        time_ = time.strftime('%Y.%m.%d %H:%M:%S', time.localtime(l_time))
+        msg = format_message(msg)
+        return '{}.{:03d} {} {}: {}'.format(time_, int(l_time * 1000 % 1000), LVL_NAME[lvl], name, msg)
+
+    def _flight_auto_dump(self, l_time):
+        if l_time - self._flight_dumped < self.FLIGHT_DUMP_INTERVAL:
+            return
+        self._flight_dumped = l_time
+        try:
+            self._print('Logger', 'Flight recorder saved to {}'.format(self.flight_dump()), WARN)
+        except RuntimeError as e:
+            self._print('Logger', e, ERROR)
 
     def _add_remote_log(self, _, data, lock, conn: Connect):
         try:
             # Забираем сокет у сервера
             conn_ = conn.extract()
             if conn_:
-                conn_.settimeout(None)
-                self._queue.put_nowait(['remote_log', conn_, data == 'raw'])
+                self._queue.put_nowait(['remote_log', conn_, data])
         finally:
             lock()
 
-    def _add_connect(self, conn, raw):
-        self._close_connect()
-        self._conn = conn
-        self._conn_raw = raw
-        self._print('Logger', 'OPEN REMOTE LOG FOR {}:{}'.format(self._conn.ip, self._conn.port), WARN)
-
-    def _close_connect(self):
-        if self._conn:
-            try:
-                self._conn.write(colored('CLOSE REMOTE LOG, BYE.', COLORS[INFO]))
-                self._conn.close()
-            except RuntimeError:
-                pass
-            finally:
-                self._print('Logger', 'CLOSE REMOTE LOG FOR {}:{}'.format(self._conn.ip, self._conn.port), WARN)
-            self._conn = None
+    def _add_connect(self, conn, data):
+        remote = _RemoteLog(conn, *_remote_options(data))
+        remote.start()
+        self._remotes.append(remote)
+        self._print('Logger', 'OPEN REMOTE LOG FOR {}:{}'.format(conn.ip, conn.port), WARN)
+        if len(self._remotes) > self.MAX_REMOTE:
+            # Лишний - самый старый
+            self._close_remote(self._remotes.pop(0))
+        self._update_min_lvl()
+
+    def _close_remote(self, remote: _RemoteLog):
+        remote.stop(colored('CLOSE REMOTE LOG, BYE.', COLORS[INFO]))
+        msg = 'CLOSE REMOTE LOG FOR {}:{}'.format(remote.conn.ip, remote.conn.port)
+        if remote.dropped:
+            msg = '{}, {} lines dropped'.format(msg, remote.dropped)
+        self._print('Logger', msg, WARN)
+
+    def _close_connect(self) -> list:
+        remotes, self._remotes = self._remotes, []
+        for remote in remotes:
+            self._close_remote(remote)
+        self._update_min_lvl()
+        return remotes
 
     def add(self, name):
         return _LogWrapper(name, self._print).p
@@ -201,28 +534,63 @@ class Logger(threading.Thread):
         _ = _LogWrapper(name, self._print)
         return _.p, _.mp
 
-    def _print(self, *args):
-        self._queue.put_nowait((time.time(), *args))
+    def _print(self, name, msg, lvl, m_name=''):
+        l_time = time.time()
+        if self._flight is not None:
+            # Без форматирования, только снимок аргументов
+            record = (l_time, lvl, name, m_name, _flight_message(msg))
+            with self._flight_lock:
+                if self._flight is not None:
+                    self._flight.append(record)
+        # Проверка до очереди: сообщения, которые никто не выведет, не форматируются.
+        # CRIT идет в очередь всегда - по нему сохраняется самописец
+        if lvl >= self.min_lvl or lvl >= CRIT:
+            self._queue.put_nowait((l_time, name, msg, lvl, m_name))
 
     def _best_print(self, l_time, name, msg, lvl, m_name=''):
         if lvl not in COLORS:
             raise RuntimeError('Incorrect log level:{}'.format(lvl))
+        if lvl >= CRIT and self._flight is not None:
+            self._flight_auto_dump(l_time)
+        # Шаблон для ограничения частоты: fmt отложенного сообщения или сам текст
+        text = format_message(msg)
+        template = msg[0] if text is not msg else str(text)
+        msg = text
         print_line = None
         if self.in_print and lvl >= self.print_lvl:
-            print_line = self._to_print(name, msg, lvl, l_time, m_name)
-            print(print_line)
-        if self._conn:
-            if self._conn_raw:
-                print_line = self._to_print_raw(name, msg, lvl, l_time, m_name)
-            elif print_line is None:
+            if self._print_throttle:
+                for record in self._print_throttle(l_time, name, msg, lvl, m_name, template):
+                    print(self._to_print(record[0], record[1], record[2], l_time, record[3]))
+            else:
                 print_line = self._to_print(name, msg, lvl, l_time, m_name)
-            self._to_remote_log(print_line)
+                print(print_line)
+        if self._remotes:
+            self._to_remote_log(print_line, name, msg, lvl, l_time, m_name, template)
         if self._app_log and lvl >= self.file_lvl:
-            if m_name:
-                name = '{}->{}'.format(name, m_name)
-            self._to_file(name, msg, lvl)
-
-    def _to_file(self, name, msg, lvl):
+            if self._file_throttle:
+                for record in self._file_throttle(l_time, name, msg, lvl, m_name, template):
+                    self._to_file(*record)
+            else:
+                self._to_file(name, msg, lvl, m_name)
+
+    def _flush_throttles(self, l_time, force=False):
+        if self._print_throttle:
+            for record in self._print_throttle.flush(l_time, force):
+                if self.in_print:
+                    print(self._to_print(record[0], record[1], record[2], l_time, record[3]))
+        if self._file_throttle:
+            for record in self._file_throttle.flush(l_time, force):
+                if self._app_log:
+                    self._to_file(*record)
+        for remote in self._remotes:
+            if remote.throttle and remote.alive:
+                to_line = self._to_print_raw if remote.raw else self._to_print
+                for record in remote.throttle.flush(l_time, force):
+                    remote.put(to_line(record[0], record[1], record[2], l_time, record[3]))
+
+    def _to_file(self, name, msg, lvl, m_name):
+        if m_name:
+            name = '{}->{}'.format(name, m_name)
         self._app_log.log(lvl, '{}: {}'.format(name, msg))
 
     def _to_print(self, name, msg, lvl, l_time, m_name) -> str:
@@ -241,9 +609,26 @@ class Logger(threading.Thread):
             time_ += '.{:03d}'.format(int(l_time * 1000 % 1000))
         return '{} {} {}{}: {}'.format(time_, LVL_NAME[lvl], name, m_name, msg)
 
-    def _to_remote_log(self, line: str):
-        if self._conn:
-            try:
-                self._conn.write(line)
-            except RuntimeError:
-                self._close_connect()
+    def _to_remote_log(self, print_line, name, msg, lvl, l_time, m_name, template):
+        # Только кладет строку в буферы подписчиков, каждый формат собирается один раз
+        raw_line = None
+        for remote in self._remotes:
+            if not remote.alive:
+                self._close_remote(remote)
+            elif not remote.accept(name, lvl, m_name):
+                continue
+            elif remote.throttle:
+                to_line = self._to_print_raw if remote.raw else self._to_print
+                for record in remote.throttle(l_time, name, msg, lvl, m_name, template):
+                    remote.put(to_line(record[0], record[1], record[2], l_time, record[3]))
+            elif remote.raw:
+                if raw_line is None:
+                    raw_line = self._to_print_raw(name, msg, lvl, l_time, m_name)
+                remote.put(raw_line)
+            else:
+                if print_line is None:
+                    print_line = self._to_print(name, msg, lvl, l_time, m_name)
+                remote.put(print_line)
+        if not all(remote.alive for remote in self._remotes):
+            self._remotes = [remote for remote in self._remotes if remote.alive]
+            self._update_min_lvl()
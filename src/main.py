@@ -33,10 +33,13 @@ CFG = {  # Дефолтные настройки https://github.com/Aculeasis/md
         'phrase_time_limit': 15,
         'silent_multiplier': 1.0,
         'no_background_play': False,
+        'audio_sink': False,
         'chrome_mode': 1,
         'chrome_choke': False,
+        'barge_in': 0,
         'chrome_alarmstt': False,
         'webrtcvad': 0,
+        'trim_silence': 0,
         'lang': 'ru',
         'lang_check': False,
     },
@@ -65,6 +68,11 @@ CFG = {  # Дефолтные настройки https://github.com/Aculeasis/md
         'remote_log': True,
         'print_ms': True,
         'method': 3,
+        'compress_lvl': 6,
+        'file_throttle': 20,
+        'print_throttle': 0,
+        # Бортовой самописец, записей всех уровней. 0 - выключен
+        'flight_recorder': 2000,
         'file': '',
     },
     'yandex': {
@@ -109,6 +117,7 @@ CFG = {  # Дефолтные настройки https://github.com/Aculeasis/md
         'allow': ''
     },
     'persons': {},
+    'sensitivity': {},
     'proxy': {
         'enable': 0,
         'monkey_patching': True,
@@ -139,7 +148,7 @@ CFG = {  # Дефолтные настройки https://github.com/Aculeasis/md
         'ns_lvl': 0,
     },
     'system': {
-        'ini_version': 23,
+        'ini_version': 30,
         'ws_token': 'token_is_unset'
     }
 }
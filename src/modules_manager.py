@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import importlib
+import itertools
 import sys
 import threading
 from collections import OrderedDict
@@ -358,8 +359,9 @@ class ModuleManager:
                 result = reply.text
                 asking = f  # можно заменить на f.__name__ если передача ссылки на объект станет невозможной
             elif reply_type is SayLow:
-                for text in reply.iter():
-                    self.own.say(*text)
+                # Подряд идущие фразы с одинаковыми параметрами - одной цепочкой
+                for params, texts in itertools.groupby(reply.iter(), key=lambda x: tuple(x[1:])):
+                    self.own.say_chain([text[0] for text in texts], *params)
         return result, asking
 
     def _call_func(self, f, *args):
@@ -367,7 +369,7 @@ class ModuleManager:
             self._module_name = f.__name__
         except AttributeError:
             self._module_name = str(f)
-        self._log(LNG['catch'].format(f), logger.DEBUG)
+        self._log((LNG['catch'], f), logger.DEBUG)
         return f(self, *args)
 
     def _call_this(self, obj, *args):
@@ -91,7 +91,7 @@ class MPDControl(threading.Thread):
         try:
             self._mpd.connect(self._cfg['ip'], self._cfg['port'])
         except (mpd.MPDError, IOError) as e:
-            self.log('{}: {}'.format(LNG['err_mpd'], e), logger.ERROR)
+            self.log(('{}: {}', LNG['err_mpd'], e), logger.ERROR)
             self.is_conn = False
             return False
         else:
@@ -147,8 +147,9 @@ class MPDControl(threading.Thread):
 
     @property
     def plays(self):
-        # MPD что-то играет
-        return self.allow() and self._mpd_is_play()
+        # MPD что-то играет. Дергается очень часто (Owner.noising), поэтому без запроса к MPD -
+        # состояние обновляет _callbacks_event после каждой команды и раз в 0.9 сек
+        return self.allow() and self._saved_state == 'play'
 
     def pause(self, paused=None):
         if not self.allow():
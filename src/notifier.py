@@ -12,6 +12,12 @@ from utils import REQUEST_ERRORS, RuntimeErrorTrace
 
 
 class MajordomoNotifier(threading.Thread):
+    # Каждое событие - HTTP запрос, частые изменения состояния и короткие start/stop объединяем
+    COALESCE = {
+        'mpd_status': 0.5, 'volume': 0.5, 'mpd_volume': 0.5,
+        'start_record': 0.3, 'start_talking': 0.3,
+    }
+
     def __init__(self, cfg, log, owner: Owner):
         super().__init__(name='Notifier')
         self._cfg = cfg
@@ -29,7 +35,7 @@ class MajordomoNotifier(threading.Thread):
     def _subscribe(self):
         # Подписываемся на нужные события, если нужно
         if self._allow_notify:
-            self.own.subscribe(self._events, self._callback)
+            self.own.subscribe(self._events, self._callback, coalesce=self.COALESCE)
 
     def _unsubscribe(self):
         self.own.unsubscribe(self._events, self._callback)
@@ -1,21 +1,24 @@
 from lib.volume import get_volume
-from utils import state_cache
 
 
 class Owner:
-    def subscribe(self, event, callback, channel='default') -> bool:
+    def subscribe(self, event, callback, channel='default', coalesce=None) -> bool:
         """
         Оформление подписки на событие или события. Можно подписаться сразу на много событий или
         подписать много коллбэков на одно событие передав их списком, но передать сразу 2 списка нельзя.
-        Важно: Вызываемый код не должен выполняться долго т.к. он заблокирует другие коллбэки.
+        Коллбэки вызываются в пуле потоков, у каждого коллбэка вызовы идут по порядку.
+        Долгий коллбэк задерживает только свои вызовы, но занимает поток пула и попадет в лог.
 
         :param event: не пустое имя события в str или список событий.
         :param callback: ссылка на объект который можно вызвать или список таких объектов,
         при вызове передаются: имя события, *args, **kwargs.
         :param channel: канал.
+        :param coalesce: объединение частых событий, dict {событие: секунды}.
+        Для start_* пара start_*/stop_* короче заданного времени не вызывается совсем,
+        для остальных событий за это время будет только один вызов с последним значением.
         :return: будет ли оформлена подписка.
         """
-        return self._pub.subscribe(event, callback, channel)
+        return self._pub.subscribe(event, callback, channel, coalesce)
 
     def unsubscribe(self, event, callback, channel='default') -> bool:
         """
@@ -55,6 +58,9 @@ class Owner:
     def say(self, msg: str, lvl: int=2, alarm=None, wait=0, is_file: bool = False, blocking: int=0):
         self._play.say(msg, lvl, alarm, wait, is_file, blocking)
 
+    def say_chain(self, msgs: list, lvl: int=2, alarm=None, wait=0):
+        self._play.say_chain(msgs, lvl, alarm, wait)
+
     def play(self, file, lvl: int=2, wait=0, blocking: int=0):
         self._play.play(file, lvl, wait, blocking)
 
@@ -76,13 +82,24 @@ class Owner:
     def really_busy(self) -> bool:
         return self._play.really_busy()
 
-    @state_cache(interval=0.008)
+    def echo_cancellation(self) -> bool:
+        return self._play.echo_cancellation()
+
     def noising(self) -> bool:
         return self._play.noising()
 
+    def wait_idle(self, timeout, event=None) -> bool:
+        return self._play.wait_idle(timeout, event)
+
     def kill_popen(self):
         self._play.kill_popen()
 
+    def flight_records(self) -> list:
+        return self._logger.flight_records()
+
+    def flight_dump(self) -> str:
+        return self._logger.flight_dump()
+
     def listen(self, hello: str = '', deaf: bool = True, voice: bool = False) -> str:
         return self._stt.listen(hello, deaf, voice)
 
@@ -215,6 +232,9 @@ class Owner:
                 # reload models. Reload terminal - later
                 self._cfg.models_load()
                 reload_terminal = True
+            if is_sub_dict('sensitivity', diff):
+                # per-model sensitivity. Reload terminal - later
+                reload_terminal = True
             if is_sub_dict('log', diff):
                 # reload logger
                 self._logger.reload()
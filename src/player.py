@@ -1,20 +1,25 @@
 #!/usr/bin/env python3
 
 
+import collections
 import os
 import queue
 import subprocess
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import logger
 from languages import PLAYER as LNG
 from lib import linux_play
+from lib.audio_sink import AudioSink
+from lib.audio_utils import APMSettings, APMReverseStream
 from owner import Owner
 
 
 class Player:
     MAX_BUSY_WAIT = 300  # Макс время блокировки, потом отлуп. Поможет от возможных зависаний
+    EARCONS = ('ding', 'dong', 'bimp')
 
     def __init__(self, cfg, log, owner: Owner):
         self._cfg = cfg
@@ -23,12 +28,29 @@ class Player:
         # 0 - играем в фоне, до 5 снимаем блокировку автоматически. 5 - монопольный режим, нужно снять блокировку руками
         self._lvl = 0
         self._only_one = threading.Lock()
+        # События ожидающих освобождения плеера, см. wait_idle
+        self._idle_lock = threading.Lock()
+        self._idle_waiters = set()
         self._work = False
         self._popen = None
-        self._lp_play = LowPrioritySay(self._wait_popen, self.say, self.play)
+        self._sink = None
+        # path -> PCM, звуки активации декодируются один раз при старте
+        self._earcons = {}
+        self._lp_play = LowPrioritySay(self._wait_popen, self.say, self.play, self.own.tts)
 
     def start(self):
         self._work = True
+        if self._cfg.gts('audio_sink'):
+            try:
+                self._sink = AudioSink(self.log, reference=self._echo_reference())
+            except RuntimeError as e:
+                self.log('Audio sink disabled, fallback to subprocess players: {}'.format(e), logger.WARN)
+            else:
+                self._sink.start()
+                self._earcons_load()
+        if self._cfg.gts('barge_in') == 2 and not self.echo_cancellation():
+            msg = 'barge_in 2 requires audio_sink and APM echo cancellation (aec_type), barge_in 1 will be used'
+            self.log(msg, logger.WARN)
         self._lp_play.start()
         self.log('start.', logger.INFO)
 
@@ -41,9 +63,38 @@ class Player:
         self._wait_popen(10)
         self.quiet()
         self.kill_popen()
+        if self._sink:
+            metrics = self._sink.metrics
+            self._sink.stop()
+            self.log('Audio sink: {} sounds, avg time to first sample {} ms'.format(
+                metrics['count'], int(metrics['ttfs'] * 1000)), logger.DEBUG)
 
         self.log('stop.', logger.INFO)
 
+    def echo_cancellation(self) -> bool:
+        # Из микрофона вычитается звук терминала: AudioSink отдает опорный сигнал и AEC включен
+        return bool(self._sink and self._sink.reference and APMSettings().aec)
+
+    def _echo_reference(self):
+        # Для barge-in микрофон слушает во время воспроизведения, APM вычитает из него то, что играем
+        if not (self._cfg.gts('barge_in') and APMSettings().aec):
+            return None
+        return APMReverseStream(AudioSink.WIDTH, AudioSink.RATE)
+
+    def _earcons_load(self):
+        for name in self.EARCONS:
+            path = self._cfg.path[name]
+            try:
+                pcm = self._sink.decode(os.path.splitext(path)[1], path)
+            except RuntimeError as e:
+                self.log('Earcon {} not preloaded: {}'.format(name, e), logger.WARN)
+                continue
+            if pcm:
+                self._earcons[path] = pcm
+        if self._earcons:
+            self.log('Preloaded earcons: {}, {} KB'.format(
+                len(self._earcons), sum(len(x) for x in self._earcons.values()) // 1024), logger.DEBUG)
+
     def set_lvl(self, lvl):
         if lvl > 1:
             self._lp_play.clear()
@@ -54,7 +105,7 @@ class Player:
             self._lvl = lvl
             self.quiet()
             return True
-        self._only_one.release()
+        self._release()
         return False
 
     def get_lvl(self):
@@ -92,6 +143,42 @@ class Player:
         self._lp_play.clear()
         self.kill_popen()
 
+    def wait_idle(self, timeout, event=None) -> bool:
+        """
+        Блокируется пока плеер занят (really_busy), но не дольше timeout.
+        event - прервать ожидание раньше, его можно выставить из другого потока.
+        Вернет True если плеер свободен.
+        """
+        event = event or threading.Event()
+        with self._idle_lock:
+            if not self.really_busy():
+                return True
+            self._idle_waiters.add(event)
+        try:
+            event.wait(timeout)
+        finally:
+            with self._idle_lock:
+                self._idle_waiters.discard(event)
+        return not self.really_busy()
+
+    def _release(self):
+        self._only_one.release()
+        self._notify_idle()
+
+    def _notify_idle(self):
+        with self._idle_lock:
+            if self._idle_waiters and not self.really_busy():
+                for event in self._idle_waiters:
+                    event.set()
+
+    def _finished(self, callback):
+        # Конец воспроизведения будит ждущих в wait_idle
+        def _callback(state):
+            if callback:
+                callback(state)
+            self._notify_idle()
+        return _callback
+
     def popen_work(self):
         return self._popen is not None and self._popen.poll() is None
 
@@ -119,7 +206,7 @@ class Player:
         self._play(file)
         if blocking:
             self._wait_popen(blocking)
-        self._only_one.release()
+        self._release()
 
         if wait:
             time.sleep(wait)
@@ -141,18 +228,59 @@ class Player:
         if alarm is None:
             alarm = self._cfg.gts('alarmtts')
 
-        file = self.own.tts(msg) if not is_file else msg
+        # Список фраз (см. say_chain) синтезируется по ходу воспроизведения
+        file = self.own.tts(msg) if not (is_file or isinstance(msg, list)) else msg
         if alarm:
             self._play(self._cfg.path['dong'])
             self._wait_popen()
-        self._play(file, self.own.say_callback)
+        if isinstance(file, list):
+            self._play_chain(file, self.own.say_callback)
+        else:
+            self._play(file, self.own.say_callback)
         if blocking:
             self._wait_popen(blocking)
-        self._only_one.release()
+        self._release()
 
         if wait:
             time.sleep(wait)
 
+    def say_chain(self, msgs: list, lvl: int=2, alarm=None, wait=0):
+        """
+        Несколько фраз подряд. С AudioSink они играют одним непрерывным потоком:
+        синтез всех фраз запускается сразу, каждая идет в устройство сразу за предыдущей.
+        """
+        if not self._sink or len(msgs) < 2:
+            for msg in msgs:
+                self.say(msg, lvl, alarm, wait)
+            return
+        self.say(list(msgs), lvl, alarm, wait)
+
+    def _play_chain(self, msgs: list, callback):
+        if self._popen:
+            self._popen.kill()
+        self.log('Play chain of {} phrases'.format(len(msgs)), logger.DEBUG)
+        # Синтез всех фраз запускается сразу, до LowPrioritySay.LOOKAHEAD + 1 параллельно.
+        # Поток AudioSink только ждет уже запущенные результаты и сам ничего не синтезирует
+        pool = ThreadPoolExecutor(LowPrioritySay.LOOKAHEAD + 1)
+        futures = [pool.submit(self.own.tts, msg) for msg in msgs]
+        pool.shutdown(wait=False)
+        self._popen = self._sink.play_chain(self._chain_parts(futures), self._finished(callback))
+
+    def _chain_parts(self, futures: list):
+        # Вызывается из потока AudioSink
+        try:
+            for future in futures:
+                path, stream, ext = future.result()()
+                ext = ext or os.path.splitext(path)[1]
+                if stream is None and not os.path.isfile(path):
+                    self.log(LNG['file_not_found'].format(path), logger.ERROR)
+                    continue
+                yield ext, stream or path, stream is not None
+        finally:
+            # Цепочку прервали - не начатый синтез уже не нужен
+            for future in futures:
+                future.cancel()
+
     def _play(self, obj, callback=None):
         if isinstance(obj, str):
             (path, stream, ext) = obj, None, None
@@ -164,26 +292,45 @@ class Player:
             raise RuntimeError('Get unknown object: {}'.format(str(obj)))
         if self._popen:
             self._popen.kill()
+        if stream is None and path in self._earcons:
+            self.log(LNG['play'].format(path), logger.DEBUG)
+            self._popen = self._sink.play_pcm(path, self._earcons[path], self._finished(callback))
+            return
         ext = ext or os.path.splitext(path)[1]
         if not stream and not os.path.isfile(path):
             return self.log(LNG['file_not_found'].format(path), logger.ERROR)
         if ext not in linux_play.CMD:
             return self.log(LNG['unknown_type'].format(ext), logger.CRIT)
         if stream is None:
-            self.log(LNG['play'].format(path, logger.DEBUG))
-            self._popen = linux_play.get_popen(ext, path, False, callback)
+            self.log(LNG['play'].format(path), logger.DEBUG)
+            self._popen = self._get_popen(ext, path, False, callback)
         else:
-            self.log(LNG['stream'].format(path, logger.DEBUG))
-            self._popen = linux_play.get_popen(ext, stream, True, callback)
+            self.log(LNG['stream'].format(path), logger.DEBUG)
+            self._popen = self._get_popen(ext, stream, True, callback)
+
+    def _get_popen(self, ext, fp_or_file, stream, callback):
+        callback = self._finished(callback)
+        if self._sink:
+            return self._sink.play(ext, fp_or_file, stream, callback)
+        return linux_play.get_popen(ext, fp_or_file, stream, callback)
 
 
 class LowPrioritySay(threading.Thread):
-    def __init__(self, wait_popen, say, play):
+    LOOKAHEAD = 2  # Сколько следующих фраз синтезировать заранее, пока играет текущая
+
+    def __init__(self, wait_popen, say, play, tts):
         super().__init__(name='LowPrioritySay')
         self._play = play
         self._say = say
+        self._tts = tts
         self._wait_popen = wait_popen
+        # (эпоха, элемент), эпоха - на момент постановки
         self._queue_in = queue.Queue()
+        # Уже взятые из очереди (эпоха, элемент), для фраз синтез запущен
+        self._ahead = collections.deque()
+        self._lock = threading.Lock()
+        # Меняется при clear, все поставленное до него выбрасывается
+        self._epoch = 0
         self._work = False
 
     def start(self):
@@ -196,11 +343,17 @@ class LowPrioritySay(threading.Thread):
         self.join()
 
     def clear(self):
-        while not self._queue_in.empty():
-            try:
-                self._queue_in.get_nowait()
-            except queue.Empty:
-                pass
+        with self._lock:
+            self._epoch += 1
+            self._ahead.clear()
+            stop = False
+            while not self._queue_in.empty():
+                try:
+                    stop |= self._queue_in.get_nowait() is None
+                except queue.Empty:
+                    pass
+            if stop:
+                self._queue_in.put_nowait(None)
 
     def say(self, msg: str, wait: float or int=0, is_file: bool = False):
         self._put(1 if not is_file else 3, msg, wait)
@@ -209,15 +362,57 @@ class LowPrioritySay(threading.Thread):
         self._put(2, file, wait)
 
     def _put(self, action, target, wait):
-        self._queue_in.put_nowait([action, target, wait])
+        with self._lock:
+            self._queue_in.put_nowait((self._epoch, [action, target, wait]))
 
     def run(self):
         while self._work:
-            say = self._queue_in.get()
-            self._wait_popen()
-            if say is None or not self._work:
+            item = self._next()
+            if item is None or not self._work:
                 break
+            epoch, say = item
+            say = self._prepare(say)
+            self._wait_popen()
+            if epoch != self._epoch:
+                continue
             if say[0] in [1, 3]:
                 self._say(msg=say[1], lvl=1, wait=say[2], is_file=say[0] == 3)
             elif say[0] == 2:
                 self._play(file=say[1], lvl=1, wait=say[2])
+            self._prefetch()
+
+    def _next(self) -> tuple or None:
+        while True:
+            with self._lock:
+                if self._ahead:
+                    return self._ahead.popleft()
+            item = self._queue_in.get()
+            if item is None or item[0] == self._epoch:
+                return item
+            # Поставлен до clear, а забран уже после
+
+    def _prefetch(self):
+        # Пока играет текущая фраза, запускаем синтез следующих
+        while self._work and len(self._ahead) < self.LOOKAHEAD:
+            try:
+                item = self._queue_in.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                with self._lock:
+                    self._ahead.append(None)
+                break
+            if item[0] != self._epoch:
+                continue
+            item = item[0], self._prepare(item[1])
+            with self._lock:
+                if item[0] != self._epoch:
+                    break
+                self._ahead.append(item)
+
+    def _prepare(self, say):
+        # Текст -> получатель уже запущенного синтеза, Player._play примет его как файл
+        # Цепочку фраз синтезирует сам Player.say
+        if say[0] != 1 or isinstance(say[1], list):
+            return say
+        return [3, self._tts(say[1]), say[2]]
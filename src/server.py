@@ -1,15 +1,19 @@
 #!/usr/bin/env python3
 
+import hashlib
 import json
 import os
 import socket
+import tempfile
 import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 import logger
 from languages import SERVER as LNG
 from owner import Owner
-from utils import file_to_base64, base64_to_bytes, pretty_time, Connect
+from utils import file_to_base64, base64_to_bytes, pretty_time, Connect, file_sha256, file_chunks
 
 try:
     from lib.ws_proxy import Server as WSProxy
@@ -28,6 +32,14 @@ class MDTServer(threading.Thread):
     # Вызов: соманда, данные, блокировка, коннектор
     # Нужно вызывать блокировку, что бы сервер отлип и продолжил свою работу.
     NET_BLOCK = 'net_block'
+    BACKLOG = 16  # Очередь ожидающих accept соединений
+    WORKERS = 8  # Одновременно обрабатываемых соединений
+    CONN_TIMEOUT = 5.0
+    MODEL_CHUNK = 1024 * 64  # Размер фрейма при бинарной передаче модели
+    MODEL_MAX_SIZE = 1024 * 1024 * 64
+    SESSION_TIMEOUT = 60.0  # Сессия без команд (и ping) дольше этого закрывается
+    # Сессия держит поток пула до таймаута, часть потоков всегда остается под обычные соединения и WS
+    MAX_SESSIONS = WORKERS // 2
 
     def __init__(self, cfg, log, owner: Owner):
         super().__init__(name='MDTServer')
@@ -57,6 +69,10 @@ class MDTServer(threading.Thread):
             'recv_model': self._api_recv_model,
             'list_models': self._api_list_models,
             'ping': self._api_ping,
+            'session': self._api_session,
+            'send_model_bin': self._api_send_model_bin,
+            'recv_model_bin': self._api_recv_model_bin,
+            'flight_log': self._api_flight_log,
         }
         self._cfg = cfg
         (self.log, ws_log) = log
@@ -65,14 +81,20 @@ class MDTServer(threading.Thread):
         self.work = False
         self._local = ('', 7999)
         self._ws_proxy = None
+        self._pool = None
+        # Места в пуле: обрабатываемые и ждущие очереди. Сверх этого новые соединения не принимаются
+        self._slots = threading.BoundedSemaphore(self.WORKERS + self.BACKLOG)
         self._socket = socket.socket()
-        self._conn = Connect(None, None)
-        self._lock = Unlock()
+        # Активные соединения: Connect -> Unlock. У каждого свое состояние и своя блокировка
+        self._conns = {}
+        self._conns_lock = threading.Lock()
 
     def join(self, timeout=None):
         self.work = False
-        self._conn.stop()
-        self._lock()
+        with self._conns_lock:
+            for conn, lock in self._conns.items():
+                conn.stop()
+                lock()
         self.log('stopping...')
         super().join(timeout)
         self.log('stop.', logger.INFO)
@@ -86,13 +108,54 @@ class MDTServer(threading.Thread):
         if WS_ERROR:
             self.log('WSProxy error: {}'.format(WS_ERROR), logger.WARN)
             return
-        self._ws_proxy = WSProxy(remote=self._local, allow=self._ws_allow, log=self._ws_log)
+        self._ws_proxy = WSProxy(dispatch=self._ws_message, allow=self._ws_allow, log=self._ws_log)
         self._ws_proxy.start()
 
     def _ws_stop(self):
         if self._ws_proxy:
             self._ws_proxy.join(20)
 
+    def _ws_message(self, conn, lines: list):
+        # Вызывается из потока WS сервера, команды разбираются в пуле как и для TCP соединений
+        if not conn.push(lines):
+            return
+        try:
+            if not self.work:
+                raise RuntimeError('server stopped')
+            if not self._slots.acquire(blocking=False):
+                # Поток WS сервера ждать не может, отказываем сразу
+                self.log('WS connection {} rejected: server busy'.format(conn.ip), logger.WARN)
+                conn.write('error:server busy')
+                raise RuntimeError('server busy')
+            self._submit(self._ws_handle, conn)
+        except RuntimeError:
+            # Пул уже остановлен или занят, обслужить клиента некому. Иначе его сообщения копились бы молча
+            conn.stop()
+            conn.close()
+
+    def _ws_handle(self, conn):
+        lock = Unlock()
+        with self._conns_lock:
+            self._conns[conn] = lock
+        try:
+            line = conn.pop()
+            while line is not None:
+                if not line:
+                    # Пустая строка завершает сеанс
+                    conn.stop()
+                    conn.close()
+                    break
+                self._parse(line, conn, lock)
+                line = conn.pop()
+        except Exception as e:
+            # Очередь клиента осталась помеченной как разбираемая, новые сообщения пропадали бы - закрываем
+            self.log('WS connection {} error: {}'.format(conn.ip, e), logger.ERROR)
+            conn.stop()
+            conn.close()
+        finally:
+            with self._conns_lock:
+                del self._conns[conn]
+
     def _ws_allow(self, _, token):
         ws_token = self._cfg.gt('system', 'ws_token')
         if ws_token and ws_token == token:
@@ -111,71 +174,124 @@ class MDTServer(threading.Thread):
             self.log(LNG['err_start'].format(*self._local, e), logger.CRIT)
             self.own.say(say)
             return False
-        self._socket.listen(1)
+        self._socket.listen(self.BACKLOG)
         return True
 
     def run(self):
         if not self._open_socket():
             return
+        # Соединения обрабатываются в пуле, медленный или заблокированный клиент не держит остальных
+        self._pool = ThreadPoolExecutor(self.WORKERS)
         self._ws_start()
-        while self.work:
-            try:
-                self._conn.insert(*self._socket.accept())
-                self._conn.settimeout(5.0)
-            except socket.timeout:
-                continue
-            allow = self._cfg.allow_connect(self._conn.ip)
-            msg = '{} new connection from {}'.format('Allow' if allow else 'Ignore', self._conn.ip)
-            self.log(msg, logger.DEBUG if allow else logger.WARN)
-            try:
-                if not allow:
+        try:
+            while self.work:
+                # Пока пул занят соединения ждут в очереди listen, а не копятся в памяти
+                if not self._slots.acquire(timeout=1):
+                    continue
+                try:
+                    conn = Connect(*self._socket.accept())
+                except socket.timeout:
+                    self._slots.release()
                     continue
-                for line in self._conn.read():
-                    self._parse(line)
-            finally:
-                self._conn.close()
-        self._ws_stop()
-        self._socket.close()
-
-    def _parse(self, data: str):
+                except Exception:
+                    self._slots.release()
+                    raise
+                self._submit(self._handle, conn)
+        finally:
+            self._ws_stop()
+            self._pool.shutdown(wait=True)
+            self._socket.close()
+
+    def _submit(self, handler, conn):
+        # Место освобождается когда обработчик завершится
+        try:
+            self._pool.submit(handler, conn).add_done_callback(lambda _: self._slots.release())
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _handle(self, conn: Connect):
+        lock = Unlock()
+        with self._conns_lock:
+            self._conns[conn] = lock
+        try:
+            conn.settimeout(self.CONN_TIMEOUT)
+            allow = self._cfg.allow_connect(conn.ip)
+            msg = '{} new connection from {}'.format('Allow' if allow else 'Ignore', conn.ip)
+            self.log(msg, logger.DEBUG if allow else logger.WARN)
+            if allow and self.work:
+                for line in conn.read():
+                    self._parse(line, conn, lock)
+                if conn.overflow:
+                    self.log('Connection {} closed: line too long, {} bytes without CRLF'.format(
+                        conn.ip, conn.overflow), logger.WARN)
+        except Exception as e:
+            # Исключение в пуле потеряется молча
+            self.log('Connection {} error: {}'.format(conn.ip, e), logger.ERROR)
+        finally:
+            conn.close()
+            with self._conns_lock:
+                del self._conns[conn]
+
+    def _parse(self, data: str, conn: Connect, lock):
         if not data:
             return self.log(LNG['no_data'])
         else:
-            self.log(LNG['get_data'].format(data[:1500]))
+            self.log((LNG['get_data'], data[:1500]))
 
         cmd = data.split(':', 1)
         if len(cmd) != 2:
             cmd.append('')
-        if self.own.has_subscribers(cmd[0], self.NET):
-            self.log('Command {} intercepted'.format(repr(cmd[0])))
-            self.own.sub_call(self.NET, cmd[0], cmd[1])
-        elif self.own.has_subscribers(cmd[0], self.NET_BLOCK):
-            self.log('Command {} intercepted in blocking mode'.format(repr(cmd[0])))
-            self._lock.clear()
-            self.own.sub_call(self.NET_BLOCK, cmd[0], cmd[1], self._lock, self._conn)
-            # Приостанавливаем выполнение, ждем пока обработчик нас разблокирует
+        if conn.session and '#' in cmd[0]:
+            # <id>#<cmd>:<data>, все ответы на команду будут помечены id
+            conn.request_id, cmd[0] = cmd[0].split('#', 1)
+        try:
+            error = self._call(cmd[0], cmd[1], conn, lock)
+            if conn.request_id is not None and not conn.replied:
+                # Команды без собственного ответа подтверждаем, иначе клиенту нечего ждать
+                conn.write('error:{}'.format(error) if error else 'ok')
+        except RuntimeError as e:
+            self.log('Reply to {} failed: {}'.format(repr(data[:100]), e), logger.WARN)
+        finally:
+            conn.request_id = None
+
+    def _call(self, cmd: str, data: str, conn: Connect, lock) -> str or None:
+        # Вернет текст ошибки, если она была
+        if self.own.has_subscribers(cmd, self.NET):
+            self.log('Command {} intercepted'.format(repr(cmd)))
+            self.own.sub_call(self.NET, cmd, data)
+        elif self.own.has_subscribers(cmd, self.NET_BLOCK):
+            self.log('Command {} intercepted in blocking mode'.format(repr(cmd)))
+            lock.clear()
+            self.own.sub_call(self.NET_BLOCK, cmd, data, lock, conn)
+            # Приостанавливаем обработку этого соединения, ждем пока обработчик нас разблокирует
             # 1 минуты хватит?
-            self._lock.wait(60)
-        elif cmd[0] in self.MDAPI:
+            lock.wait(60)
+        elif cmd in self.MDAPI:
             try:
-                self.MDAPI[cmd[0]](cmd[0], cmd[1])
+                self.MDAPI[cmd](cmd, data)
             except RuntimeError as e:
                 self.log('MDAPI: {}'.format(e), logger.ERROR)
-        elif cmd[0] in self.MTAPI:
+                return str(e)
+        elif cmd in self.MTAPI:
             try:
-                self.MTAPI[cmd[0]](cmd[0], cmd[1])
+                self.MTAPI[cmd](cmd, data)
             except RuntimeError as e:
                 self.log('MTAPI: {}'.format(e), logger.ERROR)
-        elif cmd[0] in self.TRANSFER:
-            action = 'Transfer protocol ({})...'.format(cmd[0])
+                return str(e)
+        elif cmd in self.TRANSFER:
+            action = 'Transfer protocol ({})...'.format(cmd)
             try:
-                self.TRANSFER[cmd[0]](cmd[0], cmd[1])
+                self.TRANSFER[cmd](cmd, data, conn)
             except RuntimeError as e:
                 self.log('{} ERROR: {}'.format(action, e), logger.ERROR)
+                return str(e)
             else:
                 self.log('{} OK.'.format(action))
         else:
-            self.log(LNG['unknown_cmd'].format(cmd[0]), logger.WARN)
+            self.log(LNG['unknown_cmd'].format(cmd), logger.WARN)
+            return 'unknown command'
+        return None
 
     def _api_no_implement(self, name: str, cmd: str):
         # home, url, rtsp, run
@@ -256,7 +372,7 @@ class MDTServer(threading.Thread):
             raise RuntimeError('File too small: {}'.format(len(data['body'])))
         self.own.terminal_call('send_model', data, save_time=False)
 
-    def _api_recv_model(self, cmd: str, pmdl_name: str):
+    def _api_recv_model(self, cmd: str, pmdl_name: str, conn: Connect):
         """
         Отправка модели на сервер.
         Все данные пакуются в json:
@@ -270,18 +386,18 @@ class MDTServer(threading.Thread):
         """
         if not self._cfg.is_model_name(pmdl_name):
             msg = 'Wrong model name: {}'.format(pmdl_name)
-            self._conn.raise_recv_err(cmd, 1, msg, pmdl_name)
+            conn.raise_recv_err(cmd, 1, msg, pmdl_name)
 
         pmdl_path = os.path.join(self._cfg.path['models'], pmdl_name)
         if not os.path.isfile(pmdl_path):
             msg = 'File {} not found'.format(pmdl_name)
-            self._conn.raise_recv_err(cmd, 2, msg, pmdl_name)
+            conn.raise_recv_err(cmd, 2, msg, pmdl_name)
 
         try:
             body = file_to_base64(pmdl_path)
         except IOError as e:
             msg = 'IOError: {}'.format(e)
-            self._conn.raise_recv_err(cmd, 3, msg, pmdl_name)
+            conn.raise_recv_err(cmd, 3, msg, pmdl_name)
             return
 
         phrase = self._cfg.gt('models', pmdl_name)
@@ -292,9 +408,132 @@ class MDTServer(threading.Thread):
             data['phrase'] = phrase
         if username:
             data['username'] = username
-        self._conn.write(data)
+        conn.write(data)
 
-    def _api_list_models(self, name: str, _):
+    def _api_send_model_bin(self, cmd: str, data: str, conn: Connect):
+        """
+        Получение модели от сервера бинарными фреймами, без base64 и без загрузки файла в память.
+        Заголовок - json в параметре команды:
+        filename: валидное имя файла модели, обязательно.
+        size: размер файла в байтах, обязательно.
+        sha256: hex sha256 файла, обязательно.
+        compress: 'zlib' если данные сжаты, сумма и размер считаются по несжатым.
+        phrase: ключевая фраза модели.
+        username: пользователь модели.
+        Следом идут фреймы (см. Connect.read_frames), файл пишется во временный и проверяется.
+        Ответ json: cmd, code (0 - успех), filename, msg если ошибка.
+        """
+        frames = conn.read_frames()
+        info = {}
+        try:
+            info = self._model_bin_header(data)
+            info['path'] = self._model_bin_receive(info, frames)
+        except RuntimeError as e:
+            self._frames_drain(conn, frames)
+            conn.raise_recv_err(cmd, 1, str(e), info.get('pmdl_name'))
+        conn.write({'cmd': cmd, 'code': 0, 'filename': info['pmdl_name']})
+        self.own.terminal_call('send_model', info, save_time=False)
+
+    def _model_bin_header(self, data: str) -> dict:
+        try:
+            data = json.loads(data)
+            if not isinstance(data, dict):
+                raise TypeError('Data must be dict type')
+        except (json.decoder.JSONDecodeError, TypeError) as e:
+            raise RuntimeError(e)
+        for key in ('filename', 'size', 'sha256'):
+            if key not in data:
+                raise RuntimeError('Missing key: {}'.format(repr(key)))
+        if not self._cfg.is_model_name(data['filename']):
+            raise RuntimeError('Wrong model name: {}'.format(data['filename']))
+        if not isinstance(data['size'], int) or not 1024 * 3 <= data['size'] <= self.MODEL_MAX_SIZE:
+            raise RuntimeError('Wrong size: {}'.format(repr(data['size'])))
+        if data.get('compress') not in (None, '', 'zlib'):
+            raise RuntimeError('Unsupported compression: {}'.format(repr(data['compress'])))
+        for key in ('username', 'phrase', 'sha256'):
+            if key in data and not isinstance(data[key], str):
+                raise RuntimeError('Wrong value type in {}: {}'.format(repr(key), repr(type(data[key]))))
+        return {
+            'pmdl_name': data['filename'], 'size': data['size'], 'sha256': data['sha256'].lower(),
+            'compress': data.get('compress'), 'phrase': data.get('phrase', ''), 'username': data.get('username', '')
+        }
+
+    def _model_bin_receive(self, info: dict, frames) -> str:
+        # Пишем во временный файл рядом с моделями, терминал потом атомарно переименует его
+        fd, path = tempfile.mkstemp(
+            prefix='.{}.'.format(info['pmdl_name']), suffix='.part', dir=self._cfg.path['models']
+        )
+        decompress = zlib.decompressobj() if info['compress'] else None
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                for chunk in frames:
+                    if decompress:
+                        # Не распаковываем больше заявленного, защита от zip-бомб
+                        chunk = decompress.decompress(chunk, info['size'] - size + 1)
+                    size += len(chunk)
+                    if size > info['size']:
+                        raise RuntimeError('Data larger than declared size {}'.format(info['size']))
+                    sha256.update(chunk)
+                    fp.write(chunk)
+                if decompress and (decompress.unconsumed_tail or not decompress.eof):
+                    raise RuntimeError('Broken compressed data')
+            if size != info['size']:
+                raise RuntimeError('Size mismatch: {} != {}'.format(size, info['size']))
+            if sha256.hexdigest() != info['sha256']:
+                raise RuntimeError('Checksum mismatch')
+        except (RuntimeError, OSError, zlib.error) as e:
+            os.remove(path)
+            raise RuntimeError(e)
+        return path
+
+    @staticmethod
+    def _frames_drain(conn: Connect, frames):
+        # Недочитанные фреймы сломают разбор следующих строк. Если фреймы уже сломаны,
+        # read_frames сам остановил соединение
+        try:
+            for _ in frames:
+                pass
+        except RuntimeError:
+            conn.stop()
+
+    def _api_recv_model_bin(self, cmd: str, pmdl_name: str, conn: Connect):
+        """
+        Отправка модели на сервер бинарными фреймами.
+        Параметр: имя модели, с суффиксом ':zlib' если нужно сжатие.
+        Ответ - заголовок json: cmd, code, filename, size, sha256, compress, phrase и username если есть,
+        msg если ошибка. При code 0 следом идут фреймы (см. Connect.write_frames).
+        """
+        pmdl_name, _, compress = pmdl_name.partition(':')
+        if compress not in ('', 'zlib'):
+            conn.raise_recv_err(cmd, 4, 'Unsupported compression: {}'.format(repr(compress)), pmdl_name)
+        if not self._cfg.is_model_name(pmdl_name):
+            conn.raise_recv_err(cmd, 1, 'Wrong model name: {}'.format(pmdl_name), pmdl_name)
+
+        pmdl_path = os.path.join(self._cfg.path['models'], pmdl_name)
+        if not os.path.isfile(pmdl_path):
+            conn.raise_recv_err(cmd, 2, 'File {} not found'.format(pmdl_name), pmdl_name)
+
+        try:
+            size, sha256 = file_sha256(pmdl_path, self.MODEL_CHUNK)
+        except IOError as e:
+            conn.raise_recv_err(cmd, 3, 'IOError: {}'.format(e), pmdl_name)
+            return
+
+        data = {
+            'cmd': cmd, 'filename': pmdl_name, 'code': 0, 'size': size, 'sha256': sha256, 'compress': compress
+        }
+        phrase = self._cfg.gt('models', pmdl_name)
+        username = self._cfg.gt('persons', pmdl_name)
+        if phrase:
+            data['phrase'] = phrase
+        if username:
+            data['username'] = username
+        conn.write(data)
+        conn.write_frames(file_chunks(pmdl_path, self.MODEL_CHUNK, compress == 'zlib'))
+
+    def _api_list_models(self, name: str, _, conn: Connect):
         """
         Отправка на сервер моделей которые есть у терминала.
         Все данные пакуются в json:
@@ -313,9 +552,9 @@ class MDTServer(threading.Thread):
                 'allow': self._cfg.get_allow_models()
             }
         }
-        self._conn.write(data)
+        conn.write(data)
 
-    def _api_ping(self, _, data: str):
+    def _api_ping(self, _, data: str, conn: Connect):
         """
         Пустая команды для поддержания и проверки соединения,
         на 'ping' терминал пришлет 'pong'. Если пинг с данными,
@@ -325,7 +564,44 @@ class MDTServer(threading.Thread):
         cmd = 'pong'
         if data:
             cmd = '{}:{}'.format(cmd, data)
-        self._conn.write(cmd)
+        conn.write(cmd)
+
+    def _api_session(self, name: str, _, conn: Connect):
+        """
+        Переводит соединение в постоянную сессию. Терминал отвечает session:<таймаут в секундах>.
+        Соединение не закрывается после пачки команд, его закроет пустая строка (\r\n\r\n)
+        или отсутствие команд дольше таймаута - для поддержания шлите ping.
+        Команды можно помечать id: <id>#<cmd>:<data>. Ответы на такую команду помечаются тем же id:
+        к json добавляется ключ id, к строке префикс <id>#. Если у команды нет своего ответа,
+        терминал пришлет <id>#ok или <id>#error:<текст ошибки>.
+        Сессий не больше MAX_SESSIONS, сверх этого ответ session:error:<текст>, соединение остается обычным.
+        """
+        with self._conns_lock:
+            # WS-соединения не держат поток пула, их не считаем
+            sessions = sum(1 for x in self._conns if x.session and type(x) is Connect)
+        if type(conn) is Connect and not conn.session and sessions >= self.MAX_SESSIONS:
+            msg = 'Too many sessions: {}'.format(sessions)
+            conn.write('{}:error:{}'.format(name, msg))
+            raise RuntimeError(msg)
+        conn.start_session()
+        conn.settimeout(self.SESSION_TIMEOUT)
+        conn.write('{}:{}'.format(name, int(self.SESSION_TIMEOUT)))
+
+    def _api_flight_log(self, name: str, data: str, conn: Connect):
+        """
+        Бортовой самописец логгера - последние записи всех уровней, даже если в файл пишется только info.
+        flight_log - json с ключом lines (список строк), flight_log:file - сохранить в файл на терминале,
+        в ответе будет ключ file с путем. Ошибки как у recv_model: code и msg.
+        """
+        if data == 'file':
+            try:
+                path = self.own.flight_dump()
+            except RuntimeError as e:
+                conn.raise_recv_err(name, 1, str(e))
+            else:
+                conn.write({'cmd': name, 'code': 0, 'file': path})
+        else:
+            conn.write({'cmd': name, 'code': 0, 'lines': self.own.flight_records()})
 
     def _api_pong(self, _, data: str):
         if data:
@@ -337,7 +613,7 @@ class MDTServer(threading.Thread):
             else:
                 data = time.time() - data
             if data:
-                self.log('ping {}'.format(pretty_time(data)), logger.INFO)
+                self.log(('ping {}', pretty_time(data)), logger.INFO)
 
 
 class Unlock(threading.Event):
@@ -17,6 +17,7 @@ import logger
 import utils
 from languages import LANG_CODE
 from languages import STTS as LNG
+from lib.audio_utils import SilenceTrimmer, trim_silence
 from owner import Owner
 
 
@@ -181,6 +182,7 @@ class SpeechToText:
         self.sys_say = Phrases(log, cfg)
         self._lock = threading.Lock()
         self._work = True
+        self._listener = None
         self.energy = utils.EnergyControl(cfg, owner.noising)
         try:
             self.max_mic_index = len(sr.Microphone().list_microphone_names()) - 1
@@ -197,6 +199,9 @@ class SpeechToText:
 
     def stop(self):
         self._work = False
+        listener = self._listener
+        if listener:
+            listener.done.set()
         self.log('stop.', logger.INFO)
 
     def busy(self):
@@ -297,19 +302,18 @@ class SpeechToText:
 
         # Начинаем фоновое распознавание голосом после того как запустился плей.
         listener = NonBlockListener(r=r, source=mic, phrase_time_limit=self._cfg.gts('phrase_time_limit', 15))
+        self._listener = listener
         self.own.record_callback(True)
-        if file_path:
-            while listener.work() and self.own.really_busy() and \
-                    time.time() - start_wait < max_play_time and self._work:
-                # Ждем пока время не выйдет, голос не распознался и файл играет
-                time.sleep(0.01)
+        if file_path and self._work:
+            # Ждем пока время не выйдет, голос не распознался и файл играет
+            self.own.wait_idle(max_play_time, listener.done)
         self.own.quiet()
 
-        start_wait2 = time.time()
-        while listener.work() and time.time() - start_wait2 < max_wait_time and self._work:
+        if self._work:
             # ждем еще секунд 10
-            time.sleep(0.01)
+            listener.done.wait(max_wait_time)
 
+        self._listener = None
         record_time = time.time() - start_wait
         listener.stop()
         self.own.record_callback(False)
@@ -390,6 +394,7 @@ class SpeechToText:
             return ''
         self.log(LNG['recognized_from'].format(prov), logger.DEBUG)
         wtime = time.time()
+        audio = self._trim_silence(audio)
         try:
             command = STT.GetSTT(
                 prov,
@@ -409,8 +414,32 @@ class SpeechToText:
         if fusion:
             wtime = fusion()
         self.log(LNG['recognized_for'].format(utils.pretty_time(time.time() - wtime)), logger.DEBUG)
+        if isinstance(audio, sr.StreamRecognition) and audio.trimmer:
+            self._log_trimmed(audio.trimmer.input_bytes, audio.trimmer.saved)
         return command or ''
 
+    def _trim_silence(self, audio):
+        lvl = self._cfg.gts('trim_silence')
+        if not lvl:
+            return audio
+        try:
+            if isinstance(audio, sr.StreamRecognition):
+                # Потоковое распознавание, тишина вырезается по мере чтения
+                audio.trimmer = SilenceTrimmer(audio.sample_width, audio.sample_rate, lvl)
+                return audio
+            audio = sr.AudioBuffer.from_audio_data(audio)
+            size = len(audio)
+            audio, saved = trim_silence(audio, lvl)
+        except RuntimeError as e:
+            self.log('Silence trimming disabled: {}'.format(e), logger.WARN)
+            return audio
+        self._log_trimmed(size, saved)
+        return audio
+
+    def _log_trimmed(self, size, saved):
+        percent = saved * 100 // size if size else 0
+        self.log('Silence trimmed: {} of {} bytes saved ({}%)'.format(saved, size, percent), logger.DEBUG)
+
     def phrase_from_files(self, files: list):
         if not files:
             return '', 0
@@ -454,6 +483,8 @@ class RecognitionWorker(threading.Thread):
 class NonBlockListener:
     def __init__(self, r, source, phrase_time_limit):
         self.audio = None
+        # Выставляется когда фраза записана, на нем можно ждать
+        self.done = threading.Event()
         self.stop = r.listen_in_background(source, self._callback, phrase_time_limit=phrase_time_limit)
 
     def work(self):
@@ -462,6 +493,7 @@ class NonBlockListener:
     def _callback(self, _, audio):
         if self.work():
             self.audio = audio
+            self.done.set()
 
 
 class Phrases:
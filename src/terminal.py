@@ -13,12 +13,17 @@ from languages import LANG_CODE
 from languages import STTS as LNG2
 from languages import TERMINAL as LNG
 from lib import volume
+from lib.audio_utils import SnowboyModels
+from lib.command_queue import CommandQueue
 from lib.snowboy import SnowBoySR, SnowBoySR2, SnowBoySR3, SnowBoySR4, SnowBoy
 from owner import Owner
 
 
 class MDTerminal(threading.Thread):
     MAX_LATE = 60
+    # Не требуют микрофона и монопольного воспроизведения, выполняются в TerminalWorker.
+    # compile сначала проходит очередь терминала - после уже поставленных rec, которые пишут его wav
+    WORKER_CALLS = ('send_model', 'update', 'rollback')
 
     def __init__(self, cfg, log, owner: Owner):
         super().__init__(name='MDTerminal')
@@ -27,7 +32,11 @@ class MDTerminal(threading.Thread):
         self.own = owner
         self._work = False
         self._snowboy = None
-        self._queue = queue.Queue()
+        self._queue = CommandQueue(self.MAX_LATE)
+        # Изменения конфига от воркера. Применяются в потоке терминала, но прослушивание не прерывают
+        self._config_queue = queue.Queue()
+        self._worker = TerminalWorker(self.log, self._worker_call, self._is_late)
+        SnowboyModels().log = self.log
 
     def _reload(self):
         if len(self._cfg.path['models_list']) and self.own.max_mic_index != -2:
@@ -51,15 +60,19 @@ class MDTerminal(threading.Thread):
         if self._work:
             self._work = False
             self.log('stopping...', logger.DEBUG)
+            self._worker.join()
             super().join()
             self.log('stop.', logger.INFO)
 
     def start(self):
         self._work = True
         self.log('start', logger.INFO)
+        self._worker.start()
         super().start()
 
     def _interrupt_callback(self):
+        # Дергается слушающим кодом в потоке терминала
+        self._config_check()
         return not self._work or self._queue.qsize()
 
     def run(self):
@@ -86,21 +99,24 @@ class MDTerminal(threading.Thread):
             else:
                 self._snowboy.terminate()
 
+    def _config_check(self):
+        while True:
+            try:
+                data = self._config_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._save_model_data(*data)
+
     def _external_check(self):
+        self._config_check()
         while self._queue.qsize() and self._work:
             try:
                 (cmd, data, lvl, late) = self._queue.get_nowait()
             except queue.Empty:
                 self.log(LNG['err_queue_empty'], logger.ERROR)
                 continue
-            if late:
-                late = time.time() - late
-            msg = LNG['get_call'].format(cmd, repr(data)[:300], lvl, int(late))
-            if late > self.MAX_LATE:
-                self.log(LNG['ignore_call'].format(msg), logger.WARN)
+            if self._is_late(cmd, data, lvl, late):
                 continue
-            else:
-                self.log(msg, logger.DEBUG)
             if cmd == 'reload':
                 self._reload()
             elif cmd == 'ask' and data:
@@ -109,30 +125,46 @@ class MDTerminal(threading.Thread):
                 self._detected_parse('', self.own.listen(voice=True))
             elif cmd == 'rec':
                 self._rec_rec(*data)
-            elif cmd == 'play':
-                self._rec_play(*data)
             elif cmd == 'compile':
-                self._rec_compile(*data)
-            elif cmd == 'send_model':
-                self._send_model(**data)
+                # Все rec перед ним уже выполнены, долгое обучение - в воркере
+                self._worker.put((cmd, data, lvl, 0))
             elif cmd == 'del':
                 self._rec_del(*data)
+            elif cmd == 'play':
+                self._rec_play(*data)
             elif cmd == 'volume':
                 self._set_volume(data)
             elif cmd == 'mpd_volume':
                 self._set_mpd_volume(data)
             elif cmd == 'tts':
                 self.own.say(data, lvl=lvl)
-            elif cmd == 'update':
-                self.own.update()
-            elif cmd == 'rollback':
-                self.own.manual_rollback()
             elif cmd == 'notify' and data:
                 terminal_name = self._cfg.gt('majordomo', 'terminal') or 'mdmTerminal2'
                 self._detected_parse(None, '[{}] {}'.format(terminal_name, data))
             else:
                 self.log(LNG['err_call'].format(cmd, data, lvl), logger.ERROR)
 
+    def _is_late(self, cmd, data, lvl, late) -> bool:
+        if late:
+            late = time.time() - late
+        msg = (LNG['get_call'], cmd, logger.LazyRepr(data, 300), lvl, int(late))
+        if late > self.MAX_LATE:
+            self.log(LNG['ignore_call'].format(logger.format_message(msg)), logger.WARN)
+            return True
+        self.log(msg, logger.DEBUG)
+        return False
+
+    def _worker_call(self, cmd, data):
+        # Выполняется в потоке TerminalWorker
+        if cmd == 'compile':
+            self._rec_compile(*data)
+        elif cmd == 'send_model':
+            self._send_model(**data)
+        elif cmd == 'update':
+            self.own.update()
+        elif cmd == 'rollback':
+            self.own.manual_rollback()
+
     def _rec_rec(self, model, sample):
         # Записываем образец sample для модели model
         if sample not in LNG['rec_nums']:
@@ -202,12 +234,12 @@ class MDTerminal(threading.Thread):
         # remove model record in config
         to_save |= self._cfg['models'].pop(pmdl_name, None) is not None
         to_save |= self._cfg['persons'].pop(pmdl_name, None) is not None
+        to_save |= self._cfg['sensitivity'].pop(pmdl_name, None) is not None
 
         if to_save:
             self._cfg.config_save()
         if is_del:
-            self._cfg.models_load()
-            self._reload()
+            self._models_changed()
 
     def _compile_model(self, model, models, username):
         phrase, match_count = self.own.phrase_from_files(models)
@@ -245,28 +277,48 @@ class MDTerminal(threading.Thread):
         self.log(LNG['compile_ok_log'].format(msg, work_time, pmdl_path), logger.INFO)
         self.own.say(LNG['compile_ok_say'].format(msg, model, work_time))
 
-        self._save_model_data(pmdl_name, username, phrase)
+        self._model_saved(pmdl_name, username, phrase)
 
         # Удаляем временные файлы
         for x in models:
             os.remove(x)
 
-    def _send_model(self, pmdl_name, body: bytes, username='', phrase='', **_):
+    def _send_model(self, pmdl_name, body: bytes = b'', username='', phrase='', path=None, **_):
         # Получили модель от сервера (send - это для сервера)
+        # path - уже проверенный временный файл (бинарная передача), иначе модель в body
         pmdl_path = os.path.join(self._cfg.path['models'], pmdl_name)
         self.log('Model {} received from server: phrase={}, username={}, size={} bytes.'.format(
-            repr(pmdl_name), repr(phrase), repr(username), len(body)), logger.INFO)
-        with open(pmdl_path, 'wb') as fp:
-            fp.write(body)
-        self._save_model_data(pmdl_name, username, phrase)
+            repr(pmdl_name), repr(phrase), repr(username), os.path.getsize(path) if path else len(body)), logger.INFO)
+        if path:
+            os.replace(path, pmdl_path)
+        else:
+            with open(pmdl_path, 'wb') as fp:
+                fp.write(body)
+        self._model_saved(pmdl_name, username, phrase)
+
+    def _model_saved(self, pmdl_name, username, phrase):
+        # Вызывается из воркера, конфиг меняет только поток терминала
+        self._config_queue.put_nowait((pmdl_name, username, phrase))
 
     def _save_model_data(self, pmdl_name, username, phrase):
         model_data = {'models': {pmdl_name: phrase}}
         if username:
             model_data['persons'] = {pmdl_name: username}
         self._cfg.update_from_dict(model_data)
+        self._models_changed()
+
+    def _models_changed(self):
+        # Поток терминала, в том числе посреди прослушивания.
+        # Режимы SR грузят новые модели в фоне, детектор подхватит их на следующем фрейме.
+        # Остальным нужно пересоздать детектор, а это прервет прослушивание
         self._cfg.models_load()
-        self._reload()
+        try:
+            if self._snowboy is not None and len(self._cfg.path['models_list']) and self._snowboy.models_reload():
+                return
+        except RuntimeError:
+            # Ошибка загрузки уже в логе, слушаем на старых моделях
+            return
+        self._queue.put_nowait(('reload', '', 0, 0))
 
     def _set_volume(self, value):
         control = self._cfg.gt('volume', 'line_out')
@@ -312,7 +364,11 @@ class MDTerminal(threading.Thread):
             else:
                 self.own.say(data, lvl=0)
                 return
-        self._queue.put_nowait((cmd, data, lvl, time.time() if save_time else 0))
+        item = (cmd, data, lvl, time.time() if save_time else 0)
+        if cmd in self.WORKER_CALLS:
+            self._worker.put(item)
+        else:
+            self._queue.put_nowait(item)
 
     def _detected(self, model: int=0):
         if self._snowboy is not None:
@@ -333,7 +389,7 @@ class MDTerminal(threading.Thread):
 
     def _detected_sr(self, msg: str, model_name: str, model_msg: str, energy_threshold: int):
         if model_msg is None:
-            self.log(LNG['wrong_activation'].format(msg, model_name, energy_threshold), logger.DEBUG)
+            self.log((LNG['wrong_activation'], msg, model_name, energy_threshold), logger.DEBUG)
             return
         if self._cfg.gts('energy_threshold', 0) < 1:
             energy_threshold = ', energy_threshold={}'.format(energy_threshold)
@@ -361,3 +417,37 @@ class MDTerminal(threading.Thread):
                     reply = self.own.listen(reply or '', voice=not reply)
         if reply:
             self.own.say(reply)
+
+
+class TerminalWorker(threading.Thread):
+    """
+    Выполняет долгие команды терминала (обучение модели, обновление), пока терминал слушает.
+    Команды выполняются по одной, в порядке поступления.
+    """
+    def __init__(self, log, call, is_late):
+        super().__init__(name='TerminalWorker')
+        self.log = log
+        self._call = call
+        self._is_late = is_late
+        self._queue = queue.Queue()
+
+    def put(self, item: tuple):
+        self._queue.put_nowait(item)
+
+    def join(self, timeout=None):
+        self._queue.put_nowait(None)
+        super().join(timeout)
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            (cmd, data, lvl, late) = item
+            if self._is_late(cmd, data, lvl, late):
+                continue
+            try:
+                self._call(cmd, data)
+            except Exception as e:
+                self.log('{} failed: {}'.format(cmd, e), logger.ERROR)
+                self.log(traceback.format_exc(), logger.ERROR)
@@ -2,15 +2,18 @@
 
 import base64
 import functools
+import hashlib
 import json
 import os
 import queue
 import signal
 import socket
+import struct
 import subprocess
 import threading
 import time
 import traceback
+import zlib
 from io import BytesIO
 
 import requests
@@ -18,6 +21,7 @@ import socks  # install socks-proxy dependencies - pip install requests[socks]
 import urllib3
 
 from languages import YANDEX_SPEAKER, RHVOICE_SPEAKER, AWS_SPEAKER, DEFAULT_SPEAKERS
+from lib.line_framer import LineFramer
 
 REQUEST_ERRORS = (
     requests.exceptions.HTTPError, requests.exceptions.RequestException, urllib3.exceptions.NewConnectionError,
@@ -136,16 +140,53 @@ class Popen:
 
 class Connect:
     CHUNK_SIZE = 1024 * 4
+    RECV_SIZE = 1024 * 64
+    MAX_LINE_SIZE = 1024 * 1024 * 32
+    MAX_FRAME_SIZE = 1024 * 1024
 
     def __init__(self, conn, ip_info, work=True):
         self._conn = conn
         self._ip_info = ip_info
         self._work = work
         self._r_wait = False
+        self._framer = LineFramer(self.MAX_LINE_SIZE)
+        # Постоянная сессия: клиент держит соединение и может помечать команды id
+        self._session = False
+        self._request_id = None
+        self._replied = False
+        # Сколько байт было в строке без \r\n, на которой чтение оборвалось
+        self._overflow = 0
 
     def stop(self):
         self._work = False
 
+    def start_session(self):
+        self._session = True
+
+    @property
+    def session(self) -> bool:
+        return self._session
+
+    @property
+    def request_id(self):
+        return self._request_id
+
+    @request_id.setter
+    def request_id(self, request_id):
+        # Пока установлен, все ответы помечаются этим id
+        self._request_id = request_id
+        self._replied = False
+
+    @property
+    def replied(self) -> bool:
+        # На текущий запрос уже что-то отправлено
+        return self._replied
+
+    @property
+    def overflow(self) -> int:
+        # Чтение прервано из-за строки больше MAX_LINE_SIZE
+        return self._overflow
+
     def r_wait(self):
         self._r_wait = True
 
@@ -173,7 +214,7 @@ class Connect:
     def extract(self):
         if self._conn:
             try:
-                return Connect(self._conn, self._ip_info, self._work)
+                return self.__class__(self._conn, self._ip_info, self._work)
             finally:
                 self._conn = None
                 self._ip_info = None
@@ -197,8 +238,12 @@ class Connect:
         Преобразует dict -> json, str -> bytes, (nothing) -> bytes('') и отправляет байты в сокет.
         В конце автоматически добавляет \r\n.
         В любой непонятной ситуации кидает RuntimeError.
+        Если задан request_id: к dict добавляется ключ id, к строке - префикс <id>#.
         """
         if self._conn:
+            if self._request_id is not None:
+                data = self._tagged(data)
+                self._replied = True
             self._conn_sender(data)
 
     def raise_recv_err(self, cmd, code, msg, pmdl_name=None):
@@ -208,6 +253,13 @@ class Connect:
         self.write(data)
         raise RuntimeError(msg)
 
+    def _tagged(self, data):
+        if isinstance(data, dict):
+            return dict(data, id=self._request_id)
+        if isinstance(data, bytes):
+            return '{}#'.format(self._request_id).encode() + data
+        return '{}#{}'.format(self._request_id, data or '')
+
     def _conn_sender(self, data):
         if not data:
             data = b''
@@ -232,11 +284,11 @@ class Connect:
                     raise RuntimeError(e)
 
     def _conn_reader(self):
-        data = b''
-        this_legacy = True
+        framer = self._framer
+        chunk = memoryview(bytearray(self.RECV_SIZE))
         while self._work:
             try:
-                chunk = self._conn.recv(self.CHUNK_SIZE)
+                received = self._conn.recv_into(chunk)
             except socket.timeout:
                 if self._r_wait:
                     continue
@@ -244,28 +296,79 @@ class Connect:
                     break
             except (BrokenPipeError, ConnectionResetError, AttributeError, OSError):
                 break
-            if not chunk:
+            if not received:
                 # сокет закрыли, пустой объект
                 break
-            data += chunk
-            while CRLF in data:
-                # Обрабатываем все строки разделенные \r\n отдельно, пустая строка завершает сеанс
-                this_legacy = False
-                line, data = data.split(CRLF, 1)
-                if not line:
-                    return
+            framer.feed(chunk[:received])
+            try:
+                # Строки берем по одной, обработчик строки может забрать идущие за ней бинарные данные
+                for line in framer.lines():
+                    # Обрабатываем все строки разделенные \r\n отдельно, пустая строка завершает сеанс
+                    if not line or not self._work:
+                        return
+                    try:
+                        yield line.decode()
+                    except UnicodeDecodeError:
+                        pass
+            except RuntimeError as e:
+                # Строка больше MAX_LINE_SIZE, дальше читать бессмысленно. Сообщаем клиенту почему его закроют
+                self._overflow = len(framer)
                 try:
-                    yield line.decode()
-                except UnicodeDecodeError:
+                    self.write('error:{}'.format(e))
+                except RuntimeError:
                     pass
-                del line
-        if this_legacy and data and self._work:
+                return
+        if not framer.framed and len(framer) and self._work:
             # Данные пришли без \r\n, обработаем их как есть
             try:
-                yield data.decode()
+                yield framer.tail().decode()
             except UnicodeDecodeError:
                 pass
 
+    def read_frames(self):
+        """
+        Генератор, читает бинарные фреймы: 4 байта длины (big-endian) и данные, фрейм нулевой длины - конец.
+        Данные идут в том же соединении сразу после строки-заголовка. Любая ошибка - RuntimeError
+        и остановка соединения: остаток бинарных данных нельзя разбирать как команды.
+        """
+        try:
+            while True:
+                size = struct.unpack('>I', self._read_exact(4))[0]
+                if not size:
+                    return
+                if size > self.MAX_FRAME_SIZE:
+                    raise RuntimeError('Frame too large: {}'.format(size))
+                yield self._read_exact(size)
+        except RuntimeError:
+            self.stop()
+            raise
+
+    def write_frames(self, frames):
+        """Отправляет фреймы из итератора bytes и завершающий фрейм нулевой длины. Ошибка - RuntimeError."""
+        if not self._conn:
+            return
+        try:
+            for frame in frames:
+                if frame:
+                    self._conn.sendall(struct.pack('>I', len(frame)))
+                    self._conn.sendall(frame)
+            self._conn.sendall(struct.pack('>I', 0))
+        except (BrokenPipeError, socket.timeout, InterruptedError, OSError) as e:
+            raise RuntimeError(e)
+
+    def _read_exact(self, size: int) -> bytes:
+        # Сначала то, что уже прочитано в буфер строк
+        data = bytearray(self._framer.take(size))
+        while len(data) < size:
+            try:
+                chunk = self._conn.recv(min(size - len(data), self.RECV_SIZE))
+            except (socket.timeout, BrokenPipeError, ConnectionResetError, AttributeError, OSError) as e:
+                raise RuntimeError(e)
+            if not chunk:
+                raise RuntimeError('Connection closed')
+            data += chunk
+        return bytes(data)
+
 
 def fix_speakers(cfg: dict) -> bool:
     modify = False
@@ -428,6 +531,27 @@ def file_to_base64(file_name: str) -> str:
         return base64.b64encode(fp.read()).decode()
 
 
+def file_sha256(file_name: str, chunk_size: int) -> tuple:
+    # Размер и hex sha256 файла, читается кусками
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(file_name, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            sha256.update(chunk)
+            size += len(chunk)
+    return size, sha256.hexdigest()
+
+
+def file_chunks(file_name: str, chunk_size: int, compress=False):
+    # Генератор, файл кусками, опционально сжатыми zlib
+    compressor = zlib.compressobj() if compress else None
+    with open(file_name, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            yield compressor.compress(chunk) if compressor else chunk
+    if compressor:
+        yield compressor.flush()
+
+
 def base64_to_bytes(data):
     try:
         return base64.b64decode(data)
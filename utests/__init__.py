@@ -1,6 +1,16 @@
 from .xml import YandexXML
-from .cfg_up import ConfigUpdater
+from .cfg_up import ConfigUpdater, ConfigConcurrentUpdate
 from .polly import Polly
 from .training import SNPrettyErrors
+from .frame_slicer import FrameSlicing
+from .audio_buffer import AudioBufferConversion
+from .replay import ReplaySource
+from .silence_trimmer import SilenceTrimming
+from .command_queue import CommandQueueOrder
+from .connect_session import ConnectSession
+from .line_framer import LineFraming
+from .remote_log import RemoteLogFanout
+from .publisher import PubSubDispatch
+from .terminal_models import TerminalModelsReload
 
-__all__ = ['YandexXML', 'ConfigUpdater', 'Polly', 'SNPrettyErrors']
+__all__ = ['YandexXML', 'ConfigUpdater', 'ConfigConcurrentUpdate', 'Polly', 'SNPrettyErrors', 'FrameSlicing', 'AudioBufferConversion', 'ReplaySource', 'SilenceTrimming', 'CommandQueueOrder', 'ConnectSession', 'LineFraming', 'RemoteLogFanout', 'PubSubDispatch', 'TerminalModelsReload']
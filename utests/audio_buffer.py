@@ -0,0 +1,51 @@
+import os
+import unittest
+
+from lib.audio_utils import AudioBuffer
+from lib.sr_wrapper import AudioData
+
+
+class AudioBufferConversion(unittest.TestCase):
+    RATE = 44100
+
+    def _frames(self, width):
+        return [os.urandom(width * size) for size in (1024, 512, 3000, 7)]
+
+    def _check(self, width, convert_rate, convert_width):
+        frames = self._frames(width)
+        origin = AudioData(b''.join(frames), self.RATE, width)
+        target = AudioBuffer(frames, self.RATE, width)
+        raw = b''.join(target.iter_raw(convert_rate, convert_width))
+        self.assertEqual(raw, origin.get_raw_data(convert_rate, convert_width))
+        wav = b''.join(target.iter_wav(convert_rate, convert_width))
+        self.assertEqual(wav, origin.get_wav_data(convert_rate, convert_width))
+
+    def test_no_convert(self):
+        for width in (1, 2, 4):
+            self._check(width, None, None)
+
+    def test_convert_rate(self):
+        for width in (1, 2, 4):
+            self._check(width, 16000, None)
+
+    def test_convert_width(self):
+        for width in (1, 2, 4):
+            for convert_width in (1, 2, 4):
+                self._check(width, None, convert_width)
+
+    def test_convert_all(self):
+        self._check(4, 16000, 2)
+        self._check(2, 8000, 1)
+
+    def test_frame_data(self):
+        frames = self._frames(2)
+        target = AudioBuffer(frames + [b''], self.RATE, 2)
+        self.assertEqual(len(target), sum(len(frame) for frame in frames))
+        self.assertEqual(target.frame_data, b''.join(frames))
+        self.assertEqual(b''.join(target.iter_raw()), b''.join(frames))
+
+    def test_from_audio_data(self):
+        origin = AudioData(os.urandom(2000), self.RATE, 2)
+        target = AudioBuffer.from_audio_data(origin)
+        self.assertIs(AudioBuffer.from_audio_data(target), target)
+        self.assertEqual(b''.join(target.iter_wav(16000, 2)), origin.get_wav_data(16000, 2))
@@ -1,6 +1,11 @@
 import json
+import os
+import tempfile
+import threading
+import time
 import unittest
 from copy import deepcopy
+from unittest import mock
 
 import config
 import main
@@ -70,3 +75,63 @@ class ConfigUpdater(unittest.TestCase):
         self.assertFalse(updater.save_ini)
         self.assertEqual(updater.from_dict(CFG()), 0)
         self.assertFalse(updater.save_ini)
+
+
+class _Config(config.ConfigHandler):
+    # Без чтения файлов, моделей и кэша - только изменение и запись
+    def _config_init(self):
+        pass
+
+
+class ConfigConcurrentUpdate(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.ini')
+        os.close(fd)
+        self.cfg = _Config(CFG(), {'settings': self.path}, None)
+        self.writers = 0
+        self.overlaps = 0
+        self._writers_lock = threading.Lock()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _slow_write(self, parser, fp, *args, **kwargs):
+        # Медленная запись, чтобы несериализованные сохранения гарантированно пересеклись
+        with self._writers_lock:
+            self.writers += 1
+            self.overlaps += self.writers > 1
+        time.sleep(0.005)
+        self._origin_write(parser, fp, *args, **kwargs)
+        with self._writers_lock:
+            self.writers -= 1
+
+    def _from_server(self):
+        # Как Owner.settings_from_mjd
+        for idx in range(10):
+            if self.cfg.update_from_json(json.dumps({'PROVIDERTTS': 'tts_{}'.format(idx)})) is not None:
+                self.cfg.config_save()
+
+    def _from_terminal(self):
+        # Как сохранение модели в терминале
+        for idx in range(10):
+            self.cfg.update_from_dict({'models': {'model{}.pmdl'.format(idx): 'phrase {}'.format(idx)}})
+
+    def test_two_updates(self):
+        self._origin_write = config.ConfigParserOnOff.write
+        slow_write = lambda *args, **kwargs: self._slow_write(*args, **kwargs)
+        with mock.patch.object(config.ConfigParserOnOff, 'write', slow_write):
+            threads = [threading.Thread(target=self._from_server), threading.Thread(target=self._from_terminal)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+        self.assertEqual(self.overlaps, 0)
+        self.assertEqual(self.cfg['settings']['providertts'], 'tts_9')
+        for idx in range(10):
+            self.assertEqual(self.cfg['models']['model{}.pmdl'.format(idx)], 'phrase {}'.format(idx))
+
+        saved = config.ConfigParserOnOff()
+        saved.read(self.path)
+        self.assertEqual(saved['settings']['providertts'], 'tts_9')
+        for idx in range(10):
+            self.assertEqual(saved['models']['model{}.pmdl'.format(idx)], 'phrase {}'.format(idx))
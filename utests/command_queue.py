@@ -0,0 +1,57 @@
+import queue
+import time
+import unittest
+
+from lib.command_queue import CommandQueue
+
+
+class CommandQueueOrder(unittest.TestCase):
+    def _drain(self, q: CommandQueue) -> list:
+        result = []
+        while q.qsize():
+            result.append(q.get_nowait())
+        self.assertRaises(queue.Empty, q.get_nowait)
+        return result
+
+    def test_priority(self):
+        q = CommandQueue(60)
+        q.put_nowait(('tts', 'a', 2, 0))
+        q.put_nowait(('rec', ('1', '1'), 0, 0))
+        q.put_nowait(('notify', 'b', 0, 0))
+        q.put_nowait(('ask', 'c', 0, 0))
+        q.put_nowait(('voice', '', 0, 0))
+        self.assertEqual([x[0] for x in self._drain(q)], ['ask', 'voice', 'rec', 'tts', 'notify'])
+
+    def test_coalesce(self):
+        q = CommandQueue(60)
+        q.put_nowait(('volume', 10, 0, 0))
+        q.put_nowait(('tts', 'a', 2, 0))
+        q.put_nowait(('volume', 20, 0, 0))
+        q.put_nowait(('reload', '', 0, 0))
+        q.put_nowait(('volume', 30, 0, 0))
+        q.put_nowait(('reload', '', 0, 0))
+        self.assertEqual(q.qsize(), 3)
+        self.assertEqual(q.coalesced, 3)
+        self.assertEqual(self._drain(q), [('volume', 30, 0, 0), ('reload', '', 0, 0), ('tts', 'a', 2, 0)])
+        # После выдачи команда снова попадает в очередь
+        q.put_nowait(('volume', 40, 0, 0))
+        self.assertEqual(self._drain(q), [('volume', 40, 0, 0)])
+
+    def test_expired(self):
+        q = CommandQueue(60)
+        old = time.time() - 100
+        q.put_nowait(('volume', 10, 0, old))
+        q.put_nowait(('tts', 'a', 2, old))
+        q.put_nowait(('reload', '', 0, 0))
+        q.put_nowait(('volume', 20, 0, time.time()))
+        self.assertEqual(q.expired, 2)
+        self.assertEqual([x[:2] for x in self._drain(q)], [('reload', ''), ('volume', 20)])
+
+    def test_query_not_coalesced(self):
+        q = CommandQueue(60)
+        q.put_nowait(('volume', 30, 0, 0))
+        q.put_nowait(('volume', None, 0, 0))
+        q.put_nowait(('volume', None, 0, 0))
+        q.put_nowait(('volume', 40, 0, 0))
+        # Запрос не затирает установку, установки по-прежнему схлопываются
+        self.assertEqual(self._drain(q), [('volume', 40, 0, 0), ('volume', None, 0, 0), ('volume', None, 0, 0)])
@@ -0,0 +1,70 @@
+import socket
+import struct
+import unittest
+
+from utils import Connect
+
+
+class ConnectSession(unittest.TestCase):
+    def setUp(self):
+        self.server, self.client = socket.socketpair()
+        self.server.settimeout(1)
+        self.client.settimeout(1)
+        self.conn = Connect(self.server, ('127.0.0.1', 7999))
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+
+    def _recv(self) -> bytes:
+        return self.client.recv(1024)
+
+    def test_tagged_reply(self):
+        self.conn.request_id = '42'
+        self.assertFalse(self.conn.replied)
+        self.conn.write('pong:1')
+        self.assertTrue(self.conn.replied)
+        self.assertEqual(self._recv(), b'42#pong:1\r\n')
+        self.conn.write({'cmd': 'list_models', 'code': 0})
+        self.assertEqual(self._recv(), b'{"cmd": "list_models", "code": 0, "id": "42"}\r\n')
+
+    def test_untagged_reply(self):
+        self.conn.request_id = '1'
+        self.conn.request_id = None
+        self.assertFalse(self.conn.replied)
+        self.conn.write('pong')
+        self.assertEqual(self._recv(), b'pong\r\n')
+
+    def test_pipelined_read(self):
+        self.client.send(b'session:\r\n1#ping:a\r\n2#tts:hi\r\n\r\n')
+        self.assertEqual(list(self.conn.read()), ['session:', '1#ping:a', '2#tts:hi'])
+
+    def test_frames_after_header(self):
+        body = b'\r\n' * 3000 + bytes(range(256))
+        client = Connect(self.client, None)
+        client.write('send_model_bin:{}')
+        client.write_frames(body[pos:pos + 1000] for pos in range(0, len(body), 1000))
+        client.write('ping')
+        lines = self.conn.read()
+        self.assertEqual(next(lines), 'send_model_bin:{}')
+        self.assertEqual(b''.join(self.conn.read_frames()), body)
+        self.assertEqual(next(lines), 'ping')
+
+    def test_oversized_frame_stops(self):
+        self.client.send(b'send_model_bin:{}\r\n' + struct.pack('>I', Connect.MAX_FRAME_SIZE + 1) + b'ping:evil\r\n')
+        lines = self.conn.read()
+        self.assertEqual(next(lines), 'send_model_bin:{}')
+        with self.assertRaises(RuntimeError):
+            list(self.conn.read_frames())
+        # Остаток бинарных данных не должен разбираться как команды
+        self.assertEqual(list(lines), [])
+
+    def test_oversized_line_reply(self):
+        class SmallConnect(Connect):
+            MAX_LINE_SIZE = 16
+
+        conn = SmallConnect(self.server, ('127.0.0.1', 7999))
+        self.client.send(b'ping:a\r\n' + b'x' * 100)
+        self.assertEqual(list(conn.read()), ['ping:a'])
+        self.assertEqual(conn.overflow, 100)
+        self.assertEqual(self._recv(), b'error:Line too long: more than 16 bytes\r\n')
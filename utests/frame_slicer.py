@@ -0,0 +1,66 @@
+import os
+import unittest
+
+from lib.frame_slicer import FrameSlicer
+
+
+class FrameSlicing(unittest.TestCase):
+    DATA = os.urandom(10000)
+
+    def _slicing(self, frame_size, steps):
+        slicer = FrameSlicer(frame_size)
+        result = bytearray()
+        pos = 0
+        for step in steps:
+            for frame in slicer.slice(self.DATA[pos:pos + step]):
+                self.assertEqual(len(frame), frame_size)
+                result += frame
+            pos += step
+        self.assertEqual(bytes(result), self.DATA[:len(result)])
+        self.assertEqual(len(result) + len(slicer), pos)
+        self.assertEqual(slicer.tail(), self.DATA[len(result):pos])
+        return slicer
+
+    def test_aligned(self):
+        self._slicing(100, [1000] * 10)
+
+    def test_unaligned(self):
+        for frame_size in (7, 320, 960, 4800):
+            self._slicing(frame_size, [1, 2048, 333, 0, 4800, 2048, 770])
+
+    def test_small_chunks(self):
+        slicer = self._slicing(320, [10] * 100)
+        self.assertEqual(len(slicer), 1000 % 320)
+
+    def test_frames_count(self):
+        slicer = FrameSlicer(320)
+        slicer.slice(self.DATA[:300])
+        self.assertEqual(slicer.frames_count(20), 1)
+        self.assertEqual(slicer.frames_count(19), 0)
+        slicer.clear()
+        self.assertEqual(len(slicer), 0)
+        self.assertEqual(slicer.frames_count(640), 2)
+
+    def test_tail_frame_survives_next_tail(self):
+        slicer = FrameSlicer(4)
+        slicer.slice(b'ab')
+        frames = slicer.slice(b'cdefghij')
+        self.assertEqual([bytes(frame) for frame in frames], [b'abcd', b'efgh'])
+        self.assertEqual(len(slicer), 2)
+
+    def test_as_bytes(self):
+        slicer = FrameSlicer(320, True)
+        result = []
+        for step in (100, 1000, 7, 333, 2048):
+            result += slicer.slice(bytearray(self.DATA[len(result) * 320 + len(slicer):][:step]))
+        self.assertTrue(all(type(frame) is bytes and len(frame) == 320 for frame in result))
+        self.assertEqual(b''.join(result), self.DATA[:len(result) * 320])
+
+    def test_feed(self):
+        for as_bytes in (False, True):
+            slicer = FrameSlicer(320, as_bytes)
+            result = []
+            for pos in range(0, 5000, 1000):
+                slicer.feed(self.DATA[pos:pos + 1000], lambda frame: result.append(bytes(frame)))
+            self.assertEqual(b''.join(result), self.DATA[:5000 - 5000 % 320])
+            self.assertEqual(slicer.tail(), self.DATA[5000 - 5000 % 320:5000])
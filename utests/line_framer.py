@@ -0,0 +1,45 @@
+import os
+import unittest
+
+from lib.line_framer import LineFramer
+
+
+class LineFraming(unittest.TestCase):
+    def _feed(self, framer, data, step):
+        lines = []
+        for pos in range(0, len(data), step):
+            framer.feed(data[pos:pos + step])
+            lines.extend(framer.lines())
+        return lines
+
+    def test_split_delimiter(self):
+        lines = [b'ping:1', b'', b'tts:' + os.urandom(5000).hex().encode(), b'x']
+        data = b'\r\n'.join(lines) + b'\r\n'
+        for step in (1, 2, 3, 4096, len(data)):
+            framer = LineFramer(1024 * 1024)
+            self.assertEqual(self._feed(framer, data, step), lines)
+            self.assertEqual(len(framer), 0)
+            self.assertTrue(framer.framed)
+
+    def test_tail(self):
+        framer = LineFramer(100)
+        framer.feed(b'legacy\r')
+        self.assertIsNone(framer.pop_line())
+        self.assertFalse(framer.framed)
+        self.assertEqual(framer.tail(), b'legacy\r')
+        self.assertEqual(len(framer), 0)
+
+    def test_max_line(self):
+        framer = LineFramer(10)
+        framer.feed(b'0123456789\r\n')
+        self.assertEqual(framer.pop_line(), b'0123456789')
+        framer.feed(b'0123456789A')
+        self.assertRaises(RuntimeError, framer.pop_line)
+
+    def test_take(self):
+        framer = LineFramer(100)
+        framer.feed(b'header\r\n\x00\r\n\x01tail\r\n')
+        self.assertEqual(framer.pop_line(), b'header')
+        self.assertEqual(framer.take(4), b'\x00\r\n\x01')
+        self.assertEqual(list(framer.lines()), [b'tail'])
+        self.assertEqual(framer.take(10), b'')
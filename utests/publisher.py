@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+
+from lib.publisher import PubSub
+
+
+class PubSubDispatch(unittest.TestCase):
+    def setUp(self):
+        self.pub = PubSub()
+        self.pub.start()
+
+    def tearDown(self):
+        self.pub.join(5)
+
+    def _sync(self):
+        # Подписки меняются в треде, ждем пока он разберет очередь
+        done = threading.Event()
+        self.pub.subscribe('sync', lambda *_: done.set())
+        self.pub.call('sync')
+        self.assertTrue(done.wait(5))
+
+    def test_slow_subscriber_isolated(self):
+        gate, fast = threading.Event(), threading.Event()
+        self.pub.subscribe('event', lambda *_: gate.wait(5))
+        self.pub.subscribe('event', lambda *_: fast.set())
+        self.pub.call('event')
+        # Быстрый коллбэк не ждет медленного
+        self.assertTrue(fast.wait(2))
+        gate.set()
+
+    def test_order_per_subscriber(self):
+        result, done = [], threading.Event()
+
+        def callback(_, value):
+            time.sleep(0.001)
+            result.append(value)
+            if value == 99:
+                done.set()
+        self.pub.subscribe('event', callback, 'test')
+        for i in range(100):
+            self.pub.sub_call('test', 'event', i)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(result, list(range(100)))
+
+    def test_has_subscribers(self):
+        callback = lambda *_: None
+        self.pub.subscribe(['a', 'b'], callback, 'test')
+        self._sync()
+        self.assertTrue(self.pub.has_subscribers('a', 'test'))
+        self.assertFalse(self.pub.has_subscribers('a'))
+        self.pub.unsubscribe('a', callback, 'test')
+        self._sync()
+        self.assertFalse(self.pub.has_subscribers('a', 'test'))
+        self.assertTrue(self.pub.has_subscribers('b', 'test'))
+
+    def test_slow_counter(self):
+        self.pub.SLOW_CALLBACK = 0.01
+        done = threading.Event()
+        self.pub.subscribe('event', lambda *_: (time.sleep(0.05), done.set()))
+        self.pub.call('event')
+        self.assertTrue(done.wait(5))
+        self.pub.join(5)
+        self.assertEqual(self.pub.slow, 1)
+
+    def test_coalesce_latest(self):
+        result, done = [], threading.Event()
+        self.pub.subscribe('volume', lambda _, value: (result.append(value), done.set()), coalesce={'volume': 0.1})
+        for i in range(10):
+            self.pub.call('volume', i)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(result, [9])
+        self.assertEqual(self.pub.coalesced, 9)
+
+    def test_coalesce_short_pair(self):
+        result, done = [], threading.Event()
+
+        def callback(name):
+            result.append(name)
+            if name == 'sync':
+                done.set()
+        self.pub.subscribe(['start_talking', 'stop_talking', 'sync'], callback, coalesce={'start_talking': 0.2})
+        self.pub.call('start_talking')
+        self.pub.call('stop_talking')
+        self.pub.call('start_talking')
+        time.sleep(0.3)
+        self.pub.call('stop_talking')
+        self.pub.call('sync')
+        self.assertTrue(done.wait(5))
+        self.assertEqual(result, ['start_talking', 'stop_talking', 'sync'])
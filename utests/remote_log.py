@@ -0,0 +1,142 @@
+import threading
+import unittest
+
+import logger
+
+
+class _SlowConn:
+    def __init__(self):
+        self.lines = []
+        self.gate = threading.Event()
+        self.closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def write(self, line):
+        self.gate.wait(5)
+        self.lines.append(line)
+
+    def close(self):
+        self.closed = True
+
+    ip, port = '127.0.0.1', 0
+
+
+class RemoteLogFanout(unittest.TestCase):
+    def test_options(self):
+        self.assertEqual(logger._remote_options(''), (False, logger.DEBUG, None, 0))
+        self.assertEqual(logger._remote_options('raw;throttle=5'), (True, logger.DEBUG, None, 5))
+        raw, lvl, names, _ = logger._remote_options('lvl=warn;name=Server, STT')
+        self.assertEqual((raw, lvl, names), (False, logger.WARN, frozenset(('Server', 'STT'))))
+
+    def test_filter(self):
+        remote = logger._RemoteLog(_SlowConn(), lvl=logger.INFO, names=frozenset(('Server',)))
+        self.assertTrue(remote.accept('Server', logger.INFO, ''))
+        self.assertTrue(remote.accept('Plugins', logger.ERROR, 'Server'))
+        self.assertFalse(remote.accept('Server', logger.DEBUG, ''))
+        self.assertFalse(remote.accept('STT', logger.CRIT, ''))
+
+    def test_drop_oldest(self):
+        conn = _SlowConn()
+        remote = logger._RemoteLog(conn)
+        total = remote.RING_SIZE + 100
+        # Клиент не читает - put не блокируется, буфер хранит только последние строки
+        for i in range(total):
+            remote.put(str(i))
+        remote.stop('bye')
+        conn.gate.set()
+        remote.start()
+        remote.join(5)
+        self.assertFalse(remote.is_alive())
+        self.assertTrue(conn.closed)
+        self.assertEqual(remote.dropped, 101)
+        self.assertIn('101 lines dropped', conn.lines[0])
+        self.assertEqual(conn.lines[1:], [str(i) for i in range(101, total)] + ['bye'])
+
+    def test_lazy_message(self):
+        self.assertEqual(logger.format_message(('{} {}', 1, logger.LazyRepr('abcdef', 4))), "1 'abc")
+        self.assertEqual(logger.format_message('{} plain'), '{} plain')
+
+    def test_throttle(self):
+        throttle = logger._Throttle(2)
+        out = []
+        for i in range(5):
+            out += throttle(0, 'MPD', 'reconnect', logger.WARN, '', 'reconnect')
+        out += throttle(1, 'MPD', 'error 1', logger.WARN, '', 'error {}')
+        out += throttle(2, 'MPD', 'error 2', logger.WARN, '', 'error {}')
+        out += throttle(3, 'MPD', 'error 3', logger.WARN, '', 'error {}')
+        self.assertEqual([x[1] for x in out], ['reconnect', 'Last message repeated 4 times', 'error 1', 'error 2'])
+        # Новое окно - сообщаем сколько подавлено
+        out = throttle(100, 'MPD', 'error 4', logger.WARN, '', 'error {}')
+        self.assertEqual([x[1] for x in out], ['1 similar messages suppressed', 'error 4'])
+
+    def test_throttle_flush(self):
+        throttle = logger._Throttle(1)
+        for i in range(3):
+            throttle(0, 'MPD', 'reconnect', logger.WARN, '', 'reconnect')
+        throttle(1, 'MPD', 'error 1', logger.WARN, '', 'error {}')
+        throttle(2, 'MPD', 'error 2', logger.WARN, '', 'error {}')
+        throttle(3, 'MPD', 'error 2', logger.WARN, '', 'error {}')
+        # Окна еще не кончились
+        self.assertEqual(throttle.flush(30), [])
+        out = throttle.flush(63)
+        self.assertEqual([x[1] for x in out], ['Last message repeated 1 times', '1 similar messages suppressed'])
+        self.assertEqual(throttle.flush(200), [])
+        throttle(201, 'MPD', 'error 3', logger.WARN, '', 'error {}')
+        throttle(202, 'MPD', 'error 4', logger.WARN, '', 'error {}')
+        self.assertEqual([x[1] for x in throttle.flush(203, True)], ['1 similar messages suppressed'])
+
+    def test_throttle_errors(self):
+        # Ошибки не подавляются лимитом, только сворачиваются повторы
+        throttle = logger._Throttle(1)
+        out = []
+        for i in range(3):
+            out += throttle(i, 'MPD', 'error {}'.format(i), logger.ERROR, '', 'error {}')
+        for i in range(3):
+            out += throttle(5, 'MPD', 'crit', logger.CRIT, '', 'crit')
+        out += throttle(6, 'MPD', 'warn 1', logger.WARN, '', 'warn {}')
+        out += throttle(7, 'MPD', 'warn 2', logger.WARN, '', 'warn {}')
+        self.assertEqual(
+            [x[1] for x in out], ['error 0', 'error 1', 'error 2', 'crit', 'Last message repeated 2 times', 'warn 1'])
+        self.assertEqual([x[1] for x in throttle.flush(200)], ['1 similar messages suppressed'])
+
+    def test_flight_line(self):
+        line = logger.Logger._to_flight(0, logger.DEBUG, 'Server', 'mod', ('got {}', 1))
+        self.assertTrue(line.endswith('.000 DEBUG Server->mod: got 1'))
+
+    def test_lazy_message_error(self):
+        class Broken:
+            def __repr__(self):
+                raise RuntimeError('broken')
+        self.assertIn('format error', logger.format_message(('{}', logger.LazyRepr(Broken()))))
+        self.assertIn('format error', logger.format_message(('{} {}', 1)))
+
+    def test_flight_snapshot(self):
+        data = {'a': 1}
+        msg = logger._flight_message(('got {}', logger.LazyRepr(data)))
+        data['b'] = 2
+        self.assertEqual(logger.format_message(msg), "got {'a': 1}")
+
+    def test_flight_before_filter(self):
+        # Самописец пишется в потоке вызывающего, ранний фильтр по min_lvl при этом работает
+        class Owner:
+            def unsubscribe(self, *_):
+                pass
+
+        log = logger.Logger({'method': 0, 'remote_log': False, 'flight_recorder': 10}, Owner())
+        try:
+            self.assertGreater(log.min_lvl, logger.CRIT)
+            try:
+                raise RuntimeError('boom')
+            except RuntimeError as e:
+                error = e
+            log._print('Server', ('failed: {}', error), logger.DEBUG)
+            log._print('Server', error, logger.DEBUG)
+            self.assertTrue(log._queue.empty())
+            records = list(log._flight)[-2:]
+            self.assertEqual(records[0][4], ('failed: {}', 'boom'))
+            self.assertEqual(records[1][4], 'boom')
+            self.assertTrue(log.flight_records()[-2].endswith('DEBUG Server: failed: boom'))
+        finally:
+            log.join()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+import wave
+
+import lib.sr_wrapper as sr
+from lib import replay
+
+
+class ReplaySource(unittest.TestCase):
+    RATE = 16000
+
+    def setUp(self):
+        self.data = os.urandom(self.RATE * 2)
+        fd, self.path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        with wave.open(self.path, 'wb') as fp:
+            fp.setnchannels(1)
+            fp.setsampwidth(2)
+            fp.setframerate(self.RATE)
+            fp.writeframes(self.data)
+
+    def tearDown(self):
+        replay.uninstall()
+        os.remove(self.path)
+
+    def _read_all(self, source):
+        result = b''
+        while True:
+            chunk = source.stream.read(source.CHUNK)
+            if not chunk:
+                return result
+            result += chunk
+
+    def test_wav_and_silence(self):
+        with replay.ReplayMicrophone([0.25, self.path], speed=0, gap=0.5) as source:
+            data = self._read_all(source)
+            self.assertEqual(source.raw.seconds, 1.75)
+        silence = b'\x00' * (self.RATE // 2)
+        self.assertEqual(data, silence + self.data + silence * 2)
+
+    def test_install(self):
+        replay.install([self.path, 0.1], speed=0, gap=0)
+        self.assertEqual(sr.Microphone().list_microphone_names(), ['replay'])
+        with sr.Microphone(device_index=0) as source:
+            self.assertEqual(self._read_all(source), self.data)
+        with sr.Microphone() as source:
+            self.assertEqual(len(self._read_all(source)), self.RATE // 10 * 2)
+        with sr.Microphone() as source:
+            self.assertEqual(self._read_all(source), b'')
+        replay.uninstall()
+        self.assertIs(sr.Microphone, replay._original)
@@ -0,0 +1,64 @@
+import math
+import struct
+import unittest
+
+from lib.audio_utils import AudioBuffer, SilenceTrimmer, trim_silence
+
+RATE = 16000
+
+
+def _speech(seconds):
+    # Тон с шумом - webrtcvad уверенно считает это речью
+    return b''.join(
+        struct.pack('<h', int(8000 * math.sin(i * 0.2) + (i * 7919 % 2000) - 1000)) for i in range(int(RATE * seconds))
+    )
+
+
+def _silence(seconds):
+    return b'\x00' * (int(RATE * seconds) * 2)
+
+
+def _frames(data, size=2048):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class SilenceTrimming(unittest.TestCase):
+    def test_trim(self):
+        speech = _speech(0.6)
+        audio = _silence(1.0) + speech + _silence(2.0) + speech + _silence(1.5)
+        result, saved = trim_silence(AudioBuffer(_frames(audio), RATE, 2), 3)
+        self.assertEqual(len(result) + saved, len(audio))
+        # Речь целиком и не больше 0.6 + 0.3 * 2 сек тишины (+ хвост VAD)
+        self.assertGreaterEqual(len(result), len(speech) * 2)
+        self.assertLess(len(result), len(speech) * 2 + len(_silence(1.5)))
+        self.assertIn(speech[:RATE], result.frame_data)
+
+    def test_no_speech(self):
+        audio = AudioBuffer([_silence(1.0)], RATE, 2)
+        result, saved = trim_silence(audio, 3)
+        self.assertIs(result, audio)
+        self.assertEqual(saved, 0)
+
+    def test_stream_no_speech(self):
+        trimmer = SilenceTrimmer(2, RATE, 3)
+        audio = _silence(1.0) + b'\x00' * 100
+        result = b''
+        for chunk in _frames(audio):
+            result += b''.join(trimmer.process(chunk))
+        self.assertEqual(result, b'')
+        result += b''.join(trimmer.end())
+        self.assertFalse(trimmer.found)
+        self.assertEqual(result, audio)
+        self.assertEqual(trimmer.saved, 0)
+
+    def test_stream(self):
+        trimmer = SilenceTrimmer(2, RATE, 3)
+        audio = _silence(1.0) + _speech(0.5) + _silence(1.0)
+        result = b''
+        for chunk in _frames(audio):
+            result += b''.join(trimmer.process(chunk))
+        result += b''.join(trimmer.end())
+        self.assertTrue(trimmer.found)
+        self.assertEqual(trimmer.input_bytes, len(audio))
+        self.assertEqual(trimmer.output_bytes, len(result))
+        self.assertGreater(trimmer.saved, len(_silence(1.0)))
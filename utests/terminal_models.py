@@ -0,0 +1,78 @@
+import threading
+import unittest
+
+from terminal import MDTerminal
+
+
+class _Cfg(dict):
+    def __init__(self):
+        super().__init__(models={}, persons={})
+        self.path = {'models_list': ['model1.pmdl']}
+        self.saved = 0
+
+    def update_from_dict(self, data: dict):
+        for key, value in data.items():
+            self[key].update(value)
+        self.saved += 1
+
+    def models_load(self):
+        self.path['models_list'] = sorted(set(self.path['models_list']) | set(self['models']))
+
+
+class _Snowboy:
+    # Слушает пока не прервут или не закончатся итерации, как listen() в SnowBoySR
+    def __init__(self, interrupt_check, hot_reload=True):
+        self._interrupt_check = interrupt_check
+        self.hot_reload = hot_reload
+        self.reloads = 0
+        self.interrupted = False
+        self.listening = threading.Event()
+        self.saved = threading.Event()
+
+    def start(self, iterations=200):
+        self.listening.set()
+        for _ in range(iterations):
+            if self._interrupt_check():
+                self.interrupted = True
+                return
+            self.saved.wait(0.01)
+
+    def models_reload(self) -> bool:
+        self.reloads += 1
+        return self.hot_reload
+
+
+class TerminalModelsReload(unittest.TestCase):
+    def _terminal(self, hot_reload):
+        terminal = MDTerminal(_Cfg(), lambda *_: None, None)
+        terminal._work = True
+        terminal._snowboy = _Snowboy(terminal._interrupt_callback, hot_reload)
+        return terminal
+
+    def _listen_and_save(self, terminal):
+        snowboy = terminal._snowboy
+        listen = threading.Thread(target=snowboy.start)
+        listen.start()
+        snowboy.listening.wait(1)
+        # Так модель сохраняет TerminalWorker после обучения или получения от сервера
+        terminal._model_saved('model2.pmdl', 'user', 'hello')
+        snowboy.saved.set()
+        listen.join(5)
+        return snowboy
+
+    def test_reload_keeps_listening(self):
+        terminal = self._terminal(True)
+        snowboy = self._listen_and_save(terminal)
+        self.assertFalse(snowboy.interrupted)
+        self.assertEqual(snowboy.reloads, 1)
+        self.assertEqual(terminal._cfg['models'], {'model2.pmdl': 'hello'})
+        self.assertEqual(terminal._cfg['persons'], {'model2.pmdl': 'user'})
+        self.assertIn('model2.pmdl', terminal._cfg.path['models_list'])
+        self.assertEqual(terminal._queue.qsize(), 0)
+
+    def test_reload_needs_restart(self):
+        # Детектор без горячей подмены пересоздается, тут прерывание нужно
+        terminal = self._terminal(False)
+        snowboy = self._listen_and_save(terminal)
+        self.assertTrue(snowboy.interrupted)
+        self.assertEqual(terminal._queue.get_nowait()[0], 'reload')